@@ -6,12 +6,19 @@ import csv
 # local imports
 from app.db import get_db
 from util import secrets
+from util.ascache import ResponseCache, CachingClient
+from util.aspager import get_pages
+
+# minimum time between checks for records modified in ArchivesSpace (seconds)
+cache_refresh_interval = 300
 
 # ArchivesSpace API authentication
+# single record requests are read from the response cache shared with buildxml.py
 from asnake.client import ASnakeClient
-client = ASnakeClient(baseurl = secrets.baseurl,
-                        username = secrets.username,
-                        password = secrets.password)
+client = CachingClient(ASnakeClient(baseurl = secrets.baseurl,
+                                    username = secrets.username,
+                                    password = secrets.password),
+                       ResponseCache(Path(Path(__file__).resolve().parent).joinpath('../instance/ascache.db')))
 
 def csv_gen(filename, fieldnames, category):
 
@@ -21,7 +28,7 @@ def csv_gen(filename, fieldnames, category):
     with open(Path(Path(__file__).resolve().parent).joinpath(filename), 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-        for obj in client.get_paged('/repositories/2/'+category):
+        for obj in get_pages(client, '/repositories/2/'+category):
             writer.writerow({fieldname: obj.get(fieldname)for fieldname in fieldnames})
             rec_count += 1
 
@@ -34,6 +41,7 @@ def get_notes(id):
     description = ''
 
     client.authorize()
+    client.refresh(cache_refresh_interval)
 
     uri = '/repositories/2/resources/'+id
     collection = client.get(uri)
@@ -88,13 +96,14 @@ def write_last_update(fn):
 def get_ids(category):
     client.authorize()
     id_list = list()
-    for obj in client.get_paged('/repositories/2/'+category):
+    for obj in get_pages(client, '/repositories/2/'+category):
         id = obj['uri'][obj['uri'].rfind('/')+1: ]
         id_list.append((id, obj['uri']))
     return id_list
 
 def get_json(category, id, ancestors, digital_object, linked_agents, repository, subjects, top_container):
     client.authorize()
+    client.refresh(cache_refresh_interval)
     uri = '/repositories/2/'+category+'/'+id
     begin = True
     if ancestors:
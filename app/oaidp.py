@@ -11,12 +11,13 @@ from util import defaults
 
 # other imports
 from flask import Blueprint, request, Response, render_template, send_file, g
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import xml.etree.ElementTree as ET
 import xml.dom.minidom as dom
 from pathlib import Path
-import json, subprocess
+from bisect import bisect_left, bisect_right
+import json, re, subprocess, threading, time
 
 # max number of records to return
 maxrecs = defaults.maxrecs
@@ -28,6 +29,9 @@ idbase = defaults.idbase
 pub_url = defaults.pub_url
 # collection base
 cbase = defaults.cbase
+# expected lifetime of a resumption token, given as its expirationDate
+# tokens remain valid until the static repository is rebuilt
+token_lifetime = timedelta(hours=24)
 
 bp = Blueprint('oaidp', __name__)
 
@@ -43,18 +47,188 @@ ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
 ET.register_namespace('oai_dc', 'http://www.openarchives.org/OAI/2.0/oai_dc/')
 ET.register_namespace('dc', 'http://purl.org/dc/elements/1.1/')
 
-# read static repository file
-tree = ET.parse(Path(Path(__file__).resolve().parent).joinpath('../xml/staticrepo.xml'))
-root = tree.getroot()
-
-ids = list()
-for node in root.findall('.//record/header/identifier', ns):
+# namespace declarations in a serialized element, e.g. ' xmlns:dc="http://purl.org/dc/elements/1.1/"'
+xmlns_pattern = re.compile(rb' xmlns(?::([\w.-]+))?="([^"]*)"')
+
+# returns an element serialized without the namespace declarations of its start tag, 
+# and the declarations as a dictionary {prefix: uri}
+# the declarations are made once, in the OAI-PMH element of the response (see oai_response())
+def serialize_part(elem):
+    data = ET.tostring(elem)
+    end = data.index(b'>')
+    namespaces = {(prefix or b''): uri for prefix, uri in xmlns_pattern.findall(data[:end])}
+    return xmlns_pattern.sub(b'', data[:end]) + data[end:], namespaces
+
+# returns the serialized forms of a record in responses: 
+# header only (ListIdentifiers), and header and metadata (ListRecords, GetRecord)
+# and the namespace declarations they need
+# the indentation of the record, header, metadata and oai_dc:dc elements is removed (in place)
+def serialize_record(recrd):
+    recrd.text = recrd.tail = None
+    for elem in [recrd.find('./header', ns), recrd.find('./metadata', ns), recrd.find('./metadata/oai_dc:dc', ns)]:
+        if elem is not None:
+            elem.text = elem.tail = None
+    record_bytes, namespaces = serialize_part(recrd)
+    header_end = record_bytes.index(b'</header>') + len(b'</header>')
+    return record_bytes[:header_end] + b'</record>', record_bytes, namespaces
+
+# static repository file
+staticrepo_path = Path(Path(__file__).resolve().parent).joinpath('../xml/staticrepo.xml')
+
+# minimum time between checks for a new version of the static repository (seconds)
+reload_interval = 60
+
+# maximum number of record lists in the list_cache of a snapshot
+list_cache_size = 64
+
+# static repository loaded for serving requests, with its indexes
+# a new Snapshot is built when staticrepo.xml is rewritten (see current_snapshot()); 
+# each request uses the snapshot it started with
+class Snapshot:
+
+    def __init__(self, path):
+
+        # id of this version of the static repository, from its modification time
+        # resumption tokens carry the id, so tokens issued for a previous version are refused
+        # the time is read before the file, so a file replaced while it is read is loaded again
+        self.mtime = path.stat().st_mtime_ns
+        self.snapshot_id = format(self.mtime, 'x')
+
+        self.tree = ET.parse(path)
+        self.root = self.tree.getroot()
+
+        # metadata prefix of the records in the static repository
+        self.metadata_prefix = self.root.find('./ListRecords', ns).attrib['metadataPrefix']
+
+        # index of records by OAI identifier: {identifier: (datestamp, [setSpec], header bytes, record bytes)}
+        # used by GetRecord, ListMetadataFormats and /search instead of searching the tree on each request
+        # records are serialized once (see serialize_record()), and responses are assembled from the bytes
+        self.records_index = dict()
+
+        # records for ListRecords/ListIdentifiers by set, with digital_object_type_filter applied
+        # {setSpec: [entry]}, entries as in records_index; all records are listed under 'x_000' (no set requested)
+        # each list is sorted by datestamp, records with the same datestamp in repository order
+        self.set_lists = {'x_000': list()}
+
+        # namespace declarations needed by serialized records: {prefix: uri}
+        record_namespaces = dict()
+
+        for record in self.root.findall('./ListRecords/record', ns):
+            sets_list = [setnode.text for setnode in record.findall('./header/setSpec', ns)]
+            header_bytes, record_bytes, namespaces = serialize_record(record)
+            record_namespaces.update(namespaces)
+            entry = (record.find('./header/datestamp', ns).text, sets_list, header_bytes, record_bytes)
+            self.records_index[record.find('./header/identifier', ns).text] = entry
+            type_node = record.find('./metadata/oai_dc:dc/dc:type', ns)
+            if type_node is None or type_node.text not in digital_object_type_filter:
+                continue
+            self.set_lists['x_000'].append(entry)
+            for setspec in sets_list:
+                self.set_lists.setdefault(setspec, list()).append(entry)
+        for setspec in self.set_lists:
+            self.set_lists[setspec].sort(key=lambda entry: entry[0])
+
+        # record elements are no longer needed once serialized
+        self.root.find('./ListRecords', ns).clear()
+
+        # namespace declarations of the OAI-PMH element of responses with records, sorted by prefix
+        # (the default namespace is always declared, see oai_response())
+        self.record_xmlns = b''.join(b' xmlns:' + prefix + b'="' + uri + b'"' 
+                                     for prefix, uri in sorted(record_namespaces.items()) if prefix)
+
+        # record lists filtered by included sets, by (set, included sets), or (set, None) for authenticated users
+        # see list_records()
+        self.list_cache = dict()
+
+        # archival object ids of the records, sorted, for /browse
+        ids = list()
+        for identifier in self.records_index:
+            try:
+                id = int(identifier[65:])
+                ids.append(id)
+            except:
+                pass
+        self.ids = [str(id) for id in sorted(ids)]
+
+    # returns the records of a set ('x_000' for all records) that can be harvested, sorted by datestamp:
+    # records in included (i.e. active) sets, or all records if the user is authenticated
+    # returns tuple of lists ([datestamp], [entry]), for bisecting by datestamp (entries as in records_index)
+    # lists are built once for each set and included sets, and kept in list_cache
+    def list_records(self, set_request, included_sets, authenticated):
+
+        key = (set_request, None if authenticated else frozenset(included_sets))
+        lists = self.list_cache.get(key)
+
+        if lists is None:
+            entries = self.set_lists.get(set_request, [])
+            if not authenticated:
+                included = set(included_sets)
+                entries = [entry for entry in entries if included.intersection(entry[1])]
+            lists = ([entry[0] for entry in entries], entries)
+            if len(self.list_cache) >= list_cache_size:
+                self.list_cache.clear()
+            self.list_cache[key] = lists
+
+        return lists
+
+# current snapshot of the static repository
+snapshot = Snapshot(staticrepo_path)
+
+# state of reloading: time of the last check, the thread loading a new snapshot, 
+# and the modification time of a file that could not be loaded (not tried again)
+reload_lock = threading.Lock()
+reload_checked = time.monotonic()
+reload_thread = None
+reload_failed = None
+
+# loads a new snapshot of the static repository and replaces the current snapshot
+# runs in a background thread, so requests are served from the current snapshot while it loads
+def reload_snapshot():
+    global snapshot, reload_failed
     try:
-        id = int(node.text[65:])
-        ids.append(id)
-    except:
-        pass
-ids = [str(id) for id in sorted(ids)]
+        new_snapshot = Snapshot(staticrepo_path)
+    except Exception as e:
+        reload_failed = staticrepo_path.stat().st_mtime_ns if staticrepo_path.exists() else None
+        print('Static repository could not be reloaded:', e)
+        return
+    # requests that already have the previous snapshot continue to use it
+    snapshot = new_snapshot
+    print('Static repository reloaded:', len(new_snapshot.records_index), 'records')
+
+# returns the current snapshot of the static repository
+# at most once every reload_interval seconds, checks the modification time of staticrepo.xml
+# and, if the file has been rewritten, starts loading it in a background thread (reload_snapshot())
+def current_snapshot():
+    global reload_checked, reload_thread
+    current = snapshot
+    if time.monotonic() - reload_checked < reload_interval:
+        return current
+    with reload_lock:
+        if time.monotonic() - reload_checked >= reload_interval and \
+           (reload_thread is None or not reload_thread.is_alive()):
+            reload_checked = time.monotonic()
+            try:
+                mtime = staticrepo_path.stat().st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != current.mtime and mtime != reload_failed:
+                reload_thread = threading.Thread(target=reload_snapshot, daemon=True)
+                reload_thread.start()
+    return current
+
+# returns an OAI-PMH response (bytes) assembled from serialized parts: the responseDate, the request 
+# element (with attributes request_attrib) and the parts (serialized records and resumption token)
+# in an element named verb_element
+# xmlns is added to the namespace declarations of the OAI-PMH element (record_xmlns if there are records)
+def oai_response(verb_element, request_attrib, parts, xmlns=b''):
+    respDate = ET.Element('responseDate')
+    respDate.text = datetime.now().isoformat().split('.')[0]
+    rquest = ET.Element('request', request_attrib)
+    rquest.text = dpurl
+    verb_element = verb_element.encode()
+    return b''.join([b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"', xmlns, b'>',
+                     ET.tostring(respDate), ET.tostring(rquest), b'<', verb_element, b'>'] + 
+                    parts + [b'</', verb_element, b'></OAI-PMH>'])
 
 # returns a pretty-printed XML string
 def prettify(elem):
@@ -73,6 +247,7 @@ def build():
 def browse(page_number):
     page_number=int(page_number)
     page_size=1000
+    ids=current_snapshot().ids
     items_total=len(ids)
     pages_total=(items_total+page_size-1)//page_size
     ids_display=ids[(page_number-1)*page_size:page_number*page_size]
@@ -89,8 +264,7 @@ def browse(page_number):
 @bp.route('/search', methods=('GET', 'POST'))
 def search():
     if request.method == 'POST':
-        ids = [id.text[65:] for id in root.findall('.//record/header/identifier', ns)]
-        if request.form['id'] in ids:
+        if idbase + request.form['id'] in current_snapshot().records_index:
             id = request.form['id']
         else:
             id = "id not found"
@@ -403,7 +577,7 @@ def update():
 @bp.route('/search2')
 def search2():
     try:
-        ids = [root.find('.//record/header/identifier', ns)]
+        ids = [current_snapshot().root.find('.//record/header/identifier', ns)]
     except:
         ids = ['']
     return render_template("browse.html")
@@ -420,6 +594,9 @@ def log(rq):
 @bp.route('/oai')
 def oai():
 
+    # static repository for this request; a new version loaded during the request is not used
+    snap = current_snapshot()
+
     # list of collections to include
     db = get_db()
     query = "SELECT typ, collno FROM collections WHERE incl;"
@@ -435,8 +612,8 @@ def oai():
     verb = request.args.get('verb')
     identifier = request.args.get('identifier')
  
-    # resumption token flag
-    rToken = False
+    # invalid resumption token flag
+    badToken = False
 
     if request.args.get('resumptionToken'):
 
@@ -444,11 +621,18 @@ def oai():
         first = False
 
         # get resumptionToken from request and decode
+        # resumptionToken has the form snapshot:set:from:until:cursor
+        # cursor is the position in the list of records of the set in the date range (see list_records())
         resumptionToken = request.args.get('resumptionToken').split(':')
-        set_request = resumptionToken[0]
-        datefrom = resumptionToken[1]
-        dateuntil = resumptionToken[2]
-        startrec = int(resumptionToken[3])
+        if len(resumptionToken) == 5 and resumptionToken[0] == snap.snapshot_id and resumptionToken[4].isdigit():
+            set_request = resumptionToken[1]
+            datefrom = resumptionToken[2]
+            dateuntil = resumptionToken[3]
+            startrec = int(resumptionToken[4])
+        else:
+            # malformed, or issued for a previous version of the static repository
+            badToken = True
+            set_request, datefrom, dateuntil, startrec = 'x_000', '000-00-00', '999-99-99', 0
 
     else:
 
@@ -481,7 +665,7 @@ def oai():
 
     if verb == 'Identify':
 
-        elem = root.find('.//Identify', ns)
+        elem = snap.root.find('.//Identify', ns)
         # create OAI-PMH XML object
         oaixml = ET.Element('OAI-PMH')
         respDate = ET.SubElement(oaixml, 'responseDate')
@@ -496,7 +680,7 @@ def oai():
 
     elif verb == 'ListMetadataFormats':
 
-        elem = root.find('.//ListMetadataFormats', ns)
+        elem = snap.root.find('.//ListMetadataFormats', ns)
         # create OAI-PMH XML object
         oaixml = ET.Element('OAI-PMH')
         respDate = ET.SubElement(oaixml, 'responseDate')
@@ -515,16 +699,14 @@ def oai():
         else:
 
             rquest.attrib = {'verb': 'ListMetadataFormats', 'identifier': identifier}
-            nodes = root.findall(f'.//identifier[.="{identifier}"]/../../..[@metadataPrefix]', ns)
-            for node in nodes:
-                prefix = node.attrib['metadataPrefix']
-                mf = root.find(f'.//ListMetadataFormats/metadataFormat/metadataPrefix[.="{prefix}"]/..', ns)
+            if identifier in snap.records_index:
+                mf = snap.root.find(f'.//ListMetadataFormats/metadataFormat/metadataPrefix[.="{snap.metadata_prefix}"]/..', ns)
                 listmetadataformats.append(mf)
                 count += 1
 
     elif verb == 'ListSets':
 
-        elem = root.find('.//ListSets', ns)
+        elem = snap.root.find('.//ListSets', ns)
         # create OAI-PMH XML object
         oaixml = ET.Element('OAI-PMH')
         respDate = ET.SubElement(oaixml, 'responseDate')
@@ -538,72 +720,50 @@ def oai():
                 listsets.append(node)
                 count = 1
 
-    elif verb == 'ListRecords' or verb == 'ListIdentifiers':
+    elif (verb == 'ListRecords' or verb == 'ListIdentifiers') and badToken:
 
-        elem = root.find('./ListRecords', ns)
         # create OAI-PMH XML object
         oaixml = ET.Element('OAI-PMH')
         respDate = ET.SubElement(oaixml, 'responseDate')
         respDate.text = datetime.now().isoformat().split('.')[0]
         rquest = ET.SubElement(oaixml, 'request')
-        rquest.attrib = {'verb': 'ListRecords',
-                         'metadataPrefix': 'oai_dc'
-                        }
+        rquest.attrib = {'verb': verb}
         rquest.text = dpurl
-        listrecords = ET.SubElement(oaixml, 'ListRecords')
-        recrds = elem.findall('./{http://www.openarchives.org/OAI/2.0/}record')
-
-        for recrd in recrds:
-
-            # test for valid Type
-            if recrd.find('./metadata/oai_dc:dc/dc:type', ns).text not in digital_object_type_filter:
-                continue
-
-            # get list of sets for record
-            sets_list = [setnode.text for setnode in recrd.findall('./header/setSpec', ns)]
-
-            # check 
-            # - if record is in requested set, or no set specified (x_000)
-            # - and if record is in included (i.e. active) sets, or user is authenticated
-            if (set_request in sets_list or set_request == 'x_000') \
-                    and (len(set(sets_list).intersection(set(included_sets))) > 0 \
-                or g.user):
-
-                # check if record is within date range requested
-                if recrd.find('./header/datestamp', ns).text >= datefrom and \
-                   recrd.find('./header/datestamp', ns).text <= dateuntil:
-
-                    cursor += 1
-
-                    if (cursor > startrec) and (cursor <= startrec + maxrecs):
-
-                        count += 1
-
-                        record = ET.SubElement(listrecords, '{http://www.openarchives.org/OAI/2.0/}record')
-                        header = ET.SubElement(record, '{http://www.openarchives.org/OAI/2.0/}header')
-                        hdr = recrd.find('.//{http://www.openarchives.org/OAI/2.0/}header')
-                        for node in hdr:
-                            header.append(node)
-
-                        if verb == 'ListRecords':
-
-                            metadata = ET.SubElement(record, '{http://www.openarchives.org/OAI/2.0/}metadata')
-                            dc = ET.SubElement(metadata, '{http://www.openarchives.org/OAI/2.0/oai_dc/}dc')
-                            metad = recrd.find('.//{http://www.openarchives.org/OAI/2.0/oai_dc/}dc')
-                            for node in metad:
-                                dc.append(node)
-
-                    if cursor >= startrec + maxrecs:
-                        resumptionToken = ET.SubElement(listrecords, '{http://www.openarchives.org/OAI/2.0/}resumptionToken')
-                        resumptionToken.attrib = {'cursor': str(cursor)}
-                        resumptionToken.text = f'{set_request}:{datefrom}:{dateuntil}:{cursor}'
-                        rToken = True
-                        break
+        error = ET.SubElement(oaixml, 'error')
+        error.attrib = {'code': 'badResumptionToken'}
+        error.text = 'The resumption token is invalid or has expired.'
 
+    elif verb == 'ListRecords' or verb == 'ListIdentifiers':
 
-        if not rToken and not first:
-            resumptionToken = ET.SubElement(listrecords, '{http://www.openarchives.org/OAI/2.0/}resumptionToken')
-            resumptionToken.attrib = {'cursor': str(cursor)}
+        # records in requested set (or all records if no set specified, x_000), 
+        # in included (i.e. active) sets or user is authenticated, sorted by datestamp
+        datestamps, entries = snap.list_records(set_request, included_sets, bool(g.user))
+
+        # records within date range requested
+        lo = bisect_left(datestamps, datefrom)
+        hi = bisect_right(datestamps, dateuntil)
+
+        # serialized records on this page: header only (ListIdentifiers), or header and metadata (ListRecords)
+        part = 3 if verb == 'ListRecords' else 2
+        parts = [entry[part] for entry in entries[lo + startrec : min(lo + startrec + maxrecs, hi)]]
+
+        # number of records in date range, and position after this page
+        completeListSize = max(hi - lo, 0)
+        cursor = min(startrec + maxrecs, completeListSize)
+
+        # resumption token if there are more records, or empty token on the last page
+        if cursor < completeListSize or not first:
+            resumptionToken = ET.Element('resumptionToken')
+            resumptionToken.attrib = {'cursor': str(cursor), 'completeListSize': str(completeListSize)}
+            if cursor < completeListSize:
+                expirationDate = datetime.now(timezone.utc) + token_lifetime
+                resumptionToken.attrib['expirationDate'] = expirationDate.strftime('%Y-%m-%dT%H:%M:%SZ')
+                resumptionToken.text = f'{snap.snapshot_id}:{set_request}:{datefrom}:{dateuntil}:{cursor}'
+            parts.append(ET.tostring(resumptionToken))
+
+        return Response(oai_response('ListRecords', {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}, parts,
+                                     snap.record_xmlns if verb == 'ListRecords' and completeListSize else b''),
+                        mimetype='text/xml')
                                   
 
     elif verb == 'GetRecord':
@@ -612,21 +772,16 @@ def oai():
             oaixml = ET.Element('noThing',)
             oaixml.text = "No identifier specified."
         else:
-            # create OAI-PMH XML object
-            oaixml = ET.Element('OAI-PMH')
-            respDate = ET.SubElement(oaixml, 'responseDate')
-            respDate.text = datetime.now().isoformat().split('.')[0]
-            rquest = ET.SubElement(oaixml, 'request')
-            rquest.attrib = {'verb': 'GetRecord', 'identifier': identifier, 'metaDataPrefix': 'oai_dc'}
-            rquest.text = dpurl
-            getrecord = ET.SubElement(oaixml, 'GetRecord')
-            if root.find('./ListRecords/record/header/setSpec', ns).text in included_sets:
-                try:
-                    record = root.find(f'.//identifier[.="{identifier}"]/../../.', ns)
-                    getrecord.append(record)
-                    count += 1
-                except:
-                    pass
+            # serialized record, if it is in an included (i.e. active) set, or user is authenticated
+            parts = list()
+            entry = snap.records_index.get(identifier)
+            if entry is not None:
+                if len(set(entry[1]).intersection(set(included_sets))) > 0 or g.user:
+                    parts.append(entry[3])
+            return Response(oai_response('GetRecord', 
+                                         {'verb': 'GetRecord', 'identifier': identifier, 'metaDataPrefix': 'oai_dc'},
+                                         parts, snap.record_xmlns if parts else b''),
+                            mimetype='text/xml')
             
     else:
 
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+#
+# ascache.py
+#
+# Persistent on-disk cache of ArchivesSpace API responses
+# Used by buildxml.py and app/aspace.py
+# Responses are stored in an SQLite3 database, instance/ascache.db
+# Tables:
+#   responses - record JSON keyed by URI plus resolve[] parameters
+#   refs - URIs of the record and of the resolved records embedded in each response
+#   meta - time of the last check for modified records
+#
+# Only records (responses with a lock_version) are cached. Entries are validated by:
+#   - asking ArchivesSpace for records modified since the last check (modified_since, 
+#     i.e. system_mtime), which removes every entry that contains a modified record, 
+#     including resolved records embedded in other records (refresh)
+#   - a maximum age, as a safety net for changes that are not detected
+# The cache has a size cap; least recently used entries are removed first.
+
+import json
+import time
+import zlib
+import sqlite3 as sq
+import threading
+from urllib.parse import urlsplit, parse_qsl
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default size cap of the cache (bytes, compressed)
+default_max_bytes = 1024 * 1024 * 1024
+
+# default maximum age of an entry (seconds)
+default_max_age = 7 * 24 * 60 * 60
+
+# API paths checked for records modified since the last check
+modified_paths = ['/repositories/2/archival_objects',
+                  '/repositories/2/digital_objects',
+                  '/repositories/2/resources',
+                  '/repositories/2/accessions',
+                  '/repositories/2/top_containers',
+                  '/subjects',
+                  '/agents/people',
+                  '/agents/corporate_entities',
+                  '/agents/families',
+                  '/agents/software']
+
+# margin for clock differences between this server and ArchivesSpace (seconds)
+refresh_margin = 300
+
+# number of new entries between checks of the size cap
+evict_interval = 100
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   cache_key(uri, params)                      returns cache key for a request, or None if the
+#                                               request cannot be cached
+#
+#   resolved_refs(obj)                          returns set of URIs of resolved records in obj
+#
+#   CachedResponse(text)                        response-like object returned for cache hits
+#
+#   ResponseCache(path, max_bytes, max_age)     SQLite-backed response cache
+#
+#   CachingClient(client, cache)                wraps an ASnakeClient so single record requests
+#                                               are read from and written to the cache
+#-----------------------------------------------------------------------#
+
+# returns cache key for a request: the path plus sorted resolve[] parameters
+# returns None if the request has any other parameters (paged lists, id_set, etc.)
+def cache_key(uri, params=None):
+
+    parts = urlsplit(uri)
+    query = parse_qsl(parts.query)
+
+    if params:
+        for k, v in params.items():
+            if isinstance(v, (list, tuple)):
+                query.extend((k, value) for value in v)
+            else:
+                query.append((k, v))
+
+    resolve = list()
+    for k, v in query:
+        if k in ('resolve[]', 'resolve'):
+            resolve.append(v)
+        else:
+            return None
+
+    key = '/' + parts.path.lstrip('/')
+    if resolve:
+        key += '?' + '&'.join('resolve[]=' + r for r in sorted(set(resolve)))
+
+    return key
+
+
+#-----------------------------------------------------------------------#
+
+# returns set of URIs of resolved records in obj (ancestors, linked agents, subjects, etc.)
+def resolved_refs(obj):
+
+    refs = set()
+
+    if isinstance(obj, dict):
+        if obj.get('_resolved') and obj.get('ref'):
+            refs.add(obj['ref'])
+        for value in obj.values():
+            refs.update(resolved_refs(value))
+
+    elif isinstance(obj, list):
+        for value in obj:
+            refs.update(resolved_refs(value))
+
+    return refs
+
+
+#-----------------------------------------------------------------------#
+
+# response-like object returned for cache hits
+# supports the parts of requests.Response used with ASnakeClient.get()
+class CachedResponse:
+
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+#-----------------------------------------------------------------------#
+
+# SQLite-backed response cache
+# safe to share between threads
+class ResponseCache:
+
+    def __init__(self, path, max_bytes=default_max_bytes, max_age=default_max_age):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    # open database connection on first use
+    def _connect(self):
+
+        if self._connection is None:
+            self._connection = sq.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL;')
+            self._connection.execute('PRAGMA synchronous=NORMAL;')
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB,
+                    size INTEGER,
+                    lock_version INTEGER,
+                    system_mtime TEXT,
+                    stored REAL,
+                    accessed REAL);
+                CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+                CREATE TABLE IF NOT EXISTS refs (
+                    key TEXT,
+                    ref TEXT);
+                CREATE INDEX IF NOT EXISTS refs_ref ON refs (ref);
+                CREATE INDEX IF NOT EXISTS refs_key ON refs (key);
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT);''')
+            self._connection.commit()
+
+        return self._connection
+
+    # returns JSON text for key, or None if not cached or too old
+    def get(self, key):
+
+        with self._lock:
+
+            db = self._connect()
+            row = db.execute('SELECT body, stored FROM responses WHERE key=?;', [key]).fetchone()
+
+            if row is None or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+
+            db.execute('UPDATE responses SET accessed=? WHERE key=?;', [time.time(), key])
+            db.commit()
+            self.hits += 1
+
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    # stores JSON text of a record under key
+    # returns False if the response is not a record
+    def put(self, key, text):
+
+        obj = json.loads(text)
+        if not isinstance(obj, dict) or 'lock_version' not in obj:
+            return False
+
+        body = zlib.compress(text.encode('utf-8'))
+        refs = resolved_refs(obj)
+        refs.add(obj.get('uri', key.split('?')[0]))
+        now = time.time()
+
+        with self._lock:
+
+            db = self._connect()
+            db.execute('DELETE FROM refs WHERE key=?;', [key])
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?);',
+                       [key, body, len(body), obj['lock_version'], obj.get('system_mtime'), now, now])
+            db.executemany('INSERT INTO refs VALUES (?,?);', [(key, ref) for ref in refs])
+            db.commit()
+
+            self._puts += 1
+            if self._puts % evict_interval == 0:
+                self._evict()
+
+        return True
+
+    # removes entries for records in uris, and entries with resolved copies of them
+    def invalidate(self, uris):
+
+        uris = list(uris)
+
+        with self._lock:
+
+            db = self._connect()
+
+            # in chunks, to stay under the SQLite limit on query parameters
+            for i in range(0, len(uris), 500):
+                chunk = uris[i:i+500]
+                marks = ','.join('?' * len(chunk))
+                keys = [row[0] for row in db.execute(f'SELECT DISTINCT key FROM refs WHERE ref IN ({marks});', chunk)]
+                db.executemany('DELETE FROM responses WHERE key=?;', [(key,) for key in keys])
+                db.executemany('DELETE FROM refs WHERE key=?;', [(key,) for key in keys])
+
+            db.commit()
+
+        return
+
+    # removes entries for records modified in ArchivesSpace since the last check
+    # client is an (uncached) ASnakeClient
+    # the check is skipped if the last check was less than min_interval seconds ago
+    def refresh(self, client, min_interval=0):
+
+        now = time.time()
+
+        with self._lock:
+            row = self._connect().execute('SELECT value FROM meta WHERE name=?;', ['checked']).fetchone()
+        checked = float(row[0]) if row else None
+
+        if checked is not None and now - checked < min_interval:
+            return
+
+        # an empty cache has nothing to check
+        if checked is not None:
+            modified_since = int(checked - refresh_margin)
+            modified = set()
+            for path in modified_paths:
+                ids = client.get(path, params={'all_ids': 'true', 'modified_since': modified_since}).json()
+                if isinstance(ids, list):
+                    modified.update(path + '/' + str(id) for id in ids)
+            self.invalidate(modified)
+
+        with self._lock:
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?,?);', ['checked', str(now)])
+            db.commit()
+
+        return
+
+    # removes least recently used entries until the cache is under max_bytes
+    # called with self._lock held
+    def _evict(self):
+
+        db = self._connect()
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses;').fetchone()[0]
+
+        if total <= self.max_bytes:
+            return
+
+        # remove down to 90% of the cap, so eviction is not repeated on every check
+        excess = total - int(self.max_bytes * 0.9)
+        keys = list()
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed;'):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        db.executemany('DELETE FROM responses WHERE key=?;', keys)
+        db.executemany('DELETE FROM refs WHERE key=?;', keys)
+        db.commit()
+
+        return
+
+    def close(self):
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+        return
+
+
+#-----------------------------------------------------------------------#
+
+# wraps an ASnakeClient so single record requests (with optional resolve[] parameters)
+# are read from and written to the cache
+# all other requests and methods (authorize, get_paged, post, etc.) are passed to the client
+class CachingClient:
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get(self, uri, *args, **kwargs):
+
+        key = cache_key(uri, kwargs.get('params')) if not args else None
+
+        if key is None:
+            return self.client.get(uri, *args, **kwargs)
+
+        text = self.cache.get(key)
+        if text is not None:
+            return CachedResponse(text)
+
+        response = self.client.get(uri, *args, **kwargs)
+
+        if response.status_code == 200:
+            self.cache.put(key, response.text)
+
+        return response
+
+    # removes entries for records modified since the last check
+    def refresh(self, min_interval=0):
+        self.cache.refresh(self.client, min_interval)
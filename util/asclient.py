@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# asclient.py
+#
+# Asynchronous ArchivesSpace API client, an alternative backend to ASnakeClient
+# Used by buildxml.py (--backend async)
+#
+# All requests share one pooled keep-alive HTTP session (aiohttp) running on an
+# asyncio event loop in a background thread. The number of requests in flight is
+# limited by concurrency, however many threads are making requests.
+# The session token is shared: when a request is refused because the token has
+# expired, the client logs in once and the waiting requests are retried with the new token.
+#
+# AsyncClient has the same get(), get_paged() and authorize() methods as ASnakeClient,
+# so it can be used (and wrapped by ascache.CachingClient) in the same way.
+# Coroutines (AsyncEngine.get(), AsyncEngine.get_many()) can be used directly with AsyncClient.run().
+
+import json
+import time
+import asyncio
+import threading
+
+# aiohttp is only needed for the async backend
+import aiohttp
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default maximum number of requests in flight
+default_concurrency = 10
+
+# default request timeout (seconds)
+default_timeout = 300
+
+# seconds an idle connection is kept open
+keepalive_timeout = 60
+
+# HTTP status codes returned by ArchivesSpace when the session token has expired
+reauthorize_status = [403, 412]
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   query_params(params)                        converts a params dictionary to a list of (key, value)
+#                                               pairs, with one pair per value of list parameters
+#
+#   AsyncResponse(status_code, text)            response returned by get(), like requests.Response
+#
+#   AsyncEngine(baseurl, username, password, concurrency, timeout)
+#                                               asyncio client: pooled session, concurrency limit,
+#                                               shared session token
+#
+#   AsyncClient(baseurl, username, password, concurrency, timeout)
+#                                               synchronous interface to AsyncEngine, with the
+#                                               ASnakeClient methods used by buildxml.py
+#-----------------------------------------------------------------------#
+
+# converts a params dictionary to a list of (key, value) pairs
+# list values, e.g. {'id_set[]': [1, 2]}, give one pair per value, as with requests
+def query_params(params):
+
+    pairs = list()
+
+    for key, value in (params or {}).items():
+        if isinstance(value, (list, tuple)):
+            pairs.extend((key, str(v)) for v in value)
+        elif isinstance(value, bool):
+            pairs.append((key, 'true' if value else 'false'))
+        elif value is not None:
+            pairs.append((key, str(value)))
+
+    return pairs
+
+
+#-----------------------------------------------------------------------#
+
+# response returned by get()
+# supports the parts of requests.Response used with ASnakeClient.get()
+class AsyncResponse:
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+#-----------------------------------------------------------------------#
+
+# asyncio ArchivesSpace client
+# all methods are coroutines and must run on the same event loop
+class AsyncEngine:
+
+    def __init__(self, baseurl, username, password, concurrency=default_concurrency, timeout=default_timeout):
+
+        self.baseurl = baseurl.rstrip('/')
+        self.username = username
+        self.password = password
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.token = None
+        self.requests = 0
+        # functions called for each response: hook(url, status, seconds, size)
+        self.response_hooks = list()
+        self._session = None
+        self._semaphore = None
+        self._auth_lock = None
+
+    # open session on first use (must be called on the event loop)
+    def _connect(self):
+
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._auth_lock = asyncio.Lock()
+
+        return self._session
+
+    def _url(self, uri):
+        return self.baseurl + '/' + uri.lstrip('/')
+
+    # logs in and stores the session token
+    # expired is the token that was refused; if another request has already logged in
+    # since then, the new token is used instead of logging in again
+    async def authorize(self, expired=None):
+
+        session = self._connect()
+
+        async with self._auth_lock:
+
+            if self.token is not None and self.token != expired:
+                return self.token
+
+            async with session.post(self._url('users/' + self.username + '/login'),
+                                    params={'password': self.password, 'expiring': 'false'}) as response:
+                response.raise_for_status()
+                self.token = (await response.json(content_type=None))['session']
+
+        return self.token
+
+    # GET request, returns AsyncResponse
+    # requests refused because the session token has expired are retried once with a new token
+    async def get(self, uri, params=None):
+
+        session = self._connect()
+
+        if self.token is None:
+            await self.authorize()
+
+        for attempt in range(2):
+
+            token = self.token
+
+            async with self._semaphore:
+                self.requests += 1
+                start = time.time()
+                async with session.get(self._url(uri), params=query_params(params),
+                                       headers={'X-ArchivesSpace-Session': token}) as response:
+                    status = response.status
+                    body = await response.read()
+                    text = body.decode(response.get_encoding())
+
+            for hook in self.response_hooks:
+                hook(str(response.url), status, time.time() - start, len(body))
+
+            if status not in reauthorize_status or attempt > 0:
+                break
+
+            await self.authorize(expired=token)
+
+        return AsyncResponse(status, text)
+
+    # GET requests for a list of URIs, run concurrently (up to the concurrency limit)
+    # returns list of AsyncResponse in the same order as uris
+    async def get_many(self, uris, params=None):
+        return await asyncio.gather(*[self.get(uri, params) for uri in uris])
+
+    async def close(self):
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        return
+
+
+#-----------------------------------------------------------------------#
+
+# synchronous interface to AsyncEngine
+# the event loop runs in a background thread; methods may be called from any thread,
+# and calls from several threads share the session and the concurrency limit
+class AsyncClient:
+
+    def __init__(self, baseurl, username, password, concurrency=default_concurrency, timeout=default_timeout):
+
+        self.engine = AsyncEngine(baseurl, username, password, concurrency, timeout)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    # runs a coroutine on the event loop and returns its result
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def authorize(self):
+        return self.run(self.engine.authorize())
+
+    def get(self, uri, params=None, **kwargs):
+        return self.run(self.engine.get(uri, params))
+
+    # yields results of a paged list endpoint, like ASnakeClient.get_paged()
+    def get_paged(self, url, page_size=100, params=None, **kwargs):
+
+        params = dict(params or {})
+        params['page_size'] = page_size
+        params['page'] = 1
+
+        while True:
+
+            page = self.get(url, params=params).json()
+            yield from page.get('results', [])
+
+            if page.get('this_page', 1) >= page.get('last_page', 1):
+                break
+
+            params['page'] += 1
+
+    # closes the session and stops the event loop
+    def close(self):
+
+        self.run(self.engine.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+        return
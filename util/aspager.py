@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# aspager.py
+#
+# Concurrent reading of paged ArchivesSpace API lists (e.g. /repositories/2/digital_objects)
+# Used by buildxml.py and app/aspace.py
+#
+# The first page gives the number of pages (last_page). The other pages are then fetched
+# concurrently, at most window pages at a time, and records are yielded in page order,
+# as with ASnakeClient.get_paged().
+# Works with any client with a get(uri, params=...) method (ASnakeClient, AsyncClient, and the
+# CachingClient and ResilientClient wrappers).
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default number of records per page
+default_page_size = 100
+
+# default number of pages fetched at a time
+default_window = 8
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS (in order of appearance)
+#
+#   get_page(client, uri, params, page, page_size)
+#                                               returns one page of a paged list
+#
+#   get_pages(client, uri, params, page_size, window)
+#                                               yields the records of a paged list, fetching up to
+#                                               window pages at a time
+#-----------------------------------------------------------------------#
+
+# returns one page of a paged list: {'first_page', 'last_page', 'this_page', 'total', 'results'}
+def get_page(client, uri, params, page, page_size=default_page_size):
+
+    response = client.get(uri, params=dict(params or {}, page=page, page_size=page_size))
+    obj = response.json()
+
+    if response.status_code != 200 or not isinstance(obj, dict) or 'results' not in obj:
+        raise RuntimeError('Paged list ' + uri + ' page ' + str(page) + ' failed: ' +
+                           str(response.status_code) + ' ' + str(obj)[:200])
+
+    return obj
+
+
+#-----------------------------------------------------------------------#
+
+# yields the records of a paged list in order
+# the first page is fetched alone; the other pages are fetched concurrently by window threads,
+# with at most window pages fetched ahead of the records yielded
+def get_pages(client, uri, params=None, page_size=default_page_size, window=default_window):
+
+    first = get_page(client, uri, params, 1, page_size)
+    yield from first['results']
+
+    pages = iter(range(2, first.get('last_page', 1) + 1))
+
+    # one page at a time
+    if window <= 1:
+        for page in pages:
+            yield from get_page(client, uri, params, page, page_size)['results']
+        return
+
+    with ThreadPoolExecutor(max_workers=window) as executor:
+
+        pending = deque()
+
+        def submit():
+            page = next(pages, None)
+            if page is not None:
+                pending.append(executor.submit(get_page, client, uri, params, page, page_size))
+
+        for i in range(window):
+            submit()
+
+        while pending:
+            results = pending.popleft().result()['results']
+            submit()
+            yield from results
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# asretry.py
+#
+# Rate limiting, retry and adaptive concurrency for ArchivesSpace API clients
+# Used by buildxml.py
+#
+# ResilientClient wraps an ASnakeClient or asclient.AsyncClient (in the same way as
+# ascache.CachingClient) so that each get():
+#   - waits for a token from a token bucket (--rate requests per second, 0 for no limit)
+#   - waits for a free slot under the concurrency limit, which adapts to ArchivesSpace:
+#     it grows by one slot per round of successful requests, and is halved when a request fails
+#     or the response time of an endpoint rises well above the fastest observed for that endpoint (AIMD)
+#   - is retried with jittered exponential backoff when ArchivesSpace returns 429 or 5xx,
+#     or the request times out or the connection fails (Retry-After is respected)
+# Requests, retries, failures and throttle waits are counted by endpoint (summary()), and retries
+# are passed to retry hooks, e.g. BuildReport.add_retry().
+
+import time
+import random
+import threading
+
+import requests
+
+from buildreport import endpoint_name
+
+# aiohttp is only needed for the async backend
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default number of retries of a failed request
+default_retries = 5
+
+# default request timeout (seconds)
+default_timeout = 300
+
+# HTTP status codes that are retried
+retry_status = [429, 500, 502, 503, 504]
+
+# exceptions that are retried (timeouts and connection errors)
+retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    ConnectionError, TimeoutError)
+if aiohttp is not None:
+    retry_exceptions += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+# backoff before the first retry, and maximum backoff (seconds)
+backoff_base = 0.5
+backoff_max = 60
+
+# concurrency limit is halved when the smoothed response time of an endpoint exceeds
+# latency_tolerance times the fastest smoothed response time observed for the same endpoint
+# (endpoints differ in response time, e.g. a single collection and a page of a list)
+latency_tolerance = 2.0
+
+# response times below this are never treated as a sign of overload (seconds)
+latency_floor = 0.1
+
+# weight of each response in the smoothed response time
+latency_smoothing = 0.1
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   retry_delay(attempt, response)              returns seconds to wait before retry number attempt
+#
+#   TokenBucket(rate, burst)                    token bucket rate limit, shared by threads
+#
+#   AdaptiveLimit(maximum, minimum)             AIMD concurrency limit, shared by threads
+#
+#   ResilientClient(client, rate, concurrency, retries, timeout)
+#                                               wraps an API client with rate limit, retry and
+#                                               adaptive concurrency limit
+#-----------------------------------------------------------------------#
+
+# returns seconds to wait before retry number attempt (0 for the first retry)
+# full jitter: a random time up to backoff_base * 2^attempt (at most backoff_max),
+# or the Retry-After time of the response, if longer
+def retry_delay(attempt, response=None):
+
+    delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+    retry_after = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(backoff_max, int(retry_after)))
+
+    return delay
+
+
+#-----------------------------------------------------------------------#
+
+# token bucket rate limit: at most rate requests per second on average, with bursts of up to burst
+# rate 0 means no limit
+class TokenBucket:
+
+    def __init__(self, rate=0, burst=None):
+
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # waits for a token, returns seconds waited
+    def acquire(self):
+
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens may go negative: later callers wait in turn
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+#-----------------------------------------------------------------------#
+
+# AIMD concurrency limit
+# starts at maximum; the limit grows by one after a round (limit) of successful requests,
+# and is halved (at most once per smoothed response time) when a request fails or is slow
+# response times are smoothed, and compared with the fastest, separately for each endpoint
+class AdaptiveLimit:
+
+    def __init__(self, maximum, minimum=1):
+
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.lowest = self.limit
+        self.in_flight = 0
+        # smoothed and fastest smoothed response times, by endpoint
+        self.latency = dict()
+        self.fastest = dict()
+        self.decreased = 0
+        self._condition = threading.Condition()
+
+    # waits for a free slot, returns seconds waited
+    def acquire(self):
+
+        start = time.monotonic()
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+        return time.monotonic() - start
+
+    # frees a slot and adjusts the limit
+    # seconds is the response time of the request to endpoint, ok is False if it failed
+    def release(self, seconds, ok=True, endpoint=None):
+
+        with self._condition:
+
+            self.in_flight -= 1
+
+            latency = self.latency.get(endpoint)
+            if ok:
+                latency = seconds if latency is None else \
+                    (1 - latency_smoothing) * latency + latency_smoothing * seconds
+                self.latency[endpoint] = latency
+                fastest = self.fastest[endpoint] = min(self.fastest.get(endpoint, latency), latency)
+                slow = latency > max(latency_floor, latency_tolerance * fastest)
+            else:
+                slow = False
+
+            now = time.monotonic()
+            if not ok or slow:
+                if now - self.decreased > (latency or 0):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.lowest = min(self.lowest, self.limit)
+                    self.decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+
+#-----------------------------------------------------------------------#
+
+# wraps an API client (ASnakeClient or AsyncClient) with a rate limit (rate requests per second,
+# 0 for no limit), retry (up to retries times), and an adaptive limit of concurrency requests in flight
+# other attributes are passed to the wrapped client
+class ResilientClient:
+
+    def __init__(self, client, rate=0, concurrency=10, retries=default_retries, timeout=default_timeout):
+
+        self.client = client
+        self.retries = retries
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+        self.limit = AdaptiveLimit(concurrency)
+        # functions called for each retry: hook(url, reason)
+        self.retry_hooks = list()
+        # counters by endpoint
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    # adds n to a counter of endpoint
+    def _count(self, endpoint, name, n=1):
+
+        with self._lock:
+            counters = self.counters.setdefault(endpoint, {'requests': 0, 'retries': 0, 'failures': 0,
+                                                           'throttle_seconds': 0})
+            counters[name] += n
+
+    # GET request, retried if it fails
+    # returns the response; after the last retry, returns the failed response or raises the exception
+    def get(self, uri, *args, **kwargs):
+
+        endpoint = endpoint_name(uri)
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.retries + 1):
+
+            waited = self.bucket.acquire() + self.limit.acquire()
+            self._count(endpoint, 'requests')
+            if waited:
+                self._count(endpoint, 'throttle_seconds', waited)
+
+            response, error, ok = None, None, False
+            start = time.monotonic()
+            try:
+                response = self.client.get(uri, *args, **kwargs)
+                ok = response.status_code not in retry_status
+            except retry_exceptions as e:
+                error = e
+            finally:
+                self.limit.release(time.monotonic() - start, ok, endpoint)
+
+            if ok:
+                return response
+
+            reason = type(error).__name__ if error is not None else str(response.status_code)
+
+            if attempt == self.retries:
+                self._count(endpoint, 'failures')
+                print('Request failed after', self.retries, 'retries:', uri, reason)
+                if error is not None:
+                    raise error
+                return response
+
+            self._count(endpoint, 'retries')
+            for hook in self.retry_hooks:
+                hook(uri, reason)
+
+            time.sleep(retry_delay(attempt, response))
+
+    # yields results of a paged list endpoint, like ASnakeClient.get_paged()
+    # pages are requested with get(), so they are rate limited and retried
+    def get_paged(self, url, page_size=100, params=None, **kwargs):
+
+        params = dict(params or {})
+        params['page_size'] = page_size
+        params['page'] = 1
+
+        while True:
+
+            page = self.get(url, params=params).json()
+            yield from page.get('results', [])
+
+            if page.get('this_page', 1) >= page.get('last_page', 1):
+                break
+
+            params['page'] += 1
+
+    # returns the rate limit, concurrency limit and counters (by endpoint) for the build report
+    def summary(self):
+
+        with self._lock:
+            counters = {endpoint: dict(values, throttle_seconds=round(values['throttle_seconds'], 3))
+                        for endpoint, values in sorted(self.counters.items())}
+
+        return {'rate': self.bucket.rate,
+                'retries': self.retries,
+                'concurrency': {'maximum': self.limit.maximum,
+                                'lowest': int(self.limit.lowest),
+                                'final': int(self.limit.limit)},
+                'endpoints': counters}
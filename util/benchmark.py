@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# benchmark.py
+#
+# Benchmark of buildxml.py against the local mock ArchivesSpace server (mockas.py)
+#
+# For each repository size, a mock server is started with a synthetic repository and a full build
+# is run in a separate process, in a temporary copy of the util folder with its own secrets.py,
+# database (instance/ead2dc.db) and output folders. Reports wall time, records per second, peak
+# memory (maximum resident set size of the build process) and API calls of each build.
+# Results are printed and written as JSON.
+#
+# usage: python benchmark.py [-s SIZES] [-l LATENCY] [-e ERROR_RATE] [-k] [-o OUTPUT] [-- BUILDXML OPTIONS]
+#    e.g. python benchmark.py -s 1000,10000 -l 0.005 -- -w 8 -b 50
+
+import sys
+import json
+import time
+import shutil
+import sqlite3 as sq
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+from mockas import MockRepository, start_server
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default repository sizes (number of digital objects)
+default_sizes = [1000, 10000, 100000]
+
+# util folder (files copied to each benchmark folder)
+util_path = Path(__file__).resolve().parent
+
+# database tables used by buildxml.py (see README.md)
+dbq_schema = '''CREATE TABLE logs (date text, verb text, setname text, identifier text, datefrom text, dateuntil text);
+CREATE TABLE collections (collno text, colltitle text, docount int, incl int, caltechlibrary int, internetarchive int, youtube int, other int, collid text, description text, typ text, aocount int default 0, last_edit text, type_text int, type_stillimage int, type_movingimage int, type_sound int, type_other int);
+CREATE TABLE last_update (dt text, fn text);
+CREATE TABLE user(username TEXT UNIQUE NOT NULL, role text);
+CREATE TABLE dates (earliest TEXT);
+INSERT INTO last_update VALUES ('2025-01-01T00:00:00', 'xml');
+INSERT INTO last_update VALUES ('2025-01-01T00:00:00', 'col');
+INSERT INTO dates VALUES ('2020-01-01');'''
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS (in order of appearance)
+#
+#   create_benchmark_folder(folder, baseurl)    creates a folder in which buildxml.py can run against the mock server
+#
+#   run_build(folder, options)                  runs buildxml.py in folder, returns build statistics
+#
+#   run_benchmark(size, options, latency, error_rate, keep)
+#                                               runs a build against a mock repository of the given size
+#
+#   main()                                      runs the benchmark from the command line
+#-----------------------------------------------------------------------#
+
+# creates a folder in which buildxml.py can run against the mock server
+# folder/util has copies of the scripts and a secrets.py for the mock server,
+# folder/instance the database, and folder/xml and folder/dev the outputs
+def create_benchmark_folder(folder, baseurl):
+
+    (folder / 'util').mkdir(parents=True)
+    for name in ['instance', 'xml', 'dev']:
+        (folder / name).mkdir()
+
+    for path in util_path.glob('*.py'):
+        if path.name not in ['secrets.py', 'benchmark.py', 'mockas.py', 'regression.py']:
+            shutil.copy(path, folder / 'util' / path.name)
+
+    with open(folder / 'util' / 'secrets.py', 'w') as f:
+        f.write("baseurl='" + baseurl + "'\nusername='benchmark'\npassword='benchmark'\nsecret_key='benchmark'\n")
+
+    connection = sq.connect(folder / 'instance' / 'ead2dc.db')
+    connection.executescript(dbq_schema)
+    connection.commit()
+    connection.close()
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# runs buildxml.py in folder, returns build statistics
+def run_build(folder, options):
+
+    # maximum resident set size of child processes so far (KB on Linux)
+    # builds run one after another, so the maximum is only reliable for the largest build so far
+    start = time.time()
+    result = subprocess.run([sys.executable, 'buildxml.py'] + options, cwd=folder / 'util',
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    seconds = time.time() - start
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    if result.returncode != 0:
+        print(result.stdout)
+        raise RuntimeError('buildxml.py failed with exit code ' + str(result.returncode))
+
+    # report written by buildxml.py (production runtype writes to xml/)
+    report_path = folder / 'xml' / 'buildreport.json'
+    if not report_path.exists():
+        report_path = folder / 'dev' / 'buildreport.json'
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+
+    records = report['records'].get('emitted', 0)
+
+    return {'seconds': round(seconds, 3),
+            'records': records,
+            'records_per_second': round(records / seconds, 1) if seconds else None,
+            'peak_memory_mb': round(max_rss / 1024, 1),
+            'api_calls': report['api_calls'],
+            'api_retries': report.get('api_retries', 0),
+            'phases': {phase['phase']: phase['seconds'] for phase in report['phases']}}
+
+
+#-----------------------------------------------------------------------#
+
+# runs a build against a mock repository of the given size
+# latency (seconds) is added to each API request, error_rate is the fraction of requests that fail (503);
+# keep keeps the benchmark folder
+def run_benchmark(size, options, latency=0, error_rate=0, keep=False):
+
+    print('Generating repository with', size, 'digital objects...')
+    mock = MockRepository(size)
+    server = start_server(mock, latency=latency, error_rate=error_rate)
+
+    folder = Path(tempfile.mkdtemp(prefix='ead2dc-benchmark-'))
+
+    try:
+        create_benchmark_folder(folder, 'http://127.0.0.1:' + str(server.server_port))
+        print('Running buildxml.py', ' '.join(options), 'in', folder)
+        stats = run_build(folder, options)
+    finally:
+        server.shutdown()
+        server.server_close()
+        if not keep:
+            shutil.rmtree(folder)
+
+    stats['size'] = size
+    stats['archival_objects'] = len(mock.archival_objects)
+    stats['collections'] = len(mock.trees)
+
+    print(size, 'digital objects:', stats['records'], 'records in', stats['seconds'], 'seconds,',
+          stats['records_per_second'], 'records/s,', stats['peak_memory_mb'], 'MB peak memory,',
+          stats['api_calls'], 'API calls,', stats['api_retries'], 'retries')
+
+    return stats
+
+
+#-----------------------------------------------------------------------#
+
+# runs the benchmark from the command line
+# arguments after '--' are passed to buildxml.py
+def main():
+
+    argv = sys.argv[1:]
+    options = list()
+    if '--' in argv:
+        options = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default=','.join(str(size) for size in default_sizes))
+    parser.add_argument('-l', '--latency', default=0, type=float)
+    parser.add_argument('-e', '--error-rate', default=0, type=float)
+    parser.add_argument('-k', '--keep', action='store_true')
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    args = parser.parse_args(argv)
+
+    results = {'started': datetime.now().isoformat(),
+               'options': options,
+               'latency': args.latency,
+               'error_rate': args.error_rate,
+               'builds': list()}
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results['builds'].append(run_benchmark(size, options, args.latency, args.error_rate, args.keep))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('Results written to', args.output)
+
+
+#-----------------------------------------------------------------------#
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# buildreport.py
+#
+# Instrumentation of buildxml.py runs
+# Records, for each phase of the build (API connection, collections dictionary, database refresh,
+# XML build, database update, write):
+#   - wall time
+#   - ArchivesSpace API calls: count, bytes received and latency percentiles, by endpoint
+#   - retries of failed API calls, by endpoint (see asretry.py)
+#   - records emitted and skipped (no file URIs, duplicates)
+# Phases are logged with structlog as they start and end. The report is written as JSON
+# (buildreport.json, next to duplicates.txt).
+
+import json
+import time
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import structlog
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# latency percentiles included in the report
+percentiles = [50, 90, 99]
+
+log = structlog.get_logger('buildxml')
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   endpoint_name(url)                          returns endpoint of an API URL, with ids replaced by ':id'
+#
+#   percentile(values, p)                       returns the p-th percentile of a sorted list of values
+#
+#   new_stats()                                 returns empty API call statistics of an endpoint
+#
+#   api_summary(api)                            summarizes API call statistics for the report
+#
+#   BuildReport()                               collects phase, API and record statistics of a build
+#-----------------------------------------------------------------------#
+
+# returns endpoint of an API URL, with ids replaced by ':id'
+# e.g. 'https://.../repositories/2/archival_objects/123?resolve[]=ancestors'
+# returns '/repositories/:id/archival_objects/:id'
+def endpoint_name(url):
+
+    path = urlsplit(url).path
+    parts = [':id' if part.isdigit() else part for part in path.split('/') if part]
+
+    return '/' + '/'.join(parts)
+
+
+#-----------------------------------------------------------------------#
+
+# returns the p-th percentile of a sorted list of values (nearest rank)
+def percentile(values, p):
+
+    if not values:
+        return None
+
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+
+    return values[rank]
+
+
+#-----------------------------------------------------------------------#
+
+# returns empty API call statistics of an endpoint
+def new_stats():
+    return {'calls': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': list()}
+
+
+#-----------------------------------------------------------------------#
+
+# summarizes API call statistics for the report
+# api has the form {endpoint: {'calls': #, 'errors': #, 'retries': #, 'bytes': #, 'latencies': [seconds]}}
+def api_summary(api):
+
+    summary = dict()
+
+    for endpoint, stats in sorted(api.items()):
+        latencies = sorted(stats['latencies'])
+        summary[endpoint] = {'calls': stats['calls'],
+                             'errors': stats['errors'],
+                             'retries': stats['retries'],
+                             'bytes': stats['bytes'],
+                             'latency': {'p' + str(p): percentile(latencies, p) for p in percentiles}}
+        summary[endpoint]['latency']['max'] = latencies[-1] if latencies else None
+
+    return summary
+
+
+#-----------------------------------------------------------------------#
+
+# collects phase, API and record statistics of a build
+# safe to share between threads
+class BuildReport:
+
+    def __init__(self):
+
+        self.started = datetime.now()
+        self.phases = list()
+        self.records = dict()
+        self.info = dict()
+        self._phase = None
+        self._phase_start = None
+        self._api = dict()
+        self._lock = threading.Lock()
+
+    # ends the current phase (if any) and starts a new one
+    def start_phase(self, name):
+
+        self.end_phase()
+
+        self._phase = {'phase': name, 'api': dict()}
+        self._phase_start = time.time()
+        log.info('phase started', phase=name)
+
+    # ends the current phase
+    def end_phase(self):
+
+        if self._phase is None:
+            return
+
+        with self._lock:
+            phase, api = self._phase, self._phase['api']
+            self._phase = None
+
+        phase['seconds'] = round(time.time() - self._phase_start, 3)
+        phase['api_calls'] = sum(stats['calls'] for stats in api.values())
+        phase['api_bytes'] = sum(stats['bytes'] for stats in api.values())
+        phase['api_retries'] = sum(stats['retries'] for stats in api.values())
+        phase['api'] = api_summary(api)
+        self.phases.append(phase)
+
+        log.info('phase ended', phase=phase['phase'], seconds=phase['seconds'],
+                 api_calls=phase['api_calls'], api_bytes=phase['api_bytes'])
+
+    # adds an API response (seconds is the time to the response, size the bytes received)
+    def add_response(self, url, status, seconds, size):
+
+        endpoint = endpoint_name(url)
+
+        with self._lock:
+
+            targets = [self._api]
+            if self._phase is not None:
+                targets.append(self._phase['api'])
+
+            for api in targets:
+                stats = api.setdefault(endpoint, new_stats())
+                stats['calls'] += 1
+                stats['bytes'] += size
+                stats['latencies'].append(seconds)
+                if status >= 400:
+                    stats['errors'] += 1
+
+    # adds a retry of an API call (reason is the HTTP status or exception), see asretry.ResilientClient
+    def add_retry(self, url, reason):
+
+        endpoint = endpoint_name(url)
+
+        with self._lock:
+
+            targets = [self._api]
+            if self._phase is not None:
+                targets.append(self._phase['api'])
+
+            for api in targets:
+                api.setdefault(endpoint, new_stats())['retries'] += 1
+
+        log.warning('api call retried', endpoint=endpoint, reason=reason)
+
+    # requests response hook, for ASnakeClient.session.hooks['response']
+    def response_hook(self, response, *args, **kwargs):
+        self.add_response(response.url, response.status_code, response.elapsed.total_seconds(),
+                          len(response.content))
+
+    # adds API statistics collected by another process (see take_api())
+    def merge_api(self, api):
+
+        with self._lock:
+
+            targets = [self._api]
+            if self._phase is not None:
+                targets.append(self._phase['api'])
+
+            for target in targets:
+                for endpoint, stats in api.items():
+                    total = target.setdefault(endpoint, new_stats())
+                    total['calls'] += stats['calls']
+                    total['errors'] += stats['errors']
+                    total['retries'] += stats['retries']
+                    total['bytes'] += stats['bytes']
+                    total['latencies'].extend(stats['latencies'])
+
+    # returns API statistics collected since the last call, and clears them
+    # used to send the statistics of a worker process to the main process
+    def take_api(self):
+
+        with self._lock:
+            api, self._api = self._api, dict()
+
+        return api
+
+    # adds n to a record counter (e.g. 'emitted', 'no_file_uris', 'duplicates')
+    def count(self, name, n=1):
+        self.records[name] = self.records.get(name, 0) + n
+
+    # returns the report as a dictionary
+    def summary(self):
+
+        with self._lock:
+            api = api_summary(self._api)
+
+        return {'started': self.started.isoformat(),
+                'seconds': round(sum(phase['seconds'] for phase in self.phases), 3),
+                'phases': self.phases,
+                'api_calls': sum(stats['calls'] for stats in api.values()),
+                'api_bytes': sum(stats['bytes'] for stats in api.values()),
+                'api_retries': sum(stats['retries'] for stats in api.values()),
+                'api': api,
+                'records': self.records,
+                **self.info}
+
+    # ends the current phase and writes the report as JSON
+    def write(self, report_path):
+
+        self.end_phase()
+
+        with open(report_path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+        log.info('report written', path=str(report_path))
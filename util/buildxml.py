@@ -12,17 +12,30 @@
 #   collections - records data about collections with digital content
 #   last_update - records dates of last updates of XML file and collection selection
 
+import os
+import json
 import time
 import sqlite3 as sq
 import xml.etree.ElementTree as ET
-import xml.dom.minidom as dom
 import argparse
+import threading
+import zlib
+import multiprocessing
+from collections import deque, ChainMap
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
 from datetime import date, datetime, timedelta
 from pathlib import Path
 from urllib.parse import urlparse
 
 # local imports
 import secrets
+from ascache import ResponseCache, CachingClient, cache_key
+from buildreport import BuildReport
+from asretry import ResilientClient, default_retries
+from fragcache import FragmentCache, fragment_key
+from linkindex import LinkIndex
+from aspager import get_pages
 
 # import ASnakeClient for ArchivesSpace API access
 from asnake.client import ASnakeClient
@@ -75,9 +88,58 @@ relator_map = {
 # default resource type if none found in digital object
 default_digital_object_type = 'other'
 
+# base for OAI identifiers, the archival object id is appended
+identifier_base = 'collections.archives.caltech.edu'
+
+# namespace declarations for the oai_dc:dc element of each record
+dc_namespaces = {'xmlns:oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/',
+                 'xmlns:dc': 'http://purl.org/dc/elements/1.1/',
+                 'xmlns:dcterms': 'http://purl.org/dc/terms/'}
+
+# maps namespaces in staticrepo.xml to the prefixes used to build records
+# used to reuse records from a previous build (incremental builds)
+prefix_map = {'http://www.openarchives.org/OAI/2.0/': '',
+              'http://www.openarchives.org/OAI/2.0/oai_dc/': 'oai_dc:',
+              'http://purl.org/dc/elements/1.1/': 'dc:'}
+
+# digital object fields kept in digital_objects_dict
+# these are all the fields used by published_file_uris() and get_digital_object_type()
+digital_object_fields = ['file_versions',
+                         'representative_file_version',
+                         'digital_object_type',
+                         'publish',
+                         'suppressed']
+
+# resolved records included with archival object metadata
+# ancestors are not resolved; see fetch_ancestors()
+archival_object_resolve = ['digital_object',
+                           'linked_agents',
+                           'repository',
+                           'subjects',
+                           'top_container']
+
+# number of pages of paged lists (e.g. digital objects) fetched at a time
+page_window = 8
+
+# version of the record format, part of the key of cached record fragments (see fragcache.py)
+# increase when build_record() changes, so all records are rebuilt
+record_format_version = 1
+
+# number of archival objects sent to a shard worker process at a time (--shards)
+shard_chunk_size = 200
+
+# number of records between commits of the checkpoint journal (--resume)
+checkpoint_interval = 100
+
+# lock held by the worker thread fetching ancestors (see fetch_ancestors())
+ancestors_lock = threading.Lock()
+
 # database location
 dbpath = Path(Path(__file__).resolve().parent).joinpath('../instance/ead2dc.db')
 
+# ArchivesSpace response cache location (shared with app/aspace.py)
+cachepath = Path(Path(__file__).resolve().parent).joinpath('../instance/ascache.db')
+
 # TABLE:    collections
 # COLUMNS:  collno              text    numerical id of collection, e.g. '123'
 #           colltitle           text    title of collection, e.g. 'John Doe Papers'
@@ -142,6 +204,31 @@ qdb_collections_select = 'SELECT    collno, \
                                     type_other \
                                 FROM collections;'
 
+# index of collections by collid, for updating collection statistics
+dbq_collections_index = 'CREATE INDEX IF NOT EXISTS collections_collid ON collections (collid);'
+
+# query to update collection statistics in db, one complete row per collection
+# collections not in the collections table (see database_refresh()) are not added
+dbq_collections_stats_update = 'UPDATE collections SET \
+                                    aocount=?, \
+                                    docount=?, \
+                                    caltechlibrary=?, \
+                                    internetarchive=?, \
+                                    youtube=?, \
+                                    other=?, \
+                                    type_text=?, \
+                                    type_stillimage=?, \
+                                    type_movingimage=?, \
+                                    type_sound=?, \
+                                    type_other=?, \
+                                    last_edit=? \
+                                WHERE collid=?;'
+
+# host categories and types with their own columns in the collections table
+# other types (e.g. 'collection', 'software') are counted in type_other
+host_categories = ['caltechlibrary', 'internetarchive', 'youtube', 'other']
+type_columns = ['text', 'stillimage', 'movingimage', 'sound', 'other']
+
 # default rights statement to include in XML records
 default_rights_statement = 'The copyright and related rights status of this Item has not been evaluated. \
 Please contact Caltech Archives and Special Collections for more information. You are free to use this \
@@ -150,26 +237,38 @@ Item in any way that is permitted by the copyright and related rights legislatio
 #-----------------------------------------------------------------------#
 # FUNCTIONS (in order of appearance)
 #
-#   authorize_api()                             establish API connection
+#   authorize_api(backend, concurrency, workers, rate, retries)
+#                                               establish API connection (ASnakeClient or AsyncClient),
+#                                               with rate limit, retry and adaptive concurrency limit
 #
-#   prettify(elem)                              returns a "pretty" XML string 
-#                                               from an ElementTree Element
+#   attach_report(client, report)               adds the API responses and retries of client to a BuildReport
+#
+#   serialize_element(elem, level, indent)      returns an element as written to staticrepo.xml
+#
+#   StaticRepoWriter(xml_path, indent)          writes staticrepo.xml as a stream, one record at a time
+#                                               the file is swapped in atomically when complete
 #
 #   create_collection_description(coll_info)    create collection description string from 
 #                                               collection notes in ArchivesSpace
 #                                               used to compile dc:description element in 
 #                                               OAI-PMH setDescription
 #
-#   build_collections_dict()                    builds two dictionaries: for collections and archival objects
+#   build_collections_dict()                    builds three dictionaries: for collections, archival objects
+#                                               and digital objects (all, or modified since the previous build)
 #                                               collections_dict has the form {collection: {ao: {do}}}
 #                                               archival_objects_dict has the form 
 #                                               {ao: {'collections': [collection], 'digital_objects': [do]}}
+#                                               digital_objects_dict has the form {do: {field: value}}
 #
 #   create_valid_hostnames_set(file_uris)       removes invalid hostnames from file_uris list and 
 #                                               returns set of valid hostnames
 #
 #   get_domain_from_url(file_url)               extracts domain from url
 #
+#   get_digital_object(do, digital_objects_dict)
+#                                               returns digital object metadata from digital_objects_dict,
+#                                               or from the API if not found
+#
 #   published_file_uris(do_list)                returns list of published file URIs and use statements from 
 #                                               digital objects in do_list. do_list is a list of digital object URIs
 #                                               returns list of tuples: (file_uri, use_statement)
@@ -178,24 +277,197 @@ Item in any way that is permitted by the copyright and related rights legislatio
 #
 #   get_digital_object_type(do_list)            returns list of digital object types from digital objects in do_list
 #                                               uses digital_object_type_map to map ArchivesSpace types to Dublin Core types
+#
+#   fetch_records(uris, resolve, batch_size)    fetches records in batches using the id_set[] parameter
+#                                               returns dictionary of the form {uri: record}
+#
+#   extract_ancestor(level, obj)                returns tuple (level, title, [rights note]) for an ancestor
+#
+#   fetch_ancestors(metadata_list, ancestors_cache)
+#                                               adds ancestors of archival objects to ancestors_cache
+#
+#   fetch_archival_objects(batch, ...)          fetches archival object metadata, published file URIs and
+#                                               digital object types for a batch of archival objects
+#
+#   harvest_archival_objects(items, workers, batch_size)
+#                                               fetches archival objects in batches using a bounded pool 
+#                                               of worker threads. yields results in the same order as items
+#
+#   get_collection_tree(collection)             returns archival objects of a collection in collection order,
+#                                               with ancestor chains computed from the tree
+#
+#   order_by_collection_tree(collections_dict, archival_objects_dict, ...)
+#                                               yields archival_objects_dict items in collection order
+#
+#   get_host_category(hostname)                 categorizes hostname for collection statistics
+#
+#   update_stats(stats_dict, coll_mdate_dict, ...)
+#                                               adds a record to collection statistics and last modified dates
+#
+#   build_record(ao, colls_dict, ...)           builds the OAI-PMH record element for an archival object
+#
+#   get_last_modified_date(archival_object_metadata)
+#                                               returns the datestamp of a record (YYYY-MM-DD)
+#
+#   build_archival_object(ao, colls_dict, ...)  builds the record for a fetched archival object, or reads it
+#                                               from the fragment cache
+#                                               returns tuple: (record, last_modified_date, [ancestor])
+#
+#   build_archival_objects(harvest, ancestors_cache, fragments)
+#                                               builds records for the results of harvest_archival_objects()
+#
+#   build_stats(client, items, digital_objects_dict, workers, batch_size, report)
+#                                               computes collection statistics without building records (--stats-only)
+#
+#   get_shard(colls_dict, shards)               returns the shard of an archival object, by collection
+#
+#   init_shard_worker(...)                      sets up a shard worker process
+#
+#   build_shard_chunk(chunk)                    fetches and builds records for a chunk of items in a 
+#                                               shard worker process
+#
+#   harvest_shards(items, shards, ...)          fetches and builds records in worker processes, 
+#                                               yields results in items order
+#
+#   fetch_collection_info(collections_dict, workers)
+#                                               fetches title and description of each collection once
+#                                               returns dictionary of the form {collection: {'title', 'description'}}
+#
+#   database_refresh(collections_dict, collection_info_dict, runtype)
+#                                               refresh collections information to database
+#
+#   get_collection_type(collid)                 returns collection type and number from collection id
+#
+#   collection_stats_row(collid, values, mod_date)
+#                                               returns one complete row of collection statistics
+#
+#   database_update(stats_dict, coll_mdate_dict, earliest_datestamp, last_update, xml_updated)
+#                                               writes collection statistics to the database in one transaction
+#
+#   read_build_state(state_path)                reads the state of the previous build (incremental builds)
+#
+#   write_build_state(state_path, ...)          writes the state of this build for the next incremental build
+#
+#   unqualify_record(record)                    converts a record read from XML back to the form built 
+#                                               by build_record()
+#
+#   read_prior_records(xml_path)                reads records from the previous staticrepo.xml
+#                                               returns dictionary of the form {ao: record}
+#
+#   get_last_build_time(state)                  returns the start time of the previous build (epoch seconds)
+#
+#   get_modified_uris(category, modified_since) returns set of URIs modified since the previous build
+#
+#   remove_deleted_digital_objects(digital_objects_dict)
+#                                               removes digital objects deleted since the previous build
+#
+#   find_changed_archival_objects(...)          returns set of archival objects whose records must be rebuilt
+#
+#   check_duplicates(file_uris, file_uri_set, duplicate_uris_set)
+#                                               checks for file URIs already used by other records
+#
+#   BuildJournal(journal_path)                  checkpoint journal of a build, used to resume a build
+#                                               that did not complete
+#
+#   close_build(report, report_path, api_client, backend, cache, fragments, start)
+#                                               prints cache and API statistics, closes caches and API client,
+#                                               writes the build report
 #-----------------------------------------------------------------------#
 
 # establish API connection
-def authorize_api():
-    client = ASnakeClient(baseurl = secrets.baseurl,
-                        username = secrets.username,
-                        password = secrets.password)
+# backend is 'asnake' (ASnakeClient) or 'async' (asclient.AsyncClient, pooled asyncio session
+# with at most concurrency requests in flight)
+# the client is wrapped in asretry.ResilientClient: at most rate requests per second (0 for no limit),
+# failed requests retried up to retries times, and an adaptive limit of requests in flight
+# (at most workers threads, or page_window pages of a paged list, with ASnakeClient;
+# concurrency with AsyncClient)
+def authorize_api(backend='asnake', concurrency=10, workers=1, rate=0, retries=default_retries):
+    if backend == 'async':
+        # aiohttp is only needed for the async backend
+        from asclient import AsyncClient
+        client = AsyncClient(baseurl = secrets.baseurl,
+                             username = secrets.username,
+                             password = secrets.password,
+                             concurrency = concurrency)
+    else:
+        client = ASnakeClient(baseurl = secrets.baseurl,
+                            username = secrets.username,
+                            password = secrets.password)
     client.authorize()
+    return ResilientClient(client, rate=rate, concurrency=concurrency if backend == 'async' else max(workers, page_window),
+                           retries=retries)
+
+#-----------------------------------------------------------------------#
+
+# adds the API responses (ASnakeClient or AsyncClient) and retries (ResilientClient) of client to report
+def attach_report(client, report):
+    if hasattr(client, 'engine'):
+        client.engine.response_hooks.append(report.add_response)
+    elif hasattr(client, 'session'):
+        client.session.hooks['response'].append(report.response_hook)
+    if hasattr(client, 'retry_hooks'):
+        client.retry_hooks.append(report.add_retry)
     return client
 
 #-----------------------------------------------------------------------#
 
-# returns a "pretty" XML string from an ElementTree Element (xml.etree.ElementTree.Element)
-def prettify(elem):
-    xml_string = ET.tostring(elem)
-    xml_file = dom.parseString(xml_string)
-    pretty_xml = xml_file.toprettyxml(indent="  ")
-    return pretty_xml
+# returns an element and its children as written to staticrepo.xml at the given level of indentation
+# indent is the string used for each level of indentation, or None for no indentation
+def serialize_element(elem, level, indent='  '):
+    if not indent:
+        return ET.tostring(elem, encoding='unicode')
+    ET.indent(elem, space=indent, level=level)
+    return indent * level + ET.tostring(elem, encoding='unicode') + '\n'
+
+#-----------------------------------------------------------------------#
+
+# writes staticrepo.xml as a stream
+# the OAI-PMH segments (Identify, ListMetadataFormats, ListSets) are written first, 
+# then each record is written as soon as it is built, so records are not kept in memory
+# output is written to a temporary file, which replaces xml_path when commit() is called
+# indent is the string used for each level of indentation, or None for no indentation
+class StaticRepoWriter:
+
+    def __init__(self, xml_path, indent='  '):
+        self.xml_path = Path(xml_path)
+        self.tmp_path = self.xml_path.with_suffix('.tmp')
+        self.indent = indent
+        self.f = open(self.tmp_path, 'w', encoding='utf-8')
+
+    # returns the start tag of an element, without its children
+    def start_tag(self, elem):
+        return ET.tostring(ET.Element(elem.tag, elem.attrib), encoding='unicode')[:-3] + '>'
+
+    # writes an element and its children at the given level of indentation
+    def write_element(self, elem, level):
+        self.f.write(serialize_element(elem, level, self.indent))
+
+    # writes the XML declaration, the root element start tag, the segments of 
+    # the root element (Identify, ListMetadataFormats, ListSets) and the 
+    # ListRecords start tag
+    def write_header(self, oaixml, list_records):
+        newline = '\n' if self.indent else ''
+        self.f.write('<?xml version="1.0" ?>\n')
+        self.f.write(self.start_tag(oaixml) + newline)
+        for elem in oaixml:
+            self.write_element(elem, 1)
+        self.f.write((self.indent or '') + self.start_tag(list_records) + newline)
+
+    # writes a record element, or a record already serialized by serialize_element() (see fragcache.py)
+    def write_record(self, record):
+        if isinstance(record, str):
+            self.f.write(record)
+        else:
+            self.write_element(record, 2)
+
+    # writes the end tags and replaces xml_path with the completed file
+    def commit(self):
+        newline = '\n' if self.indent else ''
+        self.f.write((self.indent or '') + '</ListRecords>' + newline + '</OAI-PMH>' + newline)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.tmp_path, self.xml_path)
 
 #-----------------------------------------------------------------------#
 
@@ -224,19 +496,28 @@ def create_collection_description(coll_info):
 
 #-----------------------------------------------------------------------#
 
-# builds two dictionaries: for collections and archival objects
+# builds three dictionaries: for collections, archival objects and digital objects
 # collections_dict has the form {collection: {ao: {do}}}
 # archival_objects_dict has the form {ao: {'collections': [collection], 'digital_objects': [do]}}
-def build_collections_dict(client):
-
-    # initialize collections dictionary
-    # this dictionary references archival objects with related digital objects
-    collections_dict = dict()
-    # initialize collections set
-    collections = set()
+# digital_objects_dict has the form {do: {field: value}} for the fields in digital_object_fields,
+# plus the 'collections' and 'archival_objects' linked to each digital object
+# for incremental builds, digital_objects_dict from the previous build is passed in and only
+# digital objects modified since the previous build (modified_since) are read from the API
+def build_collections_dict(client, digital_objects_dict=None, modified_since=None):
+
+    # initialize digital objects dictionary
+    # this dictionary keeps the digital object metadata needed to build records,
+    # so digital objects do not need to be fetched again
+    if digital_objects_dict is None:
+        digital_objects_dict = dict()
 
     # iterate over digital objects
-    digital_objects = client.get_paged('/repositories/2/digital_objects')
+    # pages after the first are fetched concurrently (page_window at a time), in page order
+    if modified_since:
+        digital_objects = get_pages(client, '/repositories/2/digital_objects', 
+                                    params={'modified_since': modified_since}, window=page_window)
+    else:
+        digital_objects = get_pages(client, '/repositories/2/digital_objects', window=page_window)
 
     n = 0
 
@@ -247,80 +528,45 @@ def build_collections_dict(client):
 
         do = obj['uri']
 
-        # only include objects that are published and not suppressed
-        if obj.get('publish') == True and obj.get('suppressed') == False:
-
-            # capture the id of the collections
-            colls_list = obj.get('collection')
-
-            if colls_list:
-
-                # iterate over the linked instances to find archival records
-                for linked_instance in obj['linked_instances']:
+        # capture the id of the collections
+        colls_list = obj.get('collection')
 
-                    # if linked to an archival object
-                    if linked_instance['ref'][:33] == '/repositories/2/archival_objects/':
-
-                        ao = linked_instance['ref']
-
-                        # build dictionary of collections, digital objects, and archival objects
-                        # dict has the form {collection: {ao: {do}}}
-                        # ao: 'archival object' is an id
-                        # do: 'digital object' is an id
-                        for collection in colls_list:
-
-                            # add to collections set
-                            coll = collection['ref']
-                            collections.add(coll)
-            
-                            if collections_dict.get(coll):
-
-                                # add to existing collection
-                                if collections_dict[coll].get(ao):
+        # only include objects that are published and not suppressed
+        if obj.get('publish') == True and obj.get('suppressed') == False and colls_list:
 
-                                    # add digital object to existing archival object
-                                    collections_dict[coll][ao].append(do)
+            # keep digital object metadata
+            digital_objects_dict[do] = {field: obj.get(field) for field in digital_object_fields}
 
-                                else:
+            # keep linked collections and archival objects
+            digital_objects_dict[do]['collections'] = [collection['ref'] for collection in colls_list]
+            digital_objects_dict[do]['archival_objects'] = [linked_instance['ref'] for linked_instance in obj['linked_instances']
+                                                            # if linked to an archival object
+                                                            if linked_instance['ref'][:33] == '/repositories/2/archival_objects/']
 
-                                    # create new archival object entry
-                                    collections_dict[coll][ao] = [do]
+        else:
 
-                            else:
+            # digital object is no longer published (incremental builds)
+            digital_objects_dict.pop(do, None)
 
-                                # create new collection
-                                collections_dict[coll] = {ao: [do]}
+    # build dictionary of collections, digital objects, and archival objects
+    # dict has the form {collection: {ao: [do]}}
+    # ao: 'archival object' is an id
+    # do: 'digital object' is an id
+    # the links are kept in a compact index (linkindex.py), read through mappings of the same
+    # form as dictionaries
+    links = LinkIndex((do, obj['archival_objects'], obj['collections']) for do, obj in digital_objects_dict.items())
+    collections_dict = links.collections_dict()
 
     print('Done building collections dictionary...')
 
-    # convert collections dictionary to archival objects dictionary
+    # archival objects dictionary, from the same index
     # form: {ao: {'collections': [collection], 'digital_objects': [do]}}
-
-    # initialize archival objects dictionary
-    archival_objects_dict = dict()
-
-    n = 0
-
-    for collection, ao_dict in collections_dict.items():
-
-        n += 1
-        print (n, end='\r')
-
-        for ao, do_list in ao_dict.items():
-
-            if archival_objects_dict.get(ao):
-
-                archival_objects_dict[ao]['collections'].append(collection)
-                archival_objects_dict[ao]['digital_objects'].extend(do_list)
-
-            else:
-
-                archival_objects_dict[ao] = {'collections': [collection], 'digital_objects': do_list}
+    archival_objects_dict = links.archival_objects_dict()
 
     print('Done building archival objects dictionary...')
 
 
-    return collections_dict, archival_objects_dict
+    return collections_dict, archival_objects_dict, digital_objects_dict
 
 
 #-----------------------------------------------------------------------#
@@ -355,10 +601,22 @@ def get_domain_from_url(file_url):
 
 #-----------------------------------------------------------------------#
 
+# returns digital object metadata from digital_objects_dict
+# falls back to the API for digital objects not found in digital_objects_dict
+def get_digital_object(client, do, digital_objects_dict=None):
+
+    if digital_objects_dict and do in digital_objects_dict:
+        return digital_objects_dict[do]
+
+    return client.get(do).json()
+
+
+#-----------------------------------------------------------------------#
+
 # returns list of published file URIs and use statements from digital objects in do_list
 # do_list is a list of digital object URIs
 # returns list of tuples: (file_uri, use_statement)
-def published_file_uris(client, do_list):
+def published_file_uris(client, do_list, digital_objects_dict=None):
 
     # create file_uris set
     file_uris = set()
@@ -367,10 +625,10 @@ def published_file_uris(client, do_list):
     for do in do_list:
 
         # get digital object metadata
-        obj = client.get(do).json()
+        obj = get_digital_object(client, do, digital_objects_dict)
 
         # iterate over file versions
-        for file_version in obj['file_versions']:
+        for file_version in obj.get('file_versions') or []:
 
             # only include published file versions with use statements not in exclude list
             # use default use statement of 'Web-Access' if none present
@@ -424,7 +682,7 @@ def get_set_id(collection_id):
 #-----------------------------------------------------------------------#
 
 # returns list of digital object types from digital objects in do_list
-def get_digital_object_type(client, do_list):
+def get_digital_object_type(client, do_list, digital_objects_dict=None):
 
     # ArchivesSpace digital_object_type_values
     # mapped to Dublin Core types
@@ -434,10 +692,11 @@ def get_digital_object_type(client, do_list):
     #     MovingImage, PhysicalObject, Service, Software, Sound,
     #     StillImage, Text
     # create list of types
-    type_list = [client.get(do).json().get('digital_object_type') for do in do_list]
+    type_list = [get_digital_object(client, do, digital_objects_dict).get('digital_object_type') for do in do_list]
 
-    # de-duplicate
-    type_list = list(set(type_list))
+    # de-duplicate, in sorted order so that the dc:type elements and the fragment key
+    # do not depend on the hash seed of the process (str: values may be None)
+    type_list = sorted(set(type_list), key=str)
 
     # map values to dc:type
     type_list = [digital_object_type_map.get(t) for t in type_list]
@@ -453,257 +712,1543 @@ def get_digital_object_type(client, do_list):
 
 #-----------------------------------------------------------------------#
 
-# refresh collections information to database from collections dictionary
-def database_refresh(client, collections_dict, runtype):
+# fetches records for a list of URIs using the id_set[] parameter of the API list endpoints,
+# e.g. /repositories/2/archival_objects?id_set[]=1&id_set[]=2&resolve[]=ancestors
+# URIs are grouped by endpoint and fetched in batches of batch_size
+# records found in the response cache are not fetched; fetched records are added to the cache
+# records not returned by the list endpoint are fetched individually
+# when batch_size <= 1, each record is fetched individually
+# returns dictionary of the form {uri: record}
+def fetch_records(client, uris, resolve=None, batch_size=1):
 
-    # open database connection
-    connection = sq.connect(dbpath)
-    cursor = connection.cursor()
+    resolve = resolve or list()
+    query = '&'.join('resolve[]=' + r for r in resolve)
 
-    # retrieve earliest date stamp from previous build
-    query = 'SELECT earliest FROM dates;'
-    result = cursor.execute(query)
-    earliestDatestamp = result.fetchone()[0]
+    # response cache, if the client has one
+    cache = client.cache if isinstance(client, CachingClient) else None
 
-    # retrieve included collections from db
-    # return dictionary of collection numbers and inclusion status
-    includedcollections = dict()
-    query = 'SELECT collno,incl FROM collections;'
-    for row in cursor.execute(query).fetchall():
-        includedcollections[row[0]] = row[1]
-    
-    if runtype == 'production':
+    records = dict()
 
-        # delete all records from db
-        query = 'DELETE FROM collections;'
-        cursor.execute(query)
+    # group URIs by endpoint: {endpoint: [id]}
+    batches = dict()
 
-    # iterate over collections dictionary to insert collection records into db
-    print ('Collections with digital objects...')
-    for collection in collections_dict:
+    for uri in uris:
 
-        # get collection info
-        coll_info = client.get(collection).json()
+        if batch_size <= 1:
+            records[uri] = client.get(uri + ('?' + query if query else '')).json()
+            continue
 
-        # create collection description from collection notes in ArchivesSpace
-        collid = coll_info['uri']
-        colltitle = coll_info['title']
-        description = create_collection_description(coll_info)
+        if cache:
+            text = cache.get(cache_key(uri, {'resolve[]': resolve}))
+            if text is not None:
+                records[uri] = json.loads(text)
+                continue
 
-        # initialize sets to count unique digital objects and archival objects
-        coll_dos, coll_aos = set(), set()
+        endpoint, id = uri.rsplit('/', 1)
+        batches.setdefault(endpoint, list()).append(id)
 
-        # extract collection type and number from collection id
-        if collid[16:25] == 'resources':
-            colltyp = 'resource'
-            collno = collid[26:]
-        else:
-            colltyp = 'accession'
-            collno = collid[27:]
+    for endpoint, ids in batches.items():
 
-        # iterate over collection to count unique digital objects and archival objects
-        for ao in collections_dict[collection]:
-            coll_aos.add(ao)
-            for do in collections_dict[collection][ao]:
-                coll_dos.add(do)
+        for i in range(0, len(ids), batch_size):
 
-        if runtype == 'production':
-        
-            # insert collection record into db
-            cursor.execute(dbq_collections_insert, 
-                           [collno,                              # collno (str)
-                            colltitle,                           # colltitle (str)
-                            description,                         # description (str)                 
-                            collid,                              # collid (str) 
-                            0,                                   # aocount (int) 
-                            0,                                   # docount (int) 
-                            includedcollections.get(collno, 0),  # incl (Boolean) 
-                            0,                                   # caltechlibrary (int)
-                            0,                                   # internetarchive (int)
-                            0,                                   # youtube (int) 
-                            0,                                   # other (int) 
-                            colltyp,                             # typ ('resource'|'accession')
-                            0,                                   # type_text (int)
-                            0,                                   # type_stillimage (int)
-                            0,                                   # type_movingimage (int)
-                            0,                                   # type_sound (int)
-                            0                                    # type_other (int)
-                            ])
-    
-        # print collection summary
-        print('>', client.get(collection).json()['title'],
-            '(' + str(len(coll_aos)) + ' archival objects; ' + str(len(coll_dos)) +  ' digital objects' + ')')
+            batch = ids[i:i+batch_size]
+            response = client.get(endpoint, params={'id_set[]': batch, 'resolve[]': resolve}).json()
 
-    if runtype == 'production':
-        # commit changes to db before reading
-        connection.commit()
+            for obj in response:
+                records[obj['uri']] = obj
+                if cache:
+                    cache.put(cache_key(obj['uri'], {'resolve[]': resolve}), json.dumps(obj))
 
-    # colls is a list of tuples: {(collno, colltitle, description, collid, aocount, docount, incl,
-    #                             caltechlibrary, internetarchive, youtube, other, typ,
-    #                             type_text, type_stillimage, type_movingimage, type_sound, type_other)}
-    colls = cursor.execute(qdb_collections_select).fetchall()
-    cursor.close()
-    connection.close()
+            # records missing from the response (e.g. deleted since the links were read)
+            for id in batch:
+                uri = endpoint + '/' + id
+                if uri not in records:
+                    records[uri] = client.get(uri + ('?' + query if query else '')).json()
 
-    return colls, earliestDatestamp
+    return records
 
 
 #-----------------------------------------------------------------------#
 
-# update collections
-def database_update(stats_dict, coll_mdate_dict):
+# returns the parts of an ancestor (series, subseries, collection) used in records:
+# tuple (level, title, [rights note]), where level is the level given in the ancestor ref
+# and the rights notes are the contents of the ancestor's userestrict notes
+def extract_ancestor(level, obj):
+
+    notes = list()
+    for n in obj.get('notes') or []:
+        if n.get('type'):
+            if n['type']=='userestrict':
+                if n['jsonmodel_type']=='note_singlepart':
+                    content = ' '.join(n['content'])
+                else:
+                    content = n['subnotes'][0]['content']
+                notes.append(content)
 
-    connection = sq.connect(dbpath)
-    db = connection.cursor()
-
-    for collid, values in stats_dict.items():
-        query = 'UPDATE collections SET aocount=? WHERE collid=?;'
-        db.execute(query, [values['archival_objects'], collid])
-
-        do_count = 0
-        for category, count in values['digital_objects'].items():
-            do_count += count
-            query = 'UPDATE collections SET '+category+'=? WHERE collid=?;'
-            db.execute(query, [count, collid])
-
-        query = 'UPDATE collections SET docount=? WHERE collid=?;'
-        db.execute(query, [do_count, collid])
-
-        for type_value, count in values.get('types', {}).items():
-            query = 'UPDATE collections SET type_'+type_value.lower()+'=? WHERE collid=?;'
-            db.execute(query, [count, collid])
-
-    # update last modified date by collection in db
-    query = 'UPDATE collections SET last_edit=? WHERE collid=?;'
-    today = date.today().strftime('%Y-%m-%d')
-    for collid, mod_date in coll_mdate_dict.items():
-        db.execute(query, [mod_date, collid])
-        earliestDatestamp = min(today, mod_date)
-
-    query = 'UPDATE dates SET earliest = ?'
-    db.execute(query, [earliestDatestamp])
-
-    # write ISO last update
-    now = datetime.now()
-    last_update = now.isoformat()
-    query = 'UPDATE last_update SET dt=? WHERE fn=?;'
-    db.execute(query, [last_update, 'xml'])
-
-    db.close()
-    connection.commit()
-    connection.close()
+    return level, obj.get('title'), notes
+
+
+#-----------------------------------------------------------------------#
+
+# adds the ancestors of archival objects in metadata_list to ancestors_cache
+# ancestors_cache has the form {ancestor: (level, title, [rights note])}
+# each ancestor is fetched once per build, instead of being resolved in every archival object
+def fetch_ancestors(client, metadata_list, ancestors_cache, batch_size=1):
+
+    metadata_list = list(metadata_list)
+
+    # ancestors not in cache: {ancestor: level}
+    def find_missing():
+        missing = dict()
+        for archival_object_metadata in metadata_list:
+            for a in archival_object_metadata.get('ancestors', []):
+                if a['ref'] not in ancestors_cache:
+                    missing[a['ref']] = a.get('level')
+        return missing
+
+    if not find_missing():
+        return
+
+    # one worker thread fetches at a time, so workers starting on the same series
+    # do not all fetch it; ancestors fetched while waiting are not fetched again
+    with ancestors_lock:
+        missing = find_missing()
+        if missing:
+            for uri, obj in fetch_records(client, list(missing), batch_size=batch_size).items():
+                ancestors_cache[uri] = extract_ancestor(missing[uri], obj)
 
     return
 
 
-#-----------------------------------------------------------------------#
-# START OF SCRIPT 
-# 
-# Contents
-# 
-# 1. ESTABLISH API CONNECTION
-# 2. BUILD COLLECTIONS DICTIONARIES
-# 3. READ/WRITE COLLECTION DATA TO DATABASE FROM ARCHIVESSPACE
-# 4. BUILD OAI-PMH XML OBJECT (oaixml)
-# 5. UPDATE DATABASE
-# 6. WRITE XML TO DISK
 #-----------------------------------------------------------------------#
 
-def main():
+# fetches archival object metadata, published file URIs and digital object types for a batch 
+# of archival objects. batch is a list of (ao, colls_dict) tuples from archival_objects_dict
+# digital objects not found in digital_objects_dict and archival objects are fetched with fetch_records()
+# archival object metadata is not fetched (None) if the archival object has no published file URIs,
+# or if its record can be reused from the previous build (prior_records, incremental builds)
+# ancestors of the fetched archival objects are added to ancestors_cache
+# returns list of tuples, in batch order: (ao, colls_dict, archival_object_metadata, file_uris, type_list)
+def fetch_archival_objects(client, batch, digital_objects_dict=None, prior_records=None, batch_size=1,
+                           ancestors_cache=None):
+
+    # fetch digital objects not found in digital_objects_dict
+    missing = [do for ao, colls_dict in batch for do in colls_dict['digital_objects'] 
+                    if not digital_objects_dict or do not in digital_objects_dict]
+    if missing:
+        digital_objects = fetch_records(client, list(dict.fromkeys(missing)), batch_size=batch_size)
+        if digital_objects_dict:
+            digital_objects = ChainMap(digital_objects, digital_objects_dict)
+    else:
+        digital_objects = digital_objects_dict
 
-    #-----------------------------------------------------------------------#
-    # RUNTYPE VARAIBLES
+    results = list()
 
-    # set -r to 'test' or 'dev' or anything except 'production' for test or development runs
-    # default -r is 'production'
-    # set -n to limit number of records processed (for testing)
-    # default -n is 1000 for development runtype
-    # default -n is all records for production runtype
-    # stats are not updated when runtype != 'production'
-    # output xml file is staticrepo_test.xml for test or development runtype
-    # output xml file is staticrepo.xml for production runtype
+    # archival objects to fetch
+    pending = list()
 
-    # Initialize parser
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-r', '--runtype', default='production')
-    parser.add_argument('-n', '--num_recs', default=-1, type=int)
+    for ao, colls_dict in batch:
 
-    # Read arguments from command line
-    args = parser.parse_args()
-    runtype = args.runtype
-    num_recs = args.num_recs
+        # create list of associated digital objects
+        do_list = colls_dict['digital_objects']
 
-    if runtype == 'production':
-        print('Running in production mode...')
-        print('Processing all records...')
-        xml_output_path = Path(Path(__file__).resolve().parent).joinpath('../xml/staticrepo.xml')
-        dup_output_path = Path(Path(__file__).resolve().parent).joinpath('../xml/duplicates.txt')
+        # remove unpublished, redirects
+        file_uris = published_file_uris(client, do_list, digital_objects)
 
-    else:
-        print('Running in', runtype, 'mode...')
-        if num_recs < 0:
-            num_recs = 1000
-        print('Limiting to', num_recs, 'records for testing...')
-        xml_output_path = Path(Path(__file__).resolve().parent).joinpath('../dev/staticrepo.xml')
-        dup_output_path = Path(Path(__file__).resolve().parent).joinpath('../dev/duplicates.txt')
+        # archival object metadata and digital object types are only needed if 
+        # the archival object has published file URIs
+        if not file_uris:
+            results.append((ao, colls_dict, file_uris, list()))
+            continue
 
-    start = time.time()
+        type_list = get_digital_object_type(client, do_list, digital_objects)
+        results.append((ao, colls_dict, file_uris, type_list))
 
-    #-----------------------------------------------------------------------#
-    # 1. ESTABLISH API CONNECTION
-    #-----------------------------------------------------------------------#
-    
-    print('Authorizing API...')
-    client = authorize_api()
+        # fetch metadata unless the record is unchanged since the previous build
+        if not (prior_records and ao in prior_records):
+            pending.append(ao)
 
-    #-----------------------------------------------------------------------#
-    # 2. BUILD COLLECTIONS DICTIONARIES
-    #-----------------------------------------------------------------------#
-    # builds two dictionaries: for collections and archival objects
-    # collections_dict has the form {collection: {ao: {do}}}
-    # archival_objects_dict has the form {ao: {'collections': [collection], 'digital_objects: [do]}}
+    # get archival object metadata
+    metadata = fetch_records(client, pending, archival_object_resolve, batch_size)
 
-    print('Building collections dictionary...')
-    collections_dict, archival_objects_dict = build_collections_dict(client)
+    # get ancestors not already in ancestors_cache
+    if ancestors_cache is not None:
+        fetch_ancestors(client, metadata.values(), ancestors_cache, batch_size)
 
-    #-----------------------------------------------------------------------#
-    # 3. READ/WRITE COLLECTION DATA TO DATABASE FROM ARCHIVESSPACE
-    #-----------------------------------------------------------------------#
-    # db location
-    # relevant tables in database:
-    #   collections - records data about collections with digital content
-    #   dates - records dates of last updates of XML file and collection selection
-    #   logs - logs data provider requests (used in oaidp.py)
+    return [(ao, colls_dict, metadata.get(ao), file_uris, type_list) 
+                for ao, colls_dict, file_uris, type_list in results]
 
-    print('Refreshing database...')
-    colls, earliestDatestamp = database_refresh(client, collections_dict, runtype)
-    
-    #-----------------------------------------------------------------------#
-    # 4. BUILD OAI-PMH XML OBJECT (oaixml)
-    #-----------------------------------------------------------------------#
 
-    print('Building static repository...')
+#-----------------------------------------------------------------------#
 
-    # namespace dictionary
-    ET.register_namespace('', 'http://www.openarchives.org/OAI/2.0/')
-    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
-    ET.register_namespace('oai_dc', 'http://www.openarchives.org/OAI/2.0/oai_dc/')
-    ET.register_namespace('dc', 'http://purl.org/dc/elements/1.1/')
+# fetches archival objects using a bounded pool of worker threads
+# items is an iterable of (ao, colls_dict) tuples from archival_objects_dict
+# items are fetched in batches of batch_size (see fetch_records()); each worker fetches one batch at a time
+# results are yielded in the same order as items, so the output (including 
+# duplicate URI detection) is identical to a serial run
+def harvest_archival_objects(client, items, digital_objects_dict=None, workers=1, prior_records=None, batch_size=1,
+                             ancestors_cache=None):
 
-    # create OAI-PMH XML object
-    oaixml = ET.Element('OAI-PMH', {'xmlns':'http://www.openarchives.org/OAI/2.0/',
-        'xmlns:xsi':'http://www.w3.org/2001/XMLSchema-instance',
-        'xsi:schemaLocation':'http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd'})
+    # split items into batches
+    items = iter(items)
+    batches = iter(lambda: list(islice(items, max(batch_size, 1))), [])
 
-    # build Identify segment
-    Identify = ET.SubElement(oaixml, 'Identify')
-    repositoryName = ET.SubElement(Identify, 'repositoryName')
-    repositoryName.text = 'Caltech Archives Digital Collections'
-    baseURL = ET.SubElement(Identify, 'baseURL')
-    baseURL.text = 'http://apps.library.caltech.edu/ead2dc/oai'
-    protocolVersion = ET.SubElement(Identify, 'protocolVersion')
-    protocolVersion.text = '2.0'
-    adminEmail = ET.SubElement(Identify, 'adminEmail')
+    # serial harvest
+    if workers <= 1:
+        for batch in batches:
+            yield from fetch_archival_objects(client, batch, digital_objects_dict, prior_records, batch_size,
+                                              ancestors_cache)
+        return
+
+    # concurrent harvest
+    # the number of pending requests is limited so results are not held in memory
+    # faster than the records can be built
+    window = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        pending = deque()
+
+        for batch in batches:
+
+            pending.append(executor.submit(fetch_archival_objects, 
+                                           client, batch, digital_objects_dict, prior_records, batch_size,
+                                           ancestors_cache))
+
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+#-----------------------------------------------------------------------#
+
+# returns the archival objects of a collection (resource) in collection order, from its tree
+# uses /repositories/2/resources/{id}/ordered_records, which returns the whole tree in one request
+# ancestor chains and levels are computed from the depth of each tree entry
+# returns list of tuples: (ao, [{'ref': ancestor, 'level': level}]), ancestors nearest first
+def get_collection_tree(client, collection):
+
+    tree = client.get(collection + '/ordered_records').json()
+
+    archival_objects = list()
+
+    # chain of ancestors of the current entry, collection first
+    chain = list()
+
+    for entry in tree.get('uris', []):
+
+        depth = entry.get('depth', 0)
+
+        # ancestors of this entry are the entries above it at lower depths
+        del chain[depth:]
+
+        if depth > 0:
+            archival_objects.append((entry['ref'], list(reversed(chain))))
+
+        chain.append({'ref': entry['ref'], 'level': entry.get('level')})
+
+    return archival_objects
+
+
+#-----------------------------------------------------------------------#
+
+# yields (ao, colls_dict) items of archival_objects_dict in collection order (collection-tree harvest)
+# resources in collections_dict are walked in turn with get_collection_tree()
+# before the items of each collection are yielded, the ancestors of its archival objects are
+# fetched into ancestors_cache in batches (except for records reused from the previous build)
+# archival objects not found in a resource tree (e.g. linked only to accessions) follow
+# in archival_objects_dict order
+def order_by_collection_tree(client, collections_dict, archival_objects_dict, ancestors_cache, 
+                             prior_records=None, batch_size=1):
+
+    # archival objects already yielded
+    seen = set()
+
+    for collection in collections_dict:
+
+        # accessions have no tree
+        if '/resources/' not in collection:
+            continue
+
+        items = list()
+
+        # ancestors to fetch: {ancestor: level}
+        missing = dict()
+
+        for ao, chain in get_collection_tree(client, collection):
+
+            if ao in seen or ao not in archival_objects_dict:
+                continue
+
+            seen.add(ao)
+            items.append((ao, archival_objects_dict[ao]))
+
+            if not (prior_records and ao in prior_records):
+                for a in chain:
+                    if a['ref'] not in ancestors_cache:
+                        missing[a['ref']] = a['level']
+
+        if missing:
+            for uri, obj in fetch_records(client, list(missing), batch_size=batch_size).items():
+                ancestors_cache[uri] = extract_ancestor(missing[uri], obj)
+
+        yield from items
+
+    for ao, colls_dict in archival_objects_dict.items():
+        if ao not in seen:
+            yield ao, colls_dict
+
+
+#-----------------------------------------------------------------------#
+
+# categorizes hostname for collection statistics
+def get_host_category(hostname):
+
+    if hostname in ['caltech.edu', 'californiarevealed.org']:
+        return 'caltechlibrary'
+    elif hostname == 'archive.org':
+        return 'internetarchive'
+    elif hostname in ['youtube.com', 'youtu.be']:
+        return 'youtube'
+    else:
+        return 'other'
+
+
+#-----------------------------------------------------------------------#
+
+# adds a record to collection statistics and last modified dates
+# stats_dict has the form {collid: {'archival_objects': #, 'digital_objects': {hostcategory: #}, 'types': {type: #}}}
+# coll_mdate_dict has the form {collid: 'mdate'}
+def update_stats(stats_dict, coll_mdate_dict, collections, file_uris, type_list, last_modified_date):
+
+    for collid in collections:
+
+        # add archival record to stats_dict
+        if stats_dict.get(collid):
+            stats_dict[collid]['archival_objects'] += 1
+        else:
+            stats_dict[collid] = {'archival_objects': 1, 'digital_objects': dict(), 'types': dict()}
+
+        # track last modified date by collection
+        if coll_mdate_dict.get(collid):
+            if last_modified_date > coll_mdate_dict[collid]:
+                coll_mdate_dict[collid] = last_modified_date
+        else:
+            coll_mdate_dict[collid] = last_modified_date
+
+    # create hostnames set
+    hostnames = create_valid_hostnames_set(file_uris)
+
+    for f_uri, f_use in file_uris:
+
+        # skip excluded hostnames
+        hostname = get_domain_from_url(f_uri)
+        if hostname not in hostnames:
+            continue
+
+        # omit thumbnail links from statistics
+        if 'thumbnail' in f_use.lower():
+            continue
+
+        hostcategory = get_host_category(hostname)
+
+        for collid in collections:
+            if stats_dict[collid]['digital_objects'].get(hostcategory):
+                stats_dict[collid]['digital_objects'][hostcategory] += 1
+            else:
+                stats_dict[collid]['digital_objects'][hostcategory] = 1
+
+    # add types to stats_dict
+    # types are counted in the last collection of the record
+    collid = collections[-1]
+    for type_value in type_list:
+        if stats_dict[collid]['types'].get(type_value):
+            stats_dict[collid]['types'][type_value] += 1
+        else:
+            stats_dict[collid]['types'][type_value] = 1
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# builds the OAI-PMH record element for an archival object
+# the record is not attached to a parent element
+def build_record(ao, colls_dict, archival_object_metadata, file_uris, type_list, last_modified_date, ancestors_cache):
+
+    # create hostnames set
+    hostnames = create_valid_hostnames_set(file_uris)
+
+    # record element
+    record = ET.Element('record')
+
+    # header element
+    header = ET.SubElement(record, 'header')
+
+    identifier = ET.SubElement(header, 'identifier')
+    identifier.text = identifier_base + ao
+    #identifier.attrib = {'type': 'archival'}
+
+    # datestamp element
+    datestamp = ET.SubElement(header, 'datestamp')
+    datestamp.text = last_modified_date
+
+    # setSpec element
+    for collid in colls_dict['collections']:
+
+        setspec = ET.SubElement(header, 'setSpec')
+        setspec.text = get_set_id(collid)
+
+    # create metadata element
+    metadata = ET.SubElement(record, 'metadata')
+
+    # dc element
+    dc = ET.SubElement(metadata, 'oai_dc:dc', dict(dc_namespaces))
+    
+    title = ET.SubElement(dc, 'dc:title')
+    title.text = archival_object_metadata['title']
+    #title.attrib = {'type': 'archival'}
+
+    # creators, subjects
+    creators = list()
+    subjects = list()
+    for linked_agent in archival_object_metadata.get('linked_agents', []):
+        if linked_agent.get('role') == 'creator':
+            if linked_agent.get('_resolved'):
+                name = linked_agent['_resolved'].get('title')
+                role = relator_map.get(linked_agent.get('relator'), None)
+                if role:
+                    name = name + ', ' + relator_map[linked_agent.get('relator')]
+                creators.append(name)
+        if linked_agent.get('role') == 'subject':
+            if linked_agent.get('_resolved'):
+                name = linked_agent['_resolved'].get('title')
+                subjects.append((name, None))
+ 
+    for c in creators:
+        creator = ET.SubElement(dc, 'dc:creator')
+        creator.text = c
+
+    # subjects
+    for s in archival_object_metadata.get('subjects', []):
+        if s.get('_resolved'):
+            source = s['_resolved'].get('source')
+            if s['_resolved'].get('title'):
+                subject = s['_resolved']['title']
+                subjects.append((subject, source))
+
+    for s in subjects:
+        if s:
+            subject = ET.SubElement(dc, 'dc:subject')
+            subject.text = s[0]
+            if s[1]:
+                subject.attrib = {'source': s[1]}
+    
+    # description, rights
+    # list to capture rights info from userestrict note
+    # format: list of tuples [(level, content)]
+    # levels are in order of preference: 'x_item', 'subseries', 'series', 'collection'
+    rights = list()
+    for note in archival_object_metadata.get('notes', []):
+
+        if note.get('publish') and (note['type'] == 'scopecontent' or note['type'] == 'abstract'):
+            if note['jsonmodel_type'] == 'note_singlepart':
+                desc_text = note['content'][0]
+            elif note['jsonmodel_type'] == 'note_multipart':
+                desc_text = note['subnotes'][0]['content']
+
+            description = ET.SubElement(dc, 'dc:description')
+            description.text = desc_text
+
+        if note.get('publish') and (note['type'] == 'userestrict'):
+            if note['jsonmodel_type'] == 'note_singlepart':
+                item_rights_note = note['content'][0]
+            elif note['jsonmodel_type'] == 'note_multipart':
+                item_rights_note = note['subnotes'][0]['content']
+
+            # capture item rights info for use below
+            rights.append(('x_item', item_rights_note))
+            
+            '''
+            # optional description attribute
+            description.attrib = {'type': 'scopecontent' if note['type']=='scopecontent' else 'abstract',
+                                  'label': 'Scope and Content' if note['type']=='scopecontent' else 'Abstract'}
+            '''
+
+    for file_uri in file_uris: 
+
+        # parse url
+        hostname = get_domain_from_url(file_uri[0])
+
+        # skip excluded hostnames
+        if hostname not in hostnames:
+            continue
+
+        # identifier element
+        # unpack tuple
+        f_uri, f_use = file_uri
+        identifier = ET.SubElement(dc, 'dc:identifier')
+        identifier.text = f_uri
+        identifier.attrib = {'scheme': 'URI', 'type': f_use if f_use else 'unknown'}
+
+    # identifier element
+    if archival_object_metadata.get('component_id'):
+        identifier = ET.SubElement(dc, 'dc:identifier')
+        identifier.text = archival_object_metadata['component_id']
+        identifier.attrib = {'type': 'localid'}
+
+    # dates
+    for dt in archival_object_metadata.get('dates', []):
+
+        if dt.get('expression'):
+            date_expression = dt['expression']
+        else:
+            date_expression = ''
+            if dt.get('begin'):
+                date_expression += dt['begin']
+            if dt.get('end'):
+                if date_expression != '':
+                    date_expression += ' - '
+                date_expression += dt['end']
+
+        if date_expression:
+            date_elem = ET.SubElement(dc, 'dc:date')
+            date_elem.text = date_expression
+            attribs = dict()
+            if dt.get('begin'):
+                attribs['begin'] = dt['begin']
+            if dt.get('end'):
+                attribs['end'] = dt['end']
+            if dt.get('date_type'):
+                attribs['type'] = dt['date_type']
+            if dt.get('label'):
+                attribs['label'] = dt['label']
+            if dt.get('certainty'):
+                attribs['certainty'] = dt['certainty']
+            if attribs != dict():
+                date_elem.attrib = attribs
+
+    # type
+    for type_value in type_list:
+        type_el = ET.SubElement(dc, 'dc:type')
+        type_el.text = type_value
+
+    # extents
+    extents = list()
+    for extent in archival_object_metadata.get('extents', []):
+        s = extent.get('number', '') + ' ' + extent.get('extent_type', '') + ' ' + extent.get('physical_details', '').strip()
+        extents.append(s)
+
+    for e in extents:
+        if e.strip() != '':
+            extent = ET.SubElement(dc, 'dc:format')
+            extent.text = e.strip()
+
+    # relation, rights
+    # ancestors_cache has the form {ancestor: (level, title, [rights note])}, see fetch_ancestors()
+    ancestors = list()
+    for a in archival_object_metadata.get('ancestors', []):
+        level, title, notes = ancestors_cache[a['ref']]
+
+        if title:
+            ancestors.append((level, title))
+
+        for content in notes:
+            rights.append((level, content))
+
+    # relation
+    for a in ancestors:
+        if a:
+            ancestor = ET.SubElement(dc, 'dc:relation')
+            ancestor.text = a[1]
+            if a[1]:
+                ancestor.attrib = {'level': a[0]}
+    
+    # rights
+    # sort order: 'x_item', 'subseries', 'series', 'collection'
+    rights.sort(reverse=True)
+
+    rights_el = ET.SubElement(dc, 'dc:rights')
+
+    ok = False
+
+    for r in rights:
+        if r[1]:
+            rights_el.text = r[1]
+            ok = True
+            break
+
+    if not ok:
+
+        rights_el.text = default_rights_statement
+
+    return record
+
+
+
+#-----------------------------------------------------------------------#
+
+# returns the datestamp of a record (YYYY-MM-DD): the latest of the create, system and user
+# modification times of the archival object
+def get_last_modified_date(archival_object_metadata):
+
+    create_time = archival_object_metadata['create_time']
+    system_mtime = archival_object_metadata['system_mtime']
+    user_mtime = archival_object_metadata['user_mtime']
+
+    return max([create_time, system_mtime, user_mtime])[:10]
+
+
+#-----------------------------------------------------------------------#
+
+# builds the record for a fetched archival object
+# with fragments (fragcache.FragmentCache), the record is returned serialized (see serialize_element()),
+# and is read from the cache if its inputs are unchanged since it was last built
+# returns tuple: (record, last_modified_date, [ancestor])
+def build_archival_object(ao, colls_dict, archival_object_metadata, file_uris, type_list, ancestors_cache,
+                          fragments=None):
+
+    # string form of date to write to each record
+    last_modified_date = get_last_modified_date(archival_object_metadata)
+
+    ancestors = [a['ref'] for a in archival_object_metadata.get('ancestors', [])]
+
+    if fragments is None:
+        record = build_record(ao, colls_dict, archival_object_metadata, file_uris, type_list, last_modified_date, 
+                              ancestors_cache)
+        return record, last_modified_date, ancestors
+
+    # hash of everything the record is built from
+    key = fragment_key(record_format_version, identifier_base, fragments.indent, ao, archival_object_metadata,
+                       colls_dict['collections'], file_uris, type_list, 
+                       [ancestors_cache.get(ancestor) for ancestor in ancestors])
+
+    record = fragments.get(ao, key)
+
+    if record is None:
+        record = serialize_element(build_record(ao, colls_dict, archival_object_metadata, file_uris, type_list, 
+                                                last_modified_date, ancestors_cache), 2, fragments.indent)
+        fragments.put(ao, key, record)
+
+    return record, last_modified_date, ancestors
+
+
+#-----------------------------------------------------------------------#
+
+# builds records for the results of harvest_archival_objects()
+# yields tuples: (ao, colls_dict, file_uris, type_list, built)
+# built is the result of build_archival_object(), or None if the archival object was not fetched
+# (no published file URIs, or record reused from the previous build)
+def build_archival_objects(harvest, ancestors_cache, fragments=None):
+
+    for ao, colls_dict, archival_object_metadata, file_uris, type_list in harvest:
+
+        if archival_object_metadata is None:
+            yield ao, colls_dict, file_uris, type_list, None
+        else:
+            yield ao, colls_dict, file_uris, type_list, \
+                build_archival_object(ao, colls_dict, archival_object_metadata, file_uris, type_list, ancestors_cache,
+                                      fragments)
+
+
+#-----------------------------------------------------------------------#
+
+# computes collection statistics without building records (--stats-only)
+# items is an iterable of (ao, colls_dict) tuples from archival_objects_dict
+# archival objects with published file URIs are fetched (with harvest_archival_objects(), so from the 
+# response cache where possible) for their last modified dates; ancestors are not fetched
+# records with duplicate file URIs are skipped, as in a full build
+# records are counted in report (BuildReport), if given
+# returns stats_dict and coll_mdate_dict (see update_stats()), and the earliest datestamp of the records
+def build_stats(client, items, digital_objects_dict, workers=1, batch_size=1, report=None):
+
+    stats_dict, coll_mdate_dict = dict(), dict()
+    earliest_datestamp = None
+    file_uri_set, duplicate_uris_set = set(), set()
+
+    for ao, colls_dict, archival_object_metadata, file_uris, type_list in \
+            harvest_archival_objects(client, items, digital_objects_dict, workers, None, batch_size):
+
+        # display archival object id
+        print(ao, '   ', end='\r')
+
+        # skip archival object if no published digital object file URIs
+        if len(file_uris) == 0:
+            if report:
+                report.count('no_file_uris')
+            continue
+
+        # skip archival object if duplicate uri
+        if check_duplicates(file_uris, file_uri_set, duplicate_uris_set):
+            if report:
+                report.count('duplicates')
+            continue
+
+        if report:
+            report.count('emitted')
+
+        last_modified_date = get_last_modified_date(archival_object_metadata)
+        earliest_datestamp = min(earliest_datestamp or last_modified_date, last_modified_date)
+
+        update_stats(stats_dict, coll_mdate_dict, colls_dict['collections'], file_uris, type_list, last_modified_date)
+
+    return stats_dict, coll_mdate_dict, earliest_datestamp
+
+
+#-----------------------------------------------------------------------#
+
+# returns the shard of an archival object, from a hash of its (first) collection
+# so all archival objects of a collection, which share ancestors, are built by the same process
+def get_shard(colls_dict, shards):
+    return zlib.crc32(colls_dict['collections'][0].encode('utf-8')) % shards
+
+
+#-----------------------------------------------------------------------#
+
+# state of a shard worker process, set by init_shard_worker()
+shard_state = dict()
+
+# sets up a shard worker process: API connection, response cache, fragment cache and build settings
+# ancestors_cache holds the ancestors already fetched by the main process (e.g. with -t)
+# fragments_path is the fragment cache database (None for no fragment cache), indent its indentation
+def init_shard_worker(backend, concurrency, rate, retries, use_cache, digital_objects_dict, prior_keys, workers, batch_size,
+                      ancestors_cache, fragments_path, indent):
+
+    report = BuildReport()
+    client = attach_report(authorize_api(backend, concurrency, workers, rate, retries), report)
+    if use_cache:
+        client = CachingClient(client, ResponseCache(cachepath))
+
+    shard_state.update(client=client,
+                       report=report,
+                       digital_objects_dict=digital_objects_dict,
+                       prior_keys=prior_keys,
+                       workers=workers,
+                       batch_size=batch_size,
+                       ancestors_cache=dict(ancestors_cache),
+                       fragments=FragmentCache(fragments_path, indent) if fragments_path else None)
+
+
+#-----------------------------------------------------------------------#
+
+# fetches and builds the records for a chunk of (ao, colls_dict) items in a shard worker process
+# returns tuple: ([(file_uris, type_list, built)] in chunk order, see build_archival_objects(),
+#                 API statistics of the worker process since the previous chunk, see BuildReport.take_api())
+def build_shard_chunk(chunk):
+
+    harvest = harvest_archival_objects(shard_state['client'], chunk, shard_state['digital_objects_dict'],
+                                       shard_state['workers'], shard_state['prior_keys'], 
+                                       shard_state['batch_size'], shard_state['ancestors_cache'])
+
+    results = [(file_uris, type_list, built) 
+                for ao, colls_dict, file_uris, type_list, built in 
+                    build_archival_objects(harvest, shard_state['ancestors_cache'], shard_state['fragments'])]
+
+    if shard_state['fragments']:
+        shard_state['fragments'].flush()
+
+    return results, shard_state['report'].take_api()
+
+
+#-----------------------------------------------------------------------#
+
+# fetches and builds records in shards worker processes (--shards)
+# items are partitioned by collection (get_shard()); each shard is split into chunks of shard_chunk_size
+# results are merged in items order, so duplicate URI detection and statistics (in main()) are 
+# the same as in a single process build
+# API statistics of the worker processes are added to report
+# fragments (fragcache.FragmentCache) is opened by each worker process
+# yields tuples: (ao, colls_dict, file_uris, type_list, built), see build_archival_objects()
+def harvest_shards(items, shards, backend, concurrency, rate, retries, use_cache, digital_objects_dict, 
+                   prior_records, workers=1, batch_size=1, ancestors_cache=None, report=None, 
+                   fragments=None):
+
+    items = list(items)
+
+    # shard of each item, in items order
+    assignments = [get_shard(colls_dict, shards) for ao, colls_dict in items]
+
+    # chunks of each shard, in items order
+    chunks = [list() for shard in range(shards)]
+    for item, shard in zip(items, assignments):
+        if not chunks[shard] or len(chunks[shard][-1]) >= shard_chunk_size:
+            chunks[shard].append(list())
+        chunks[shard][-1].append(item)
+    chunks = [iter(shard_chunks) for shard_chunks in chunks]
+
+    prior_keys = set(prior_records) if prior_records else None
+
+    # processes are forked, so the worker processes share the settings of this process
+    context = multiprocessing.get_context('fork')
+
+    with ProcessPoolExecutor(max_workers=shards, mp_context=context, initializer=init_shard_worker,
+                             initargs=(backend, concurrency, rate / shards, retries, use_cache, digital_objects_dict, 
+                                       prior_keys, workers, batch_size, ancestors_cache or {},
+                                       fragments.path if fragments else None, 
+                                       fragments.indent if fragments else None)) as executor:
+
+        # pending chunks of each shard, at most two per shard
+        pending = [deque() for shard in range(shards)]
+
+        def submit(shard):
+            chunk = next(chunks[shard], None)
+            if chunk is not None:
+                pending[shard].append(executor.submit(build_shard_chunk, chunk))
+
+        for shard in range(shards):
+            submit(shard)
+            submit(shard)
+
+        # results of the current chunk of each shard
+        results = [deque() for shard in range(shards)]
+
+        for (ao, colls_dict), shard in zip(items, assignments):
+
+            if not results[shard]:
+                chunk_results, api = pending[shard].popleft().result()
+                results[shard].extend(chunk_results)
+                if report:
+                    report.merge_api(api)
+                submit(shard)
+
+            file_uris, type_list, built = results[shard].popleft()
+            yield ao, colls_dict, file_uris, type_list, built
+
+
+#-----------------------------------------------------------------------#
+
+# fetches collection (resource, accession) metadata for collections in collections_dict
+# collections are fetched once each, concurrently when workers > 1
+# collection records are also kept in the response cache, which is shared with app/aspace.py
+# returns dictionary of the form {collection: {'title': title, 'description': description}}
+def fetch_collection_info(client, collections_dict, workers=1):
+
+    def get_collection(collection):
+        coll_info = client.get(collection).json()
+        return collection, {'title': coll_info['title'],
+                            'description': create_collection_description(coll_info)}
+
+    if workers <= 1:
+        return dict(get_collection(collection) for collection in collections_dict)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(get_collection, collections_dict))
+
+
+#-----------------------------------------------------------------------#
+
+# refresh collections information to database from collections dictionary
+# collection_info_dict has the form {collection: {'title': title, 'description': description}}
+def database_refresh(collections_dict, collection_info_dict, runtype):
+
+    # open database connection
+    connection = sq.connect(dbpath)
+    cursor = connection.cursor()
+
+    # retrieve earliest date stamp from previous build
+    query = 'SELECT earliest FROM dates;'
+    result = cursor.execute(query)
+    earliestDatestamp = result.fetchone()[0]
+
+    # retrieve included collections from db
+    # return dictionary of collection numbers and inclusion status
+    includedcollections = dict()
+    query = 'SELECT collno,incl FROM collections;'
+    for row in cursor.execute(query).fetchall():
+        includedcollections[row[0]] = row[1]
+    
+    if runtype == 'production':
+
+        # delete all records from db
+        query = 'DELETE FROM collections;'
+        cursor.execute(query)
+
+    # iterate over collections dictionary to insert collection records into db
+    print ('Collections with digital objects...')
+    for collection in collections_dict:
+
+        # get collection info
+        # collection description was created from collection notes in ArchivesSpace
+        collid = collection
+        colltitle = collection_info_dict[collection]['title']
+        description = collection_info_dict[collection]['description']
+
+        # initialize sets to count unique digital objects and archival objects
+        coll_dos, coll_aos = set(), set()
+
+        # extract collection type and number from collection id
+        colltyp, collno = get_collection_type(collid)
+
+        # iterate over collection to count unique digital objects and archival objects
+        for ao, dos in collections_dict[collection].items():
+            coll_aos.add(ao)
+            coll_dos.update(dos)
+
+        if runtype == 'production':
+        
+            # insert collection record into db
+            cursor.execute(dbq_collections_insert, 
+                           [collno,                              # collno (str)
+                            colltitle,                           # colltitle (str)
+                            description,                         # description (str)                 
+                            collid,                              # collid (str) 
+                            0,                                   # aocount (int) 
+                            0,                                   # docount (int) 
+                            includedcollections.get(collno, 0),  # incl (Boolean) 
+                            0,                                   # caltechlibrary (int)
+                            0,                                   # internetarchive (int)
+                            0,                                   # youtube (int) 
+                            0,                                   # other (int) 
+                            colltyp,                             # typ ('resource'|'accession')
+                            0,                                   # type_text (int)
+                            0,                                   # type_stillimage (int)
+                            0,                                   # type_movingimage (int)
+                            0,                                   # type_sound (int)
+                            0                                    # type_other (int)
+                            ])
+    
+        # print collection summary
+        print('>', colltitle,
+            '(' + str(len(coll_aos)) + ' archival objects; ' + str(len(coll_dos)) +  ' digital objects' + ')')
+
+    if runtype == 'production':
+        # commit changes to db before reading
+        connection.commit()
+
+    # colls is a list of tuples: {(collno, colltitle, description, collid, aocount, docount, incl,
+    #                             caltechlibrary, internetarchive, youtube, other, typ,
+    #                             type_text, type_stillimage, type_movingimage, type_sound, type_other)}
+    colls = cursor.execute(qdb_collections_select).fetchall()
+    cursor.close()
+    connection.close()
+
+    return colls, earliestDatestamp
+
+
+#-----------------------------------------------------------------------#
+
+# returns collection type and number from collection id
+# e.g. '/repositories/2/resources/123' returns ('resource', '123')
+def get_collection_type(collid):
+
+    if collid[16:25] == 'resources':
+        return 'resource', collid[26:]
+    else:
+        return 'accession', collid[27:]
+
+
+#-----------------------------------------------------------------------#
+
+# returns one complete row of collection statistics for dbq_collections_stats_update
+def collection_stats_row(collid, values, mod_date):
+
+    # digital objects by host category
+    hosts = [values['digital_objects'].get(category, 0) for category in host_categories]
+
+    # digital objects by type, types without their own column are counted as 'other'
+    types = dict.fromkeys(type_columns, 0)
+    for type_value, count in values.get('types', {}).items():
+        column = type_value.lower() if type_value.lower() in type_columns else 'other'
+        types[column] += count
+
+    return [values['archival_objects'],             # aocount
+            sum(values['digital_objects'].values()) # docount
+            ] + hosts + [types[t] for t in type_columns] + [mod_date, collid]
+
+
+#-----------------------------------------------------------------------#
+
+# update collections
+# writes one complete row of statistics per collection in a single transaction
+# earliest_datestamp is the earliest datestamp of all records in the repository (not written if None)
+# last_update is the time the build started, used as the starting point of the next incremental build
+# it is not written if xml_updated is False (--stats-only, staticrepo.xml is not rebuilt)
+def database_update(stats_dict, coll_mdate_dict, earliest_datestamp=None, last_update=None, xml_updated=True):
+
+    connection = sq.connect(dbpath)
+
+    with connection:
+
+        connection.execute(dbq_collections_index)
+
+        rows = [collection_stats_row(collid, values, coll_mdate_dict.get(collid)) 
+                    for collid, values in stats_dict.items()]
+        connection.executemany(dbq_collections_stats_update, rows)
+
+        # earliest date stamp of the repository
+        if earliest_datestamp is not None:
+            today = date.today().strftime('%Y-%m-%d')
+            connection.execute('UPDATE dates SET earliest = ?', [min(today, earliest_datestamp)])
+
+        # write ISO last update
+        if xml_updated:
+            if last_update is None:
+                last_update = datetime.now()
+            query = 'UPDATE last_update SET dt=? WHERE fn=?;'
+            connection.execute(query, [last_update.isoformat(), 'xml'])
+
+    connection.close()
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# reads the state of the previous build (incremental builds)
+# state has the form {'started': 'ISO date', 'digital_objects': digital_objects_dict, 'ancestors': {ao: [ancestor]}}
+# returns None if there is no previous build state
+def read_build_state(state_path):
+
+    if not Path(state_path).exists():
+        return None
+
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+
+    return state
+
+
+#-----------------------------------------------------------------------#
+
+# writes the state of this build for the next incremental build
+# the file is written to a temporary file and renamed, so a failed build does not leave a partial state
+def write_build_state(state_path, started, digital_objects_dict, ancestors_dict):
+
+    state = {'started': started.isoformat(),
+             'digital_objects': digital_objects_dict,
+             'ancestors': ancestors_dict}
+
+    tmp_path = Path(state_path).with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# converts a record read from XML back to the form built by build_record():
+# namespaced tags are replaced by prefixed tags, namespace declarations are restored 
+# and whitespace is removed
+def unqualify_record(record):
+
+    for elem in record.iter():
+
+        if elem.tag[0] == '{':
+            namespace, tag = elem.tag[1:].split('}')
+            elem.tag = prefix_map[namespace] + tag
+
+        # restore namespace declarations
+        if elem.tag == 'oai_dc:dc':
+            elem.attrib = {**dc_namespaces, **elem.attrib}
+
+        # remove whitespace
+        if len(elem) and elem.text and not elem.text.strip():
+            elem.text = None
+        elem.tail = None
+
+    return record
+
+
+#-----------------------------------------------------------------------#
+
+# reads records from the previous staticrepo.xml
+# returns dictionary of the form {ao: record}, or None if there is no previous build
+# namespaces are replaced with the prefixes used by build_record() and whitespace
+# added by indentation is removed, so records are written out exactly as they were built
+def read_prior_records(xml_path):
+
+    if not Path(xml_path).exists():
+        return None
+
+    prior_records = dict()
+
+    root = ET.parse(xml_path).getroot()
+
+    for record in root.iter('{http://www.openarchives.org/OAI/2.0/}record'):
+
+        unqualify_record(record)
+
+        identifier = record.find('./header/identifier').text
+        prior_records[identifier[len(identifier_base):]] = record
+
+    return prior_records
+
+
+#-----------------------------------------------------------------------#
+
+# returns the start time of the previous build (epoch seconds)
+# the earlier of the last xml update in the database and the start of the build that wrote state
+def get_last_build_time(state):
+
+    connection = sq.connect(dbpath)
+    cursor = connection.cursor()
+    query = 'SELECT dt FROM last_update WHERE fn=?;'
+    last_update = cursor.execute(query, ['xml']).fetchone()[0]
+    cursor.close()
+    connection.close()
+
+    last_build = min(datetime.fromisoformat(last_update), datetime.fromisoformat(state['started']))
+
+    return int(last_build.timestamp())
+
+
+#-----------------------------------------------------------------------#
+
+# returns set of URIs modified since the previous build
+# category is 'archival_objects', 'digital_objects', or 'resources'
+def get_modified_uris(client, category, modified_since):
+
+    ids = client.get('/repositories/2/' + category, 
+                     params={'all_ids': 'true', 'modified_since': modified_since}).json()
+
+    return {'/repositories/2/' + category + '/' + str(id) for id in ids}
+
+
+#-----------------------------------------------------------------------#
+
+# removes digital objects deleted since the previous build from digital_objects_dict
+def remove_deleted_digital_objects(client, digital_objects_dict):
+
+    ids = client.get('/repositories/2/digital_objects', params={'all_ids': 'true'}).json()
+    current = {'/repositories/2/digital_objects/' + str(id) for id in ids}
+
+    for do in list(digital_objects_dict):
+        if do not in current:
+            del digital_objects_dict[do]
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# returns set of archival objects whose records must be rebuilt
+# previous_dict is digital_objects_dict from the previous build
+# ancestors_dict has the form {ao: [ancestor]} for records in the previous build
+# records of archival objects not in the previous build are always built
+def find_changed_archival_objects(client, previous_dict, digital_objects_dict, ancestors_dict, modified_since):
+
+    changed = set()
+
+    # archival objects linked to new, modified or removed digital objects
+    for do in previous_dict.keys() | digital_objects_dict.keys():
+        if previous_dict.get(do) != digital_objects_dict.get(do):
+            for obj in (previous_dict.get(do), digital_objects_dict.get(do)):
+                if obj:
+                    changed.update(obj['archival_objects'])
+
+    # archival objects modified since the previous build, including
+    # archival objects with a modified ancestor (series, collection)
+    modified = get_modified_uris(client, 'archival_objects', modified_since)
+    modified.update(get_modified_uris(client, 'resources', modified_since))
+
+    for ao, ancestors in ancestors_dict.items():
+        if ao in modified or modified.intersection(ancestors):
+            changed.add(ao)
+
+    return changed
+
+
+#-----------------------------------------------------------------------#
+# START OF SCRIPT 
+# 
+# Contents
+# 
+# 1. ESTABLISH API CONNECTION
+# 2. BUILD COLLECTIONS DICTIONARIES
+# 3. READ/WRITE COLLECTION DATA TO DATABASE FROM ARCHIVESSPACE
+# 4. BUILD OAI-PMH XML OBJECT (oaixml)
+# 5. UPDATE DATABASE
+# 6. WRITE XML TO DISK
+#-----------------------------------------------------------------------#
+
+# checks file_uris against the file URIs of records already written
+# adds file_uris to file_uri_set, and file URIs already seen to duplicate_uris_set
+# returns True if the record is a duplicate (and is skipped)
+def check_duplicates(file_uris, file_uri_set, duplicate_uris_set):
+
+    dup = False
+    for file_uri in file_uris:
+        if file_uri in file_uri_set:
+            duplicate_uris_set.add(file_uri)
+            dup = True
+        else:
+            file_uri_set.add(file_uri)
+
+    return dup
+
+
+#-----------------------------------------------------------------------#
+
+# checkpoint journal of a build, used to resume a build that did not complete (--resume)
+# an SQLite3 database next to staticrepo.xml (buildjournal.db)
+# Tables:
+#   records - one row per archival object processed, in processing order: the finished record
+#             (None for duplicates) and its contribution to duplicate URIs, statistics and ancestors
+#   meta - start time and options of the build
+# rows are committed every checkpoint_interval records; the journal is removed when the build completes
+class BuildJournal:
+
+    def __init__(self, journal_path):
+        self.journal_path = Path(journal_path)
+        self.connection = sq.connect(self.journal_path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                seq INTEGER PRIMARY KEY,
+                ao TEXT,
+                record TEXT,
+                collections TEXT,
+                file_uris TEXT,
+                type_list TEXT,
+                mdate TEXT,
+                ancestors TEXT);
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT);''')
+        self.pending = 0
+
+    # returns the start time and options of the journaled build, or (None, None) if the journal is empty
+    def read_meta(self):
+        meta = dict(self.connection.execute('SELECT name, value FROM meta;').fetchall())
+        if 'started' not in meta:
+            return None, None
+        return datetime.fromisoformat(meta['started']), json.loads(meta['options'])
+
+    # clears the journal and records the start time and options of a new build
+    def start(self, started, options):
+        with self.connection:
+            self.connection.execute('DELETE FROM records;')
+            self.connection.execute('DELETE FROM meta;')
+            self.connection.executemany('INSERT INTO meta VALUES (?,?);',
+                                        [('started', started.isoformat()), ('options', json.dumps(options))])
+
+    # yields journaled archival objects in processing order:
+    # (ao, record, collections, file_uris, type_list, last_modified_date, ancestors)
+    # record is None for duplicates
+    def read(self):
+        query = 'SELECT ao, record, collections, file_uris, type_list, mdate, ancestors FROM records ORDER BY seq;'
+        for ao, record, collections, file_uris, type_list, mdate, ancestors in self.connection.execute(query):
+            yield (ao,
+                   unqualify_record(ET.fromstring(record)) if record else None,
+                   json.loads(collections),
+                   [tuple(file_uri) for file_uri in json.loads(file_uris)],
+                   json.loads(type_list),
+                   mdate,
+                   json.loads(ancestors))
+
+    # adds an archival object to the journal
+    # record is an element, a serialized record (see build_archival_object()), or None for duplicates
+    def add(self, ao, record, collections, file_uris, type_list, last_modified_date, ancestors):
+        if isinstance(record, str):
+            record = record.strip()
+        elif record is not None:
+            record = ET.tostring(record, encoding='unicode')
+        self.connection.execute('INSERT INTO records (ao, record, collections, file_uris, type_list, mdate, ancestors) \
+                                 VALUES (?,?,?,?,?,?,?);',
+                                [ao,
+                                 record,
+                                 json.dumps(collections),
+                                 json.dumps(file_uris),
+                                 json.dumps(type_list),
+                                 last_modified_date,
+                                 json.dumps(ancestors)])
+        self.pending += 1
+        if self.pending >= checkpoint_interval:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    # removes the journal (build completed)
+    def remove(self):
+        self.connection.close()
+        self.journal_path.unlink()
+
+
+#-----------------------------------------------------------------------#
+
+# prints the statistics of the response cache, fragment cache (if any) and API client, 
+# closes the caches and the API client, and writes the build report and elapsed time
+# start is the start time of the build (epoch seconds)
+def close_build(report, report_path, api_client, backend, cache=None, fragments=None, start=None):
+
+    if cache is not None:
+        print('Response cache:', cache.hits, 'hits,', cache.misses, 'misses')
+        report.info['response_cache'] = {'hits': cache.hits, 'misses': cache.misses}
+        cache.close()
+
+    if fragments is not None:
+        # hits and misses of the main process (worker processes, with -s, are not counted)
+        print('Fragment cache:', fragments.hits, 'hits,', fragments.misses, 'misses')
+        report.info['fragment_cache'] = {'hits': fragments.hits, 'misses': fragments.misses}
+        fragments.close()
+
+    # rate limit, concurrency limit and retries of the API client (main process)
+    api_limits = api_client.summary()
+    print('API retries:', sum(counters['retries'] for counters in api_limits['endpoints'].values()), 
+          'concurrency limit:', api_limits['concurrency']['final'])
+    report.info['api_client'] = api_limits
+
+    if backend == 'async':
+        print('Async backend:', api_client.engine.requests, 'requests')
+        api_client.close()
+    
+    # write build report
+    report.write(report_path)
+
+    # print elapsed time in seconds (about 75 mins)
+    elapsed_time = timedelta(seconds=time.time()-start)
+    print('Total elapsed time:', elapsed_time, 50*' ')
+
+    print('Done.')
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+def main():
+
+    #-----------------------------------------------------------------------#
+    # RUNTYPE VARAIBLES
+
+    # set -r to 'test' or 'dev' or anything except 'production' for test or development runs
+    # default -r is 'production'
+    # set -n to limit number of records processed (for testing)
+    # default -n is 1000 for development runtype
+    # default -n is all records for production runtype
+    # stats are not updated when runtype != 'production'
+    # set -w to the number of worker threads used to fetch archival objects
+    # default -w is 1 (serial harvest)
+    # set -b to the number of archival objects fetched per API request (id_set[] batches)
+    # default -b is 1 (one request per archival object)
+    # set -t to harvest archival objects in collection order, from the collection trees
+    # set -i for an incremental build: only records changed since the previous build are rebuilt,
+    # all other records are reused from the previous staticrepo.xml
+    # set -s to the number of worker processes that fetch and build records (default 1, no worker processes)
+    # archival objects are split among the processes by collection
+    # set --resume to continue a build that did not complete, from its checkpoint journal
+    # set --backend async to use the asyncio client (asclient.py) with a pooled keep-alive session
+    # set -c to the maximum number of requests in flight with the async backend (default 10)
+    # requests are made by the worker threads (-w), so -w should be at least -c
+    # set --rate to the maximum number of API requests per second (default 0, no limit)
+    # set --retries to the number of times a failed API request (429, 5xx, timeout) is retried (default 5)
+    # set --no-cache to read all records from the API instead of the response cache, and to build all
+    # records instead of reusing unchanged records from the fragment cache
+    # set --no-indent to write staticrepo.xml without indentation (smaller file)
+    # set --stats-only to refresh the collection statistics in the database without building staticrepo.xml
+    # (archival objects are read from the response cache where possible)
+    # output xml file is staticrepo_test.xml for test or development runtype
+    # output xml file is staticrepo.xml for production runtype
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--runtype', default='production')
+    parser.add_argument('-n', '--num_recs', default=-1, type=int)
+    parser.add_argument('-w', '--workers', default=1, type=int)
+    parser.add_argument('-b', '--batch-size', default=1, type=int)
+    parser.add_argument('-t', '--tree', action='store_true')
+    parser.add_argument('-i', '--incremental', action='store_true')
+    parser.add_argument('-s', '--shards', default=1, type=int)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--backend', default='asnake', choices=['asnake', 'async'])
+    parser.add_argument('-c', '--concurrency', default=10, type=int)
+    parser.add_argument('--rate', default=0, type=float)
+    parser.add_argument('--retries', default=default_retries, type=int)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false')
+    parser.add_argument('--no-indent', dest='indent', action='store_const', const=None, default='  ')
+    parser.add_argument('--stats-only', action='store_true')
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    runtype = args.runtype
+    num_recs = args.num_recs
+    workers = args.workers
+    batch_size = args.batch_size
+    tree = args.tree
+    incremental = args.incremental
+    shards = args.shards
+    resume = args.resume
+    backend = args.backend
+    concurrency = args.concurrency
+    rate = args.rate
+    retries = args.retries
+    use_cache = args.use_cache
+    indent = args.indent
+    stats_only = args.stats_only
+
+    if runtype == 'production':
+        print('Running in production mode...')
+        print('Processing all records...')
+        xml_output_path = Path(Path(__file__).resolve().parent).joinpath('../xml/staticrepo.xml')
+        dup_output_path = Path(Path(__file__).resolve().parent).joinpath('../xml/duplicates.txt')
+
+    else:
+        print('Running in', runtype, 'mode...')
+        if num_recs < 0:
+            num_recs = 1000
+        print('Limiting to', num_recs, 'records for testing...')
+        xml_output_path = Path(Path(__file__).resolve().parent).joinpath('../dev/staticrepo.xml')
+        dup_output_path = Path(Path(__file__).resolve().parent).joinpath('../dev/duplicates.txt')
+
+    # state of this build, read by the next incremental build
+    state_path = xml_output_path.with_name('buildstate.json')
+
+    # checkpoint journal of this build, read by --resume if the build does not complete
+    journal_path = xml_output_path.with_name('buildjournal.db')
+
+    # serialized records of previous builds, reused when their inputs are unchanged
+    fragments_path = xml_output_path.with_name('fragments.db')
+
+    # report of this build: time, API calls and records by phase
+    report_path = dup_output_path.with_name('buildreport.json')
+
+    start = time.time()
+    started = datetime.now()
+
+    report = BuildReport()
+    report.info.update(runtype=runtype, workers=workers, batch_size=batch_size, shards=shards,
+                       tree=tree, incremental=incremental, resume=resume, backend=backend, rate=rate,
+                       retries=retries, stats_only=stats_only)
+
+    #-----------------------------------------------------------------------#
+    # 1. ESTABLISH API CONNECTION
+    #-----------------------------------------------------------------------#
+    
+    report.start_phase('api connection')
+
+    print('Authorizing API...')
+    client = api_client = attach_report(authorize_api(backend, concurrency, workers, rate, retries), report)
+
+    # read records from the response cache where possible
+    # entries for records modified since the last build are removed first
+    cache = None
+    if use_cache:
+        print('Refreshing response cache...')
+        cache = ResponseCache(cachepath)
+        cache.refresh(client)
+        client = CachingClient(client, cache)
+
+    #-----------------------------------------------------------------------#
+    # 2. BUILD COLLECTIONS DICTIONARIES
+    #-----------------------------------------------------------------------#
+
+    report.start_phase('collections dictionary')
+    # builds three dictionaries: for collections, archival objects and digital objects
+    # collections_dict has the form {collection: {ao: {do}}}
+    # archival_objects_dict has the form {ao: {'collections': [collection], 'digital_objects: [do]}}
+    # digital_objects_dict has the form {do: {field: value}}
+
+    # incremental builds start from the previous build state and staticrepo.xml
+    # prior_records has the form {ao: record} for records that can be reused
+    prior_records = None
+
+    if incremental:
+        state = read_build_state(state_path)
+        if state:
+            prior_records = read_prior_records(xml_output_path)
+        if prior_records is None:
+            print('No previous build found, running full build...')
+            incremental = False
+
+    if incremental:
+
+        modified_since = get_last_build_time(state)
+        print('Incremental build, reading changes since', datetime.fromtimestamp(modified_since).isoformat(), '...')
+
+        digital_objects_dict = state['digital_objects']
+        previous_dict = dict(digital_objects_dict)
+        remove_deleted_digital_objects(client, digital_objects_dict)
+
+        print('Building collections dictionary...')
+        collections_dict, archival_objects_dict, digital_objects_dict = \
+            build_collections_dict(client, digital_objects_dict, modified_since)
+
+        changed = find_changed_archival_objects(client, previous_dict, digital_objects_dict, 
+                                                state['ancestors'], modified_since)
+        prior_records = {ao: record for ao, record in prior_records.items() if ao not in changed}
+        print(len(changed), 'archival objects changed since previous build...')
+
+    else:
+
+        print('Building collections dictionary...')
+        collections_dict, archival_objects_dict, digital_objects_dict = build_collections_dict(client)
+
+    #-----------------------------------------------------------------------#
+    # 3. READ/WRITE COLLECTION DATA TO DATABASE FROM ARCHIVESSPACE
+    #-----------------------------------------------------------------------#
+
+    report.start_phase('database refresh')
+    # db location
+    # relevant tables in database:
+    #   collections - records data about collections with digital content
+    #   dates - records dates of last updates of XML file and collection selection
+    #   logs - logs data provider requests (used in oaidp.py)
+
+    print('Fetching collections...')
+    collection_info_dict = fetch_collection_info(client, collections_dict, workers)
+
+    print('Refreshing database...')
+    colls, earliestDatestamp = database_refresh(collections_dict, collection_info_dict, runtype)
+
+    #-----------------------------------------------------------------------#
+    # STATS ONLY: UPDATE COLLECTION STATISTICS IN DATABASE
+    #-----------------------------------------------------------------------#
+
+    # with --stats-only, statistics are computed from the harvested archival objects (in 
+    # archival_objects_dict order, as in a full build) and written to the database; no records are built
+    # and staticrepo.xml, the build state and the fragment cache are not changed
+    if stats_only:
+
+        report.start_phase('stats')
+
+        print('Computing collection statistics...')
+        items = archival_objects_dict.items()
+        if runtype != 'production':
+            items = islice(items, num_recs)
+        stats_dict, coll_mdate_dict, earliest_datestamp = build_stats(client, items, digital_objects_dict, 
+                                                                      workers, batch_size, report)
+
+        if runtype == 'production':
+            print('Updating database...')
+            database_update(stats_dict, coll_mdate_dict, earliest_datestamp, xml_updated=False)
+
+        close_build(report, report_path, api_client, backend, cache, None, start)
+
+        return
+    
+    #-----------------------------------------------------------------------#
+    # 4. BUILD OAI-PMH XML OBJECT (oaixml)
+    #-----------------------------------------------------------------------#
+
+    report.start_phase('xml build')
+
+    print('Building static repository...')
+
+    # namespace dictionary
+    ET.register_namespace('', 'http://www.openarchives.org/OAI/2.0/')
+    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
+    ET.register_namespace('oai_dc', 'http://www.openarchives.org/OAI/2.0/oai_dc/')
+    ET.register_namespace('dc', 'http://purl.org/dc/elements/1.1/')
+
+    # create OAI-PMH XML object
+    oaixml = ET.Element('OAI-PMH', {'xmlns':'http://www.openarchives.org/OAI/2.0/',
+        'xmlns:xsi':'http://www.w3.org/2001/XMLSchema-instance',
+        'xsi:schemaLocation':'http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd'})
+
+    # build Identify segment
+    Identify = ET.SubElement(oaixml, 'Identify')
+    repositoryName = ET.SubElement(Identify, 'repositoryName')
+    repositoryName.text = 'Caltech Archives Digital Collections'
+    baseURL = ET.SubElement(Identify, 'baseURL')
+    baseURL.text = 'http://apps.library.caltech.edu/ead2dc/oai'
+    protocolVersion = ET.SubElement(Identify, 'protocolVersion')
+    protocolVersion.text = '2.0'
+    adminEmail = ET.SubElement(Identify, 'adminEmail')
     adminEmail.text = 'archives@caltech.edu'
     earliestDate = ET.SubElement(Identify, 'earliestDatestamp')
     earliestDate.text = earliestDatestamp
@@ -725,12 +2270,15 @@ def main():
     # build ListSets segment
     ListSets = ET.SubElement(oaixml, 'ListSets')
                             
+    # titles and descriptions are taken from collection_info_dict where available,
+    # so they are current even when the database is not refreshed (runtype != 'production')
     for coll in colls:
+        coll_info = collection_info_dict.get(coll[3], {'title': coll[1], 'description': coll[2]})
         oaiset = ET.SubElement(ListSets, 'set')
         setSpec = ET.SubElement(oaiset, 'setSpec')
         setSpec.text = coll[11]+'_'+coll[0]
         setName = ET.SubElement(oaiset, 'setName')
-        setName.text = coll[1]
+        setName.text = coll_info['title']
         setDescription = ET.SubElement(
             ET.SubElement(
                 ET.SubElement(oaiset, 'setDescription'), 'oai_dc', {
@@ -741,10 +2289,19 @@ def main():
                 }
             ), 'dc:description'
         )
-        setDescription.text = coll[2]
+        setDescription.text = coll_info['description']
 
     # build ListRecords segment
-    ListRecords = ET.SubElement(oaixml, 'ListRecords', {'metadataPrefix': 'oai_dc'})
+    # records are written to disk as they are built, and are not added to oaixml
+    ListRecords = ET.Element('ListRecords', {'metadataPrefix': 'oai_dc'})
+
+    # write Identify, ListMetadataFormats and ListSets segments
+    writer = StaticRepoWriter(xml_output_path, indent)
+    writer.write_header(oaixml, ListRecords)
+
+    # serialized records are reused from previous builds if the archival object, its digital objects, 
+    # collections and ancestors are unchanged (see build_archival_object())
+    fragments = FragmentCache(fragments_path, indent) if use_cache else None
 
     # initialize stats_dict for collection statistics
     # {setid: {'archival_objects': #, 'digital_objects': {hostcategory: #}, 'types': {type: #}}
@@ -754,347 +2311,163 @@ def main():
     # {collid: 'mdate'}
     coll_mdate_dict = dict()
 
+    # earliest datestamp of all records (written to the database as earliestDatestamp)
+    # the latest dates of collections in coll_mdate_dict are not used: earlier records would be missed
+    earliest_datestamp = None
+
+    # initialize ancestors_cache to fetch each ancestor (series, collection) once
+    # {ancestor: (level, title, [rights note])}
+    ancestors_cache = dict()
+
     # iterate over archival object dictionary
     # do = digital object, ao = archival object
     # archival_objects_dict = {ao: {'collections': [collids], 'digital_objects: [dos]}}        
-    j = 0
-
-    # initialize set to check for duplicate uris
-    file_uri_set, duplicate_uris_set = set(), set()
-
-    for ao, colls_dict in archival_objects_dict.items():
-
-        # display archival object id
-        print(ao, '   ', end='\r')
-
-        # limit number of records processed if testing
-        if runtype != 'production':
-            j += 1
-            if j > num_recs:
-                break
-
-        # get archival object metadata
-        uri = ao + "?resolve[]=ancestors" \
-                + "&resolve[]=digital_object" \
-                + "&resolve[]=linked_agents" \
-                + "&resolve[]=repository" \
-                + "&resolve[]=subjects" \
-                + "&resolve[]=top_container"
-        archival_object_metadata = client.get(uri).json()
-
-        # string form of date to write to each record
-        create_time = archival_object_metadata['create_time']
-        system_mtime = archival_object_metadata['system_mtime']
-        user_mtime = archival_object_metadata['user_mtime']
-        last_modified_date = max([create_time, system_mtime, user_mtime])[:10]
-
-        # create list of associated digital objects
-        do_list = colls_dict['digital_objects']
-
-        # remove unpublished, redirects
-        file_uris = published_file_uris(client, do_list)
-
-        # skip archival object if no published digital object file URIs
-        if len(file_uris) == 0:
-            continue
-        
-        # skip archival object if duplicate uri
-        dup = False
-        for file_uri in file_uris:
-            if file_uri in file_uri_set:
-                duplicate_uris_set.add(file_uri)
-                dup = True
-            else:
-                file_uri_set.add(file_uri)
-        if dup:
-            continue
+    # with -t, archival objects are taken in collection order from the collection trees
+    if tree:
+        print('Reading collection trees...')
+        items = order_by_collection_tree(client, collections_dict, archival_objects_dict, ancestors_cache,
+                                         prior_records, batch_size)
+    else:
+        items = archival_objects_dict.items()
 
-        # create hostnames set
-        hostnames = create_valid_hostnames_set(file_uris)
+    # limit number of records processed if testing
+    if runtype != 'production':
+        items = islice(items, num_recs)
 
-        # record element
-        record = ET.SubElement(ListRecords, 'record')
+    if workers > 1:
+        print('Fetching archival objects with', workers, 'workers...')
 
-        # header element
-        header = ET.SubElement(record, 'header')
+    if batch_size > 1:
+        print('Fetching archival objects in batches of', batch_size, '...')
 
-        identifier = ET.SubElement(header, 'identifier')
-        identifier.text = 'collections.archives.caltech.edu' + ao
-        #identifier.attrib = {'type': 'archival'}
+    # initialize set to check for duplicate uris
+    file_uri_set, duplicate_uris_set = set(), set()
 
-        # datestamp element
-        datestamp = ET.SubElement(header, 'datestamp')
-        datestamp.text = last_modified_date
+    # initialize ancestors_dict to track the ancestors of each record (for incremental builds)
+    # {ao: [ancestor]}
+    ancestors_dict = dict()
 
-        # setSpec element
-        for collid in colls_dict['collections']:
+    # checkpoint journal
+    # with --resume, the records of an interrupted build with the same options are replayed from 
+    # the journal (records, duplicate URIs, statistics, ancestors) and only the remaining archival 
+    # objects are fetched. records are processed in the same order in every run, so the journaled 
+    # archival objects are the first ones processed and the output is the same as an uninterrupted build
+    journal = BuildJournal(journal_path)
+    journal_options = {'runtype': runtype, 'num_recs': num_recs, 'tree': tree, 'incremental': incremental}
+    journal_started, journal_previous_options = journal.read_meta()
 
-            setspec = ET.SubElement(header, 'setSpec')
-            setspec.text = get_set_id(collid)
+    # archival objects in the journal
+    done = set()
 
-            # add archival record to stats_dict
-            # {collid: {'archival_objects': #, 'digital_objects': {hostcategory: #}}
-            if stats_dict.get(collid):
-                stats_dict[collid]['archival_objects'] += 1
-            else:
-                stats_dict[collid] = {'archival_objects': 1, 'digital_objects': dict(), 'types': dict()}
+    if resume and journal_started and journal_previous_options == journal_options:
 
-            # track last modified date by collection
-            if coll_mdate_dict.get(collid):
-                if last_modified_date > coll_mdate_dict[collid]:
-                    coll_mdate_dict[collid] = last_modified_date
-            else:
-                coll_mdate_dict[collid] = last_modified_date
+        print('Resuming build started', journal_started.isoformat(), '...')
+        started = journal_started
 
-        # create metadata element
-        metadata = ET.SubElement(record, 'metadata')
+        for ao, record, collections, file_uris, type_list, last_modified_date, ancestors in journal.read():
 
-        # dc element
-        dc = ET.SubElement(metadata, 'oai_dc:dc', {'xmlns:oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/',
-                                            'xmlns:dc': 'http://purl.org/dc/elements/1.1/',
-                                            'xmlns:dcterms': 'http://purl.org/dc/terms/'})
-        
-        title = ET.SubElement(dc, 'dc:title')
-        title.text = archival_object_metadata['title']
-        #title.attrib = {'type': 'archival'}
-
-        # creators, subjects
-        creators = list()
-        subjects = list()
-        for linked_agent in archival_object_metadata.get('linked_agents', []):
-            if linked_agent.get('role') == 'creator':
-                if linked_agent.get('_resolved'):
-                    name = linked_agent['_resolved'].get('title')
-                    role = relator_map.get(linked_agent.get('relator'), None)
-                    if role:
-                        name = name + ', ' + relator_map[linked_agent.get('relator')]
-                    creators.append(name)
-            if linked_agent.get('role') == 'subject':
-                if linked_agent.get('_resolved'):
-                    name = linked_agent['_resolved'].get('title')
-                    subjects.append((name, None))
- 
-        for c in creators:
-            creator = ET.SubElement(dc, 'dc:creator')
-            creator.text = c
-
-        # subjects
-        for s in archival_object_metadata.get('subjects', []):
-            if s.get('_resolved'):
-                source = s['_resolved'].get('source')
-                if s['_resolved'].get('title'):
-                    subject = s['_resolved']['title']
-                    subjects.append((subject, source))
-
-        for s in subjects:
-            if s:
-                subject = ET.SubElement(dc, 'dc:subject')
-                subject.text = s[0]
-                if s[1]:
-                    subject.attrib = {'source': s[1]}
-        
-        # description, rights
-        # list to capture rights info from userestrict note
-        # format: list of tuples [(level, content)]
-        # levels are in order of preference: 'x_item', 'subseries', 'series', 'collection'
-        rights = list()
-        for note in archival_object_metadata.get('notes', []):
-
-            if note.get('publish') and (note['type'] == 'scopecontent' or note['type'] == 'abstract'):
-                if note['jsonmodel_type'] == 'note_singlepart':
-                    desc_text = note['content'][0]
-                elif note['jsonmodel_type'] == 'note_multipart':
-                    desc_text = note['subnotes'][0]['content']
-
-                description = ET.SubElement(dc, 'dc:description')
-                description.text = desc_text
-
-            if note.get('publish') and (note['type'] == 'userestrict'):
-                if note['jsonmodel_type'] == 'note_singlepart':
-                    item_rights_note = note['content'][0]
-                elif note['jsonmodel_type'] == 'note_multipart':
-                    item_rights_note = note['subnotes'][0]['content']
-
-                # capture item rights info for use below
-                rights.append(('x_item', item_rights_note))
-                
-                '''
-                # optional description attribute
-                description.attrib = {'type': 'scopecontent' if note['type']=='scopecontent' else 'abstract',
-                                      'label': 'Scope and Content' if note['type']=='scopecontent' else 'Abstract'}
-                '''
+            done.add(ao)
 
-        for file_uri in file_uris: 
+            if check_duplicates(file_uris, file_uri_set, duplicate_uris_set):
+                report.count('duplicates')
+                continue
 
-            # parse url
-            hostname = get_domain_from_url(file_uri[0])
+            report.count('emitted')
+            report.count('resumed')
+            writer.write_record(record)
+            ancestors_dict[ao] = ancestors
+            earliest_datestamp = min(earliest_datestamp or last_modified_date, last_modified_date)
+            update_stats(stats_dict, coll_mdate_dict, collections, file_uris, type_list, last_modified_date)
 
-            # skip excluded hostnames
-            if hostname not in hostnames:
-                continue
+        print(len(done), 'archival objects read from journal...')
 
-            # categorize hostname
-            if hostname in ['caltech.edu', 'californiarevealed.org']:
-                hostcategory = 'caltechlibrary'
-            elif hostname == 'archive.org':
-                hostcategory = 'internetarchive'
-            elif hostname in ['youtube.com', 'youtu.be']:
-                hostcategory = 'youtube'
-            else:
-                hostcategory = 'other'
+        # skip archival objects in the journal
+        items = ((ao, colls_dict) for ao, colls_dict in items if ao not in done)
 
-            # identifier element
-            # unpack tuple
-            f_uri, f_use = file_uri
-            identifier = ET.SubElement(dc, 'dc:identifier')
-            identifier.text = f_uri
-            identifier.attrib = {'scheme': 'URI', 'type': f_use if f_use else 'unknown'}
+    else:
 
-            # omit thumbnail links from statistics
-            if 'thumbnail' in f_use.lower():
-                continue
+        if resume:
+            print('No interrupted build to resume, running full build...')
+        journal.start(started, journal_options)
+
+    # archival objects are fetched concurrently when workers > 1, and records are built in 
+    # worker processes when shards > 1, but results are returned in items order and processed 
+    # serially below
+    if shards > 1:
+        print('Building records in', shards, 'shards...')
+        results = harvest_shards(items, shards, backend, concurrency, rate, retries, use_cache, 
+                                 digital_objects_dict, prior_records, workers, batch_size, ancestors_cache, report,
+                                 fragments)
+    else:
+        results = build_archival_objects(harvest_archival_objects(client, items, digital_objects_dict, workers, 
+                                                                  prior_records, batch_size, ancestors_cache),
+                                         ancestors_cache, fragments)
 
-            for collid in colls_dict['collections']:
+    for ao, colls_dict, file_uris, type_list, built in results:
 
-                if stats_dict[collid].get('digital_objects'):
+        # display archival object id
+        print(ao, '   ', end='\r')
 
-                    if stats_dict[collid]['digital_objects'].get(hostcategory):
-                        stats_dict[collid]['digital_objects'][hostcategory] += 1
+        # skip archival object if no published digital object file URIs
+        if len(file_uris) == 0:
+            report.count('no_file_uris')
+            continue
+        
+        # skip archival object if duplicate uri
+        if check_duplicates(file_uris, file_uri_set, duplicate_uris_set):
+            report.count('duplicates')
+            journal.add(ao, None, colls_dict['collections'], file_uris, type_list, None, None)
+            continue
 
-                    else:
-                        stats_dict[collid]['digital_objects'][hostcategory] = 1
+        report.count('emitted')
 
-                else:
-                    stats_dict[collid]['digital_objects'][hostcategory] = 1
+        if built is None:
 
-        # identifier element
-        if archival_object_metadata.get('component_id'):
-            identifier = ET.SubElement(dc, 'dc:identifier')
-            identifier.text = archival_object_metadata['component_id']
-            identifier.attrib = {'type': 'localid'}
+            # reuse record from previous build
+            report.count('reused')
+            record = prior_records[ao]
+            last_modified_date = record.find('./header/datestamp').text
+            ancestors_dict[ao] = state['ancestors'].get(ao, [])
 
-        # dates
-        for dt in archival_object_metadata.get('dates', []):
+        else:
 
-            if dt.get('expression'):
-                date_expression = dt['expression']
-            else:
-                date_expression = ''
-                if dt.get('begin'):
-                    date_expression += dt['begin']
-                if dt.get('end'):
-                    if date_expression != '':
-                        date_expression += ' - '
-                    date_expression += dt['end']
-
-            if date_expression:
-                date_elem = ET.SubElement(dc, 'dc:date')
-                date_elem.text = date_expression
-                attribs = dict()
-                if dt.get('begin'):
-                    attribs['begin'] = dt['begin']
-                if dt.get('end'):
-                    attribs['end'] = dt['end']
-                if dt.get('date_type'):
-                    attribs['type'] = dt['date_type']
-                if dt.get('label'):
-                    attribs['label'] = dt['label']
-                if dt.get('certainty'):
-                    attribs['certainty'] = dt['certainty']
-                if attribs != dict():
-                    date_elem.attrib = attribs
-
-        # type
-        for type_value in get_digital_object_type(client, do_list):
-            type_el = ET.SubElement(dc, 'dc:type')
-            type_el.text = type_value
-
-            # add type to stats_dict
-            # {setid: {'types': {type_value: #}}
-            if stats_dict[collid].get('types'):
-                if stats_dict[collid]['types'].get(type_value):
-                    stats_dict[collid]['types'][type_value] += 1
-                else:
-                    stats_dict[collid]['types'][type_value] = 1
-            else:
-                stats_dict[collid]['types'][type_value] = 1
-
-        # extents
-        extents = list()
-        for extent in archival_object_metadata.get('extents', []):
-            s = extent.get('number', '') + ' ' + extent.get('extent_type', '') + ' ' + extent.get('physical_details', '').strip()
-            extents.append(s)
-
-        for e in extents:
-            if e.strip() != '':
-                extent = ET.SubElement(dc, 'dc:format')
-                extent.text = e.strip()
-
-        # relation, rights
-        ancestors = list()
-        for a in archival_object_metadata.get('ancestors', []):
-            level = a.get('level')
-
-            if a.get('_resolved'):
-                if a['_resolved'].get('title'):
-                    title = a['_resolved']['title']
-                    ancestors.append((level, title))
-
-                if a['_resolved'].get('notes'):
-                    nn = a['_resolved']['notes']
-                    for n in nn:
-                        if n.get('type'):
-                            if n['type']=='userestrict':
-                                if n['jsonmodel_type']=='note_singlepart':
-                                    content = ' '.join(n['content'])
-                                else:
-                                    content = n['subnotes'][0]['content']
-                                rights.append((level, content))
-
-        # relation
-        for a in ancestors:
-            if a:
-                ancestor = ET.SubElement(dc, 'dc:relation')
-                ancestor.text = a[1]
-                if a[1]:
-                    ancestor.attrib = {'level': a[0]}
-        
-        # rights
-        # sort order: 'x_item', 'subseries', 'series', 'collection'
-        rights.sort(reverse=True)
+            record, last_modified_date, ancestors_dict[ao] = built
 
-        rights_el = ET.SubElement(dc, 'dc:rights')
+        # journal the record before it is written (and indented)
+        journal.add(ao, record, colls_dict['collections'], file_uris, type_list, last_modified_date, ancestors_dict[ao])
 
-        ok = False
+        writer.write_record(record)
 
-        for r in rights:
-            if r[1]:
-                rights_el.text = r[1]
-                ok = True
-                break
+        # add record to collection statistics
+        earliest_datestamp = min(earliest_datestamp or last_modified_date, last_modified_date)
+        update_stats(stats_dict, coll_mdate_dict, colls_dict['collections'], file_uris, type_list, last_modified_date)
 
-        if not ok:
+    journal.commit()
 
-            rights_el.text = default_rights_statement
 
     #-----------------------------------------------------------------------#
     # 5. UPDATE DATABASE
     #-----------------------------------------------------------------------#
+
+    report.start_phase('database update')
     # update collection statistics in db
     # {collid: {'archival_objects': #, 'digital_objects': {hostcategory: #}}
 
     if runtype == 'production':
 
         print('Updating database...')
-        database_update(stats_dict, coll_mdate_dict)
+        # all records are processed in production (reused records included), so earliest_datestamp
+        # covers the whole repository
+        database_update(stats_dict, coll_mdate_dict, earliest_datestamp, started)
 
     #-----------------------------------------------------------------------#
     # 6. WRITE XML TO DISK
     #-----------------------------------------------------------------------#
 
-    # write XML to disk
-    with open(xml_output_path, 'w') as f:
-        f.write(prettify(oaixml))
+    report.start_phase('write')
+
+    # complete XML file and replace previous file
+    writer.commit()
 
     # write duplicate URI report
     # duplicate_uris_set is a set of tuples
@@ -1103,12 +2476,14 @@ def main():
         for uri_tuple in duplicate_uris_set:
             out = uri_tuple[0] + ' (' + uri_tuple[1] + ')\n'
             f.write(out)
-    
-    # print elapsed time in seconds (about 75 mins)
-    elapsed_time = timedelta(seconds=time.time()-start)
-    print('Total elapsed time:', elapsed_time, 50*' ')
 
-    print('Done.')
+    # write build state for the next incremental build
+    write_build_state(state_path, started, digital_objects_dict, ancestors_dict)
+
+    # build is complete, journal is no longer needed
+    journal.remove()
+
+    close_build(report, report_path, api_client, backend, cache, fragments, start)
 
 #-----------------------------------------------------------------------#
 
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# fragcache.py
+#
+# Persistent cache of serialized records (record fragments of staticrepo.xml)
+# Used by buildxml.py
+# Fragments are stored in an SQLite3 database, fragments.db, next to staticrepo.xml
+# Tables:
+#   fragments - one row per archival object: the hash of the inputs of its record, and the
+#               record as written to staticrepo.xml (compressed)
+#
+# The hash covers everything a record is built from: the archival object JSON (with resolved agents
+# and subjects), the file URIs and types of its digital objects, its collections, the parts of its
+# ancestors used in records (level, title, rights), and the record format (see buildxml.py).
+# A record is rebuilt only if its hash has changed, so no entries have to be invalidated.
+# Entries not used for max_age are removed when the cache is closed.
+
+import json
+import time
+import zlib
+import hashlib
+import sqlite3 as sq
+import threading
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default maximum time since an entry was last used (seconds)
+default_max_age = 30 * 24 * 60 * 60
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   fragment_key(*inputs)                       returns hash of the inputs of a record
+#
+#   FragmentCache(path, indent, max_age)        SQLite-backed cache of serialized records
+#-----------------------------------------------------------------------#
+
+# returns hash of the inputs of a record (any JSON-serializable values)
+def fragment_key(*inputs):
+
+    text = json.dumps(inputs, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=20).hexdigest()
+
+
+#-----------------------------------------------------------------------#
+
+# cache of serialized records, keyed by archival object and checked against the hash of its inputs
+# indent is the indentation of staticrepo.xml (the fragments are stored as written)
+# safe to share between threads
+class FragmentCache:
+
+    def __init__(self, path, indent='  ', max_age=default_max_age):
+
+        self.path = path
+        self.indent = indent
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # archival objects whose entries were used, written by flush()
+        self._used = list()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    # open database connection on first use
+    def _connect(self):
+
+        if self._connection is None:
+            self._connection = sq.connect(self.path, check_same_thread=False, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL;')
+            self._connection.execute('PRAGMA synchronous=NORMAL;')
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS fragments (
+                    ao TEXT PRIMARY KEY,
+                    key TEXT,
+                    fragment BLOB,
+                    used REAL);''')
+            self._connection.commit()
+
+        return self._connection
+
+    # returns the fragment of ao if it was built from the same inputs (key), otherwise None
+    def get(self, ao, key):
+
+        with self._lock:
+
+            db = self._connect()
+            row = db.execute('SELECT key, fragment FROM fragments WHERE ao=?;', [ao]).fetchone()
+
+            if row is None or row[0] != key:
+                self.misses += 1
+                return None
+
+            self._used.append(ao)
+            self.hits += 1
+
+        return zlib.decompress(row[1]).decode('utf-8')
+
+    # stores the fragment of ao, built from inputs with hash key
+    def put(self, ao, key, fragment):
+
+        body = zlib.compress(fragment.encode('utf-8'))
+
+        with self._lock:
+
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO fragments VALUES (?,?,?,?);', [ao, key, body, time.time()])
+            db.commit()
+
+        return
+
+    # records the use of the entries returned by get() since the last flush
+    def flush(self):
+
+        with self._lock:
+            if self._used:
+                db = self._connect()
+                db.executemany('UPDATE fragments SET used=? WHERE ao=?;', [(time.time(), ao) for ao in self._used])
+                db.commit()
+                self._used = list()
+
+        return
+
+    # records the use of entries, removes entries not used for max_age, and closes the database
+    def close(self):
+
+        self.flush()
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM fragments WHERE used<?;', [time.time() - self.max_age])
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+        return
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#
+# linkindex.py
+#
+# Compact index of the links between collections, archival objects and digital objects
+# Used by buildxml.py (build_collections_dict())
+#
+# Archival objects and digital objects are stored by their ids (integers), and the links
+# in arrays (adjacency lists: collection -> archival object -> digital object, and
+# archival object -> collections and digital objects), rather than as
+# URI strings in nested dictionaries and lists.
+#
+# The index is read through two read-only mappings with the same form, and the same order,
+# as the dictionaries they replace:
+#   LinkIndex.collections_dict()        {collection: {ao: [do]}}
+#   LinkIndex.archival_objects_dict()   {ao: {'collections': [collection], 'digital_objects': [do]}}
+# URIs are converted back to strings when they are read.
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, ItemsView
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# URI prefixes of archival objects and digital objects, followed by the id
+ao_prefix = '/repositories/2/archival_objects/'
+do_prefix = '/repositories/2/digital_objects/'
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   uri_id(uri, prefix)                         returns the id (integer) of a URI with the given prefix,
+#                                               or None
+#
+#   LinkIndex(links)                            array-backed index of collection, archival object and
+#                                               digital object links
+#
+#   CollectionsView(index)                      {collection: {ao: [do]}} mapping of a LinkIndex
+#
+#   CollectionLinks(index, c)                   {ao: [do]} mapping of one collection
+#
+#   CollectionLinksItems(links)                 items of CollectionLinks, in index order
+#
+#   ArchivalObjectsView(index)                  {ao: {'collections', 'digital_objects'}} mapping of a LinkIndex
+#
+#   ArchivalObjectsItems(view)                  items of ArchivalObjectsView, in index order
+#-----------------------------------------------------------------------#
+
+# returns the id (integer) of a URI with the given prefix, e.g. 12345 for
+# '/repositories/2/archival_objects/12345', or None if uri is not of this form
+def uri_id(uri, prefix):
+
+    if isinstance(uri, str) and uri[:len(prefix)] == prefix and uri[len(prefix):].isdigit():
+        return int(uri[len(prefix):])
+
+    return None
+
+
+#-----------------------------------------------------------------------#
+
+# array-backed index of collection, archival object and digital object links
+# links is an iterable of (do, [ao], [collection]) tuples, e.g. from digital_objects_dict
+# collections are ordered by first appearance in links, the archival objects of each collection
+# by first appearance, and the digital objects of each (collection, archival object) in links order
+# archival objects (archival_objects_dict()) are ordered by first appearance in collection order
+class LinkIndex:
+
+    def __init__(self, links):
+
+        # collection URIs, by collection number
+        self.collections = list()
+        coll_numbers = dict()
+
+        # pairs (collection, archival object), in order of first appearance in links,
+        # with the digital objects linked to each pair
+        pair_numbers = dict()
+        pair_coll, pair_ao, pair_dos = array('l'), array('q'), list()
+
+        do_length, ao_length = len(do_prefix), len(ao_prefix)
+
+        for do, aos, colls in links:
+            if do[:do_length] != do_prefix or not do[do_length:].isdigit():
+                raise ValueError('Not a digital object URI: ' + str(do))
+            d = int(do[do_length:])
+            for ao in aos:
+                if ao[:ao_length] != ao_prefix or not ao[ao_length:].isdigit():
+                    raise ValueError('Not an archival object URI: ' + str(ao))
+                a = int(ao[ao_length:])
+                for coll in colls:
+                    c = coll_numbers.get(coll)
+                    if c is None:
+                        c = coll_numbers[coll] = len(self.collections)
+                        self.collections.append(coll)
+                    # one integer key per pair
+                    key = (a << 24) | c
+                    p = pair_numbers.get(key)
+                    if p is None:
+                        pair_numbers[key] = len(pair_dos)
+                        pair_coll.append(c)
+                        pair_ao.append(a)
+                        pair_dos.append([d])
+                    else:
+                        pair_dos[p].append(d)
+
+        del pair_numbers
+
+        # collection -> archival object -> digital objects
+        # pairs are ordered by collection, then by first appearance (stable sort), and stored in
+        # pair_coll and pair_ao; the pairs of collection c are coll_start[c] to coll_start[c+1] - 1
+        # digital objects of pair p are pair_do[pair_start[p]:pair_start[p+1]]
+        order = sorted(range(len(pair_dos)), key=pair_coll.__getitem__)
+        self.coll_start = array('l', [0] * (len(self.collections) + 1))
+        self.pair_coll, self.pair_ao = array('l'), array('q')
+        self.pair_start, self.pair_do = array('l', [0]), array('q')
+
+        for p in order:
+            self.coll_start[pair_coll[p] + 1] += 1
+            self.pair_coll.append(pair_coll[p])
+            self.pair_ao.append(pair_ao[p])
+            self.pair_do.extend(pair_dos[p])
+            self.pair_start.append(len(self.pair_do))
+
+        for c in range(len(self.collections)):
+            self.coll_start[c + 1] += self.coll_start[c]
+
+        # pairs of each collection sorted by archival object id, for lookups (CollectionLinks)
+        # coll_sorted_ao[coll_start[c]:coll_start[c+1]] are the sorted archival object ids of collection c,
+        # and coll_sorted_pair the pairs they are in
+        self.coll_sorted_ao, self.coll_sorted_pair = array('q'), array('l')
+        for c in range(len(self.collections)):
+            by_ao = sorted(range(self.coll_start[c], self.coll_start[c + 1]), key=self.pair_ao.__getitem__)
+            self.coll_sorted_ao.extend(self.pair_ao[p] for p in by_ao)
+            self.coll_sorted_pair.extend(by_ao)
+
+        del order, pair_coll, pair_ao, pair_dos
+
+        # archival objects, by row, in order of first appearance in pairs
+        # archival object -> collections and digital objects: row r has the collection and digital 
+        # objects of pair first_pair[r], and of the pairs in other_pairs[r] if the archival object 
+        # is in more than one collection
+        rows = dict()
+        self.ao_ids, self.first_pair, self.other_pairs = array('q'), array('l'), dict()
+        for p, a in enumerate(self.pair_ao):
+            r = rows.get(a)
+            if r is None:
+                rows[a] = len(self.ao_ids)
+                self.ao_ids.append(a)
+                self.first_pair.append(p)
+            else:
+                self.other_pairs.setdefault(r, list()).append(p)
+
+        del rows
+
+        # archival object ids in sorted order, and their rows, for lookups
+        by_id = sorted(range(len(self.ao_ids)), key=self.ao_ids.__getitem__)
+        self.sorted_ids = array('q', (self.ao_ids[r] for r in by_id))
+        self.sorted_rows = array('l', by_id)
+
+    # returns the row of an archival object URI, or None if it is not in the index
+    def row(self, ao):
+
+        a = uri_id(ao, ao_prefix)
+        if a is None:
+            return None
+
+        i = bisect_left(self.sorted_ids, a)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == a:
+            return self.sorted_rows[i]
+
+        return None
+
+    # returns the digital object URIs of pair p
+    def pair_digital_objects(self, p):
+        return [do_prefix + str(d) for d in self.pair_do[self.pair_start[p]:self.pair_start[p+1]]]
+
+    # returns the links of archival object row r: {'collections': [collection], 'digital_objects': [do]}
+    # digital objects linked in more than one collection are listed once
+    def links(self, r):
+
+        p = self.first_pair[r]
+        collections = [self.collections[self.pair_coll[p]]]
+        digital_objects = self.pair_digital_objects(p)
+
+        for p in self.other_pairs.get(r, []):
+            collections.append(self.collections[self.pair_coll[p]])
+            digital_objects.extend(do for do in self.pair_digital_objects(p) if do not in digital_objects)
+
+        return {'collections': collections, 'digital_objects': digital_objects}
+
+    # returns the mapping {collection: {ao: [do]}}
+    def collections_dict(self):
+        return CollectionsView(self)
+
+    # returns the mapping {ao: {'collections': [collection], 'digital_objects': [do]}}
+    def archival_objects_dict(self):
+        return ArchivalObjectsView(self)
+
+
+#-----------------------------------------------------------------------#
+
+# {collection: {ao: [do]}} mapping of a LinkIndex
+class CollectionsView(Mapping):
+
+    def __init__(self, index):
+        self.index = index
+        self.numbers = {coll: c for c, coll in enumerate(index.collections)}
+
+    def __getitem__(self, collection):
+        return CollectionLinks(self.index, self.numbers[collection])
+
+    def __iter__(self):
+        return iter(self.index.collections)
+
+    def __len__(self):
+        return len(self.index.collections)
+
+
+#-----------------------------------------------------------------------#
+
+# {ao: [do]} mapping of collection number c of a LinkIndex
+class CollectionLinks(Mapping):
+
+    def __init__(self, index, c):
+        self.index = index
+        self.start = index.coll_start[c]
+        self.end = index.coll_start[c + 1]
+
+    # returns the pair of an archival object URI in this collection, or None
+    def _pair(self, ao):
+        a = uri_id(ao, ao_prefix)
+        if a is not None:
+            i = bisect_left(self.index.coll_sorted_ao, a, self.start, self.end)
+            if i < self.end and self.index.coll_sorted_ao[i] == a:
+                return self.index.coll_sorted_pair[i]
+        return None
+
+    def __getitem__(self, ao):
+        p = self._pair(ao)
+        if p is None:
+            raise KeyError(ao)
+        return self.index.pair_digital_objects(p)
+
+    def __contains__(self, ao):
+        return self._pair(ao) is not None
+
+    def __iter__(self):
+        return (ao_prefix + str(a) for a in self.index.pair_ao[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def items(self):
+        return CollectionLinksItems(self)
+
+
+# items of CollectionLinks, read in order without lookups
+class CollectionLinksItems(ItemsView):
+
+    def __iter__(self):
+        links = self._mapping
+        for p in range(links.start, links.end):
+            yield ao_prefix + str(links.index.pair_ao[p]), links.index.pair_digital_objects(p)
+
+
+#-----------------------------------------------------------------------#
+
+# {ao: {'collections': [collection], 'digital_objects': [do]}} mapping of a LinkIndex
+# each lookup returns a new dictionary
+class ArchivalObjectsView(Mapping):
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, ao):
+        r = self.index.row(ao)
+        if r is None:
+            raise KeyError(ao)
+        return self.index.links(r)
+
+    def __contains__(self, ao):
+        return self.index.row(ao) is not None
+
+    def __iter__(self):
+        return (ao_prefix + str(a) for a in self.index.ao_ids)
+
+    def __len__(self):
+        return len(self.index.ao_ids)
+
+    def items(self):
+        return ArchivalObjectsItems(self)
+
+
+# items of ArchivalObjectsView, read in order without lookups
+class ArchivalObjectsItems(ItemsView):
+
+    def __iter__(self):
+        index = self._mapping.index
+        for r, a in enumerate(index.ao_ids):
+            yield ao_prefix + str(a), index.links(r)
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+#
+# mockas.py
+#
+# Local mock ArchivesSpace API server with a synthetic repository
+# Used to run buildxml.py without the live ArchivesSpace (see benchmark.py)
+#
+# The synthetic repository has a given number of digital objects, linked to archival objects
+# (files) in series of resources, with a few also linked to accessions. Records are generated
+# from their ids when requested, so large repositories (100k digital objects) use little memory.
+# Output is the same for the same size and seed.
+# Records can be edited or deleted after the repository is generated (edit(), delete()), e.g. to test
+# incremental builds (see regression.py); edited records get the current time as system_mtime.
+#
+# Endpoints:
+#   POST /users/{username}/login                                returns a session token
+#   GET  /repositories/2                                        repository
+#   GET  /repositories/2/{type}?page=&page_size=                paged list
+#   GET  /repositories/2/{type}?all_ids=true[&modified_since=]  list of ids
+#   GET  /repositories/2/{type}?id_set[]=...[&resolve[]=...]    list of records
+#   GET  /repositories/2/{type}/{id}[?resolve[]=...]            record
+#   GET  /repositories/2/resources/{id}/ordered_records         collection tree
+#   GET  /agents/people/{id}, /subjects/{id}                    agents, subjects
+# {type} is digital_objects, archival_objects, resources or accessions
+# resolve[] supports ancestors, linked_agents, subjects, digital_object, repository and top_container
+#
+# usage: python mockas.py [-s SIZE] [-p PORT] [-l LATENCY] [-e ERROR_RATE] [--seed SEED]
+
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# repository path
+repository = '/repositories/2'
+
+# number of series in each resource
+series_per_resource = 4
+
+# number of digital objects per resource (sets the number of resources)
+digital_objects_per_resource = 500
+
+# number of accessions
+accession_count = 3
+
+# number of agents and subjects
+agent_count = 20
+subject_count = 20
+
+# hosts of digital object file versions (see buildxml.get_host_category())
+file_hosts = ['https://digital.archives.caltech.edu',
+              'https://californiarevealed.org',
+              'https://archive.org',
+              'https://www.youtube.com',
+              'https://example.com']
+
+# ArchivesSpace digital object types
+digital_object_types = ['text', 'still_image', 'moving_image', 'sound_recording', 'mixed_materials', None]
+
+# default page size of paged lists
+default_page_size = 10
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS AND CLASSES (in order of appearance)
+#
+#   mtime(n)                                    returns an ISO timestamp in 2024 for record number n
+#
+#   now()                                       returns the current time as an ISO timestamp
+#
+#   MockRepository(size, seed)                  synthetic repository with size digital objects
+#
+#   MockHandler                                 HTTP request handler for the mock API
+#
+#   start_server(mock, port, latency, error_rate)
+#                                               starts the mock server in a background thread
+#
+#   main()                                      runs the mock server from the command line
+#-----------------------------------------------------------------------#
+
+# returns an ISO timestamp in 2024 for record number n
+def mtime(n):
+    return datetime.fromtimestamp(1704067200 + (n * 7919) % 31536000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# returns the current time as an ISO timestamp
+def now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+#-----------------------------------------------------------------------#
+
+# synthetic repository with size digital objects
+# only the structure (links between records) is kept; records are generated by record()
+class MockRepository:
+
+    def __init__(self, size=1000, seed=1):
+
+        self.size = size
+        self.seed = seed
+
+        # fields of edited records {(category, id): {field: value}}, and deleted records {(category, id)}
+        self.edits = dict()
+        self.deleted = set()
+
+        rnd = random.Random(seed)
+
+        resources = max(1, size // digital_objects_per_resource)
+
+        # archival objects: {id: (resource, parent ao or None, level)}
+        self.archival_objects = dict()
+        # digital objects: {id: ao}
+        self.digital_objects = dict()
+        # tree of each resource: {resource: [(ao, depth)]}
+        self.trees = {r: list() for r in range(1, resources + 1)}
+
+        ao_id, do_id = 1, 1
+        series = dict()
+
+        # series
+        for r in range(1, resources + 1):
+            series[r] = list()
+            for s in range(series_per_resource):
+                self.archival_objects[ao_id] = (r, None, 'series')
+                series[r].append(ao_id)
+                ao_id += 1
+
+        # files, in resources round robin, until there are size digital objects
+        files = {r: {s: list() for s in series[r]} for r in series}
+        n = 0
+        while do_id <= size:
+            r = n % resources + 1
+            s = series[r][(n // resources) % series_per_resource]
+            self.archival_objects[ao_id] = (r, s, 'file')
+            files[r][s].append(ao_id)
+            # a quarter of files have no digital objects, some have two
+            if rnd.random() >= 0.25:
+                for k in range(2 if rnd.random() < 0.1 else 1):
+                    if do_id <= size:
+                        self.digital_objects[do_id] = ao_id
+                        do_id += 1
+            ao_id += 1
+            n += 1
+
+        for r in series:
+            for s in series[r]:
+                self.trees[r].append((s, 1))
+                self.trees[r].extend((f, 2) for f in files[r][s])
+
+    # edits a record: fields replace the fields of the generated record, and system_mtime is set
+    # to the current time
+    def edit(self, category, id, **fields):
+        self.edits.setdefault((category, id), dict()).update(fields, system_mtime=now())
+
+    # deletes a record
+    def delete(self, category, id):
+        self.deleted.add((category, id))
+
+    # returns ids of records of a type
+    def ids(self, category):
+
+        if category == 'digital_objects':
+            ids = list(self.digital_objects)
+        elif category == 'archival_objects':
+            ids = list(self.archival_objects)
+        elif category == 'resources':
+            ids = list(self.trees)
+        elif category == 'accessions':
+            ids = list(range(1, accession_count + 1))
+        else:
+            ids = list()
+
+        return [id for id in ids if (category, id) not in self.deleted]
+
+    # returns record of a type and id, with edits, or None if not found or deleted
+    def record(self, category, id):
+
+        if (category, id) in self.deleted:
+            return None
+
+        obj = self.generate(category, id)
+        if obj is not None and (category, id) in self.edits:
+            obj.update(self.edits[(category, id)])
+
+        return obj
+
+    # returns generated record of a type and id, or None if not found
+    def generate(self, category, id):
+
+        rnd = random.Random(self.seed * 1000003 + id * 31 + len(category))
+
+        if category == 'digital_objects' and id in self.digital_objects:
+            ao = self.digital_objects[id]
+            r = self.archival_objects[ao][0]
+            collections = [{'ref': repository + '/resources/' + str(r)}]
+            if id % 50 == 0:
+                collections.append({'ref': repository + '/accessions/' + str(id % accession_count + 1)})
+            host = file_hosts[id % len(file_hosts)]
+            file_versions = [{'file_uri': host + '/item/' + str(id),
+                              'publish': True,
+                              'use_statement': rnd.choice(['Web-Access', 'Web-Access', 'Persistent-URL'])}]
+            return {'uri': repository + '/digital_objects/' + str(id),
+                    'jsonmodel_type': 'digital_object',
+                    'title': 'Digital object ' + str(id),
+                    'publish': id % 20 != 0,
+                    'suppressed': False,
+                    'digital_object_type': digital_object_types[id % len(digital_object_types)],
+                    'collection': collections,
+                    'linked_instances': [{'ref': repository + '/archival_objects/' + str(ao)}],
+                    'file_versions': file_versions,
+                    'representative_file_version': file_versions[0] if id % 3 == 0 else None,
+                    'lock_version': 0,
+                    'system_mtime': mtime(id)}
+
+        if category == 'archival_objects' and id in self.archival_objects:
+            r, parent, level = self.archival_objects[id]
+            ancestors = list()
+            if parent:
+                ancestors.append({'ref': repository + '/archival_objects/' + str(parent), 'level': 'series'})
+            ancestors.append({'ref': repository + '/resources/' + str(r), 'level': 'collection'})
+            notes = [{'type': 'scopecontent', 'publish': True, 'jsonmodel_type': 'note_multipart',
+                      'subnotes': [{'content': 'Scope and content of ' + level + ' ' + str(id) + '.' + ' Description.' * rnd.randint(1, 20)}]}]
+            if level == 'series' and id % 2 == 0:
+                notes.append({'type': 'userestrict', 'publish': True, 'jsonmodel_type': 'note_singlepart',
+                              'content': ['Series rights statement ' + str(id)]})
+            return {'uri': repository + '/archival_objects/' + str(id),
+                    'jsonmodel_type': 'archival_object',
+                    'title': level.title() + ' ' + str(id),
+                    'level': level,
+                    'component_id': 'C' + str(id),
+                    'resource': {'ref': repository + '/resources/' + str(r)},
+                    'ancestors': ancestors,
+                    'dates': [{'expression': str(1900 + id % 100), 'begin': str(1900 + id % 100),
+                               'date_type': 'single', 'label': 'creation'}],
+                    'extents': [{'number': '1', 'extent_type': 'folder', 'physical_details': ''}],
+                    'notes': notes,
+                    'linked_agents': [{'role': 'creator', 'relator': 'aut',
+                                       'ref': '/agents/people/' + str(id % agent_count + 1)},
+                                      {'role': 'subject',
+                                       'ref': '/agents/people/' + str((id + 7) % agent_count + 1)}],
+                    'subjects': [{'ref': '/subjects/' + str(id % subject_count + 1)}],
+                    'instances': [],
+                    'create_time': mtime(id),
+                    'user_mtime': mtime(id),
+                    'lock_version': 1,
+                    'system_mtime': mtime(id)}
+
+        if category == 'resources' and id in self.trees:
+            notes = [{'type': 'abstract', 'publish': True, 'jsonmodel_type': 'note_singlepart',
+                      'content': ['Abstract of collection ' + str(id)]}]
+            if id % 2:
+                notes.append({'type': 'userestrict', 'publish': True, 'jsonmodel_type': 'note_multipart',
+                              'subnotes': [{'content': 'Collection rights statement ' + str(id)}]})
+            return {'uri': repository + '/resources/' + str(id),
+                    'jsonmodel_type': 'resource',
+                    'title': 'Collection ' + str(id),
+                    'level': 'collection',
+                    'notes': notes,
+                    'lock_version': 1,
+                    'system_mtime': mtime(id)}
+
+        if category == 'accessions' and 1 <= id <= accession_count:
+            return {'uri': repository + '/accessions/' + str(id),
+                    'jsonmodel_type': 'accession',
+                    'title': 'Accession ' + str(id),
+                    'notes': [],
+                    'lock_version': 1,
+                    'system_mtime': mtime(id)}
+
+        if category == 'people' and 1 <= id <= agent_count:
+            return {'uri': '/agents/people/' + str(id), 'jsonmodel_type': 'agent_person',
+                    'title': 'Person ' + str(id), 'lock_version': 1, 'system_mtime': mtime(id)}
+
+        if category == 'subjects' and 1 <= id <= subject_count:
+            return {'uri': '/subjects/' + str(id), 'jsonmodel_type': 'subject', 'source': 'lcsh',
+                    'title': 'Subject ' + str(id), 'lock_version': 1, 'system_mtime': mtime(id)}
+
+        return None
+
+    # returns record for an API path (e.g. '/agents/people/1'), or None if not found
+    def record_for_path(self, path):
+
+        parts = path.strip('/').split('/')
+        if len(parts) < 2 or not parts[-1].isdigit():
+            return None
+
+        return self.record(parts[-2], int(parts[-1]))
+
+    # adds resolved records (_resolved) to a record
+    def resolve(self, obj, resolve):
+
+        refs = list()
+        if 'ancestors' in resolve:
+            refs.extend(obj.get('ancestors', []))
+        if 'linked_agents' in resolve:
+            refs.extend(obj.get('linked_agents', []))
+        if 'subjects' in resolve:
+            refs.extend(obj.get('subjects', []))
+
+        for ref in refs:
+            resolved = self.record_for_path(ref['ref'])
+            if resolved:
+                ref['_resolved'] = resolved
+
+        if 'repository' in resolve:
+            obj['repository'] = {'ref': repository, '_resolved': {'uri': repository, 'name': 'Mock Archives'}}
+
+        return obj
+
+    # returns the ordered_records tree of a resource
+    def ordered_records(self, r):
+
+        uris = [{'ref': repository + '/resources/' + str(r), 'level': 'collection', 'depth': 0,
+                 'display_string': 'Collection ' + str(r)}]
+        for ao, depth in self.trees[r]:
+            uris.append({'ref': repository + '/archival_objects/' + str(ao),
+                         'level': self.archival_objects[ao][2], 'depth': depth,
+                         'display_string': self.archival_objects[ao][2].title() + ' ' + str(ao)})
+
+        return {'uris': uris}
+
+    # handles a GET request, returns (status, response object)
+    def get(self, path, query):
+
+        resolve = [v for k, v in query if k in ('resolve[]', 'resolve')]
+        params = dict(query)
+
+        if path.rstrip('/') == repository:
+            return 200, {'uri': repository, 'name': 'Mock Archives', 'lock_version': 1}
+
+        parts = path.strip('/').split('/')
+
+        # collection tree
+        if parts[-1] == 'ordered_records' and len(parts) == 5 and parts[3].isdigit():
+            r = int(parts[3])
+            if r in self.trees:
+                return 200, self.ordered_records(r)
+            return 404, {'error': 'Resource not found'}
+
+        # single record
+        obj = self.record_for_path(path)
+        if obj is not None:
+            return 200, self.resolve(obj, resolve)
+        if parts[-1].isdigit():
+            return 404, {'error': 'Record not found'}
+
+        # list
+        category = parts[-1]
+        ids = self.ids(category)
+
+        if 'modified_since' in params:
+            since = int(params['modified_since'])
+            ids = [id for id in ids
+                   if datetime.fromisoformat(self.record(category, id)['system_mtime'].replace('Z', '+00:00')).timestamp() >= since]
+
+        if params.get('all_ids') in ('true', 'True', '1'):
+            return 200, ids
+
+        id_set = [int(v) for k, v in query if k in ('id_set[]', 'id_set') and v.isdigit()]
+        if id_set:
+            records = [self.record(category, id) for id in id_set]
+            return 200, [self.resolve(obj, resolve) for obj in records if obj is not None]
+
+        if 'page' in params:
+            page = int(params['page'])
+            page_size = int(params.get('page_size', default_page_size))
+            last_page = max(1, (len(ids) + page_size - 1) // page_size)
+            results = [self.resolve(self.record(category, id), resolve)
+                           for id in ids[(page - 1) * page_size:page * page_size]]
+            return 200, {'first_page': 1, 'last_page': last_page, 'this_page': page,
+                         'total': len(ids), 'results': results}
+
+        return 400, {'error': 'page, all_ids or id_set[] is required'}
+
+
+#-----------------------------------------------------------------------#
+
+# HTTP request handler for the mock API
+# the server sets mock (MockRepository), latency (seconds added to each request) and
+# error_rate (fraction of GET requests that fail with 503 Service Unavailable)
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately; without this, keep-alive requests wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        return
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if '/login' in self.path:
+            self.send_json(200, {'session': 'mock-session-token'})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.send_json(503, {'error': 'Service Unavailable'})
+            return
+        parts = urlsplit(self.path)
+        status, obj = self.server.mock.get(parts.path, parse_qsl(parts.query))
+        self.send_json(status, obj)
+
+
+#-----------------------------------------------------------------------#
+
+# starts the mock server in a background thread
+# port 0 picks a free port; returns the server (server.server_port, server.shutdown())
+def start_server(mock, port=0, latency=0, error_rate=0):
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    server.latency = latency
+    server.error_rate = error_rate
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+#-----------------------------------------------------------------------#
+
+# runs the mock server from the command line
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', default=1000, type=int)
+    parser.add_argument('-p', '--port', default=8089, type=int)
+    parser.add_argument('-l', '--latency', default=0, type=float)
+    parser.add_argument('-e', '--error-rate', default=0, type=float)
+    parser.add_argument('--seed', default=1, type=int)
+    args = parser.parse_args(argv)
+
+    print('Generating repository with', args.size, 'digital objects...')
+    mock = MockRepository(args.size, args.seed)
+    print(len(mock.trees), 'resources,', len(mock.archival_objects), 'archival objects')
+
+    server = start_server(mock, args.port, args.latency, args.error_rate)
+    print('Mock ArchivesSpace API at http://127.0.0.1:' + str(server.server_port))
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+#-----------------------------------------------------------------------#
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# regression.py
+#
+# Regression check of buildxml.py against the local mock ArchivesSpace server (mockas.py)
+#
+# Builds run in temporary folders, as in benchmark.py. A full build with the default options is the
+# reference; each other build mode must give the same records (compared by identifier, after removing
+# whitespace), the same duplicates.txt (sorted) and the same collection statistics and earliest date
+# in the database:
+#   - a rerun with the response and fragment caches of the reference build
+#   - fresh builds with each option set in build_modes (concurrent, batched, tree, sharded, async, no cache)
+#   - a build killed after its first checkpoint, then run again with --resume
+# Records of the mock repository are then edited and deleted (edit_repository()), and a fresh full build
+# is compared with an incremental build (-i) and a --no-cache rebuild in the folder of the reference build.
+# Prints each comparison and exits with status 1 if any build differs.
+#
+# usage: python regression.py [-s SIZE] [-l LATENCY] [-k]
+
+import sys
+import json
+import time
+import signal
+import shutil
+import sqlite3 as sq
+import argparse
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from mockas import MockRepository, start_server
+from benchmark import create_benchmark_folder
+
+#-----------------------------------------------------------------------#
+# GLOBAL CONFIGURATION VARAIBLES
+
+# default repository size (number of digital objects)
+default_size = 1000
+
+# options of the builds compared with the reference build (fresh folders)
+build_modes = [['-w', '8', '-b', '50'],
+               ['-t'],
+               ['-s', '3'],
+               ['--backend', 'async'],
+               ['--no-cache']]
+
+# latency of the mock server during the build that is killed (seconds), so it can be killed
+# before it completes
+resume_latency = 0.005
+
+# OAI namespace of staticrepo.xml
+oai_ns = '{http://www.openarchives.org/OAI/2.0/}'
+
+#-----------------------------------------------------------------------#
+# FUNCTIONS (in order of appearance)
+#
+#   run_build(folder, options)                  runs buildxml.py in folder, raises RuntimeError if it fails
+#
+#   run_killed_build(folder, options)           runs buildxml.py in folder and kills it after its first checkpoint
+#
+#   read_build(folder)                          returns the records, duplicates and database statistics of a build
+#
+#   compare_builds(name, build, reference)      prints the differences between two builds, returns True if equal
+#
+#   edit_repository(mock)                       edits and deletes records of the mock repository
+#
+#   main()                                      runs the regression check from the command line
+#-----------------------------------------------------------------------#
+
+# runs buildxml.py in folder, raises RuntimeError if it fails
+def run_build(folder, options):
+
+    result = subprocess.run([sys.executable, 'buildxml.py'] + options, cwd=folder / 'util',
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    if result.returncode != 0:
+        print(result.stdout)
+        raise RuntimeError('buildxml.py ' + ' '.join(options) + ' failed with exit code ' + str(result.returncode))
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# runs buildxml.py in folder and kills it once its journal has a checkpoint (see buildxml.BuildJournal)
+# returns the number of journaled archival objects; raises RuntimeError if the build completed first
+def run_killed_build(folder, options):
+
+    journal_path = folder / 'xml' / 'buildjournal.db'
+    process = subprocess.Popen([sys.executable, 'buildxml.py'] + options, cwd=folder / 'util',
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    journaled = 0
+    while process.poll() is None and journaled == 0:
+        time.sleep(0.1)
+        if journal_path.exists():
+            try:
+                connection = sq.connect(journal_path)
+                journaled = connection.execute('SELECT count(*) FROM records;').fetchone()[0]
+                connection.close()
+            except sq.OperationalError:
+                pass
+
+    if process.poll() is not None:
+        raise RuntimeError('buildxml.py completed before it could be killed')
+
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+
+    return journaled
+
+
+#-----------------------------------------------------------------------#
+
+# returns the records, duplicates and database statistics of a build in folder
+# records: {identifier: record}, serialized in canonical form without whitespace between elements
+# duplicates: sorted lines of duplicates.txt
+# collections: rows of the collections table (statistics), dates: earliest date
+# report: record counts of the build report (emitted, reused, resumed...), not compared
+def read_build(folder):
+
+    root = ET.parse(folder / 'xml' / 'staticrepo.xml').getroot()
+    records = dict()
+    for record in root.iter(oai_ns + 'record'):
+        identifier = record.find('./' + oai_ns + 'header/' + oai_ns + 'identifier').text
+        records[identifier] = ET.canonicalize(ET.tostring(record, encoding='unicode'), strip_text=True)
+
+    with open(folder / 'xml' / 'duplicates.txt', 'r') as f:
+        duplicates = sorted(f.read().splitlines())
+
+    connection = sq.connect(folder / 'instance' / 'ead2dc.db')
+    collections = connection.execute('SELECT collid, colltitle, aocount, docount, caltechlibrary, internetarchive, \
+                                             youtube, other, type_text, type_stillimage, type_movingimage, \
+                                             type_sound, type_other, last_edit \
+                                      FROM collections ORDER BY collid;').fetchall()
+    dates = connection.execute('SELECT earliest FROM dates;').fetchall()
+    connection.close()
+
+    with open(folder / 'xml' / 'buildreport.json', 'r') as f:
+        report = json.load(f)['records']
+
+    return {'records': records, 'duplicates': duplicates, 'collections': collections, 'dates': dates,
+            'report': report}
+
+
+#-----------------------------------------------------------------------#
+
+# prints the differences between a build and the reference build, returns True if they are the same
+def compare_builds(name, build, reference):
+
+    differences = list()
+
+    missing = reference['records'].keys() - build['records'].keys()
+    extra = build['records'].keys() - reference['records'].keys()
+    changed = [identifier for identifier in reference['records'].keys() & build['records'].keys()
+               if reference['records'][identifier] != build['records'][identifier]]
+    if missing:
+        differences.append(str(len(missing)) + ' records missing, e.g. ' + sorted(missing)[0])
+    if extra:
+        differences.append(str(len(extra)) + ' records added, e.g. ' + sorted(extra)[0])
+    if changed:
+        differences.append(str(len(changed)) + ' records changed, e.g. ' + sorted(changed)[0])
+
+    for part in ['duplicates', 'collections', 'dates']:
+        if build[part] != reference[part]:
+            differences.append(part + ' differ')
+
+    if differences:
+        print('FAIL', name + ':', '; '.join(differences))
+    else:
+        print('OK  ', name + ':', str(len(build['records'])) + ' records' +
+              ''.join(', ' + count + ' ' + str(build['report'][count]) 
+                      for count in ['reused', 'resumed'] if build['report'].get(count)))
+
+    return not differences
+
+
+#-----------------------------------------------------------------------#
+
+# edits and deletes records of the mock repository, as between two nightly builds:
+# an archival object title, the file of a digital object, an unpublished and a deleted digital object,
+# a series rights statement (inherited by its files) and a collection title
+def edit_repository(mock):
+
+    aos = [ao for ao in mock.digital_objects.values()]
+    dos = list(mock.digital_objects)
+    series = [ao for ao, (r, parent, level) in mock.archival_objects.items() if level == 'series']
+
+    mock.edit('archival_objects', aos[0], title='Edited title')
+    mock.edit('digital_objects', dos[1], file_versions=[{'file_uri': 'https://digital.archives.caltech.edu/edited/1',
+                                                         'publish': True, 'use_statement': 'Web-Access'}])
+    mock.edit('digital_objects', dos[2], publish=False)
+    mock.delete('digital_objects', dos[3])
+    mock.edit('archival_objects', series[0],
+              notes=[{'type': 'userestrict', 'publish': True, 'jsonmodel_type': 'note_singlepart',
+                      'content': ['Edited series rights statement']}])
+    mock.edit('resources', 1, title='Edited collection')
+
+    return
+
+
+#-----------------------------------------------------------------------#
+
+# runs the regression check from the command line
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', default=default_size, type=int)
+    parser.add_argument('-l', '--latency', default=0, type=float)
+    parser.add_argument('-k', '--keep', action='store_true')
+    args = parser.parse_args()
+
+    print('Generating repository with', args.size, 'digital objects...')
+    mock = MockRepository(args.size)
+    server = start_server(mock, latency=args.latency)
+    # connections dropped by the killed build are not reported
+    server.handle_error = lambda request, client_address: None
+    baseurl = 'http://127.0.0.1:' + str(server.server_port)
+
+    temp = Path(tempfile.mkdtemp(prefix='ead2dc-regression-'))
+    passed = True
+
+    # creates a build folder in temp
+    def new_folder(name):
+        folder = temp / name
+        create_benchmark_folder(folder, baseurl)
+        return folder
+
+    try:
+
+        print('Running reference build...')
+        reference_folder = new_folder('reference')
+        run_build(reference_folder, [])
+        reference = read_build(reference_folder)
+        print(len(reference['records']), 'records')
+
+        run_build(reference_folder, [])
+        passed &= compare_builds('rerun with caches', read_build(reference_folder), reference)
+
+        for options in build_modes:
+            folder = new_folder('build' + ''.join(options).replace('-', '_'))
+            run_build(folder, options)
+            passed &= compare_builds(' '.join(options), read_build(folder), reference)
+
+        folder = new_folder('resume')
+        server.latency = resume_latency
+        journaled = run_killed_build(folder, [])
+        server.latency = args.latency
+        run_build(folder, ['--resume'])
+        passed &= compare_builds('--resume after kill (' + str(journaled) + ' journaled)',
+                                 read_build(folder), reference)
+
+        # system_mtime of edits is after the start of the reference build (whole seconds)
+        time.sleep(1)
+        edit_repository(mock)
+
+        print('Running reference build of the edited repository...')
+        folder = new_folder('edited')
+        run_build(folder, [])
+        edited = read_build(folder)
+        if edited['records'] == reference['records']:
+            print('FAIL edits: edited repository gives the same records')
+            passed = False
+
+        run_build(reference_folder, ['-i'])
+        passed &= compare_builds('-i after edits', read_build(reference_folder), edited)
+
+        run_build(reference_folder, ['--no-cache'])
+        passed &= compare_builds('--no-cache after edits', read_build(reference_folder), edited)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        if args.keep:
+            print('Build folders kept in', temp)
+        else:
+            shutil.rmtree(temp)
+
+    print('All builds are the same' if passed else 'Builds differ')
+
+    return 0 if passed else 1
+
+
+#-----------------------------------------------------------------------#
+
+
+if __name__ == '__main__':
+    sys.exit(main())